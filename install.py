@@ -113,6 +113,11 @@ def create_applescript_handler(venv_python=None, homebrew_mode=False):
 # Log file for debugging
 LOG_FILE=~/WinmailOpener_log.txt
 
+# Keep the log bounded: start a new one once it grows past 1 MB
+if [ -f "$LOG_FILE" ] && [ "$(wc -c < "$LOG_FILE")" -gt 1048576 ]; then
+    mv -f "$LOG_FILE" "$LOG_FILE.1"
+fi
+
 # Log this execution
 echo "========================================" >> "$LOG_FILE"
 echo "Handler script executed at $(date)" >> "$LOG_FILE"
@@ -0,0 +1,198 @@
+"""
+Benchmark suite for py-winmail-opener.
+
+Generates a synthetic TNEF corpus with the pure-Python TNEFWriter (no external
+tools needed) and measures parse, extract and render throughput together with
+peak memory. Results can be saved as JSON and compared against a previous run
+to track performance across releases:
+
+    python test/benchmark_winmail_opener.py --output bench.json
+    python test/benchmark_winmail_opener.py --compare bench.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+import tnefparse  # noqa: E402
+from tnef_generator import generate_corpus  # noqa: E402
+
+import winmail_opener  # noqa: E402
+
+# Corpus shapes: keyword arguments for generate_corpus
+SCENARIOS = {
+    "many_attachments": {"attachments": 20, "attachment_size": 256 * 1024},
+    "large_rtf": {"attachments": 1, "rtf_size": 2 * 1024 * 1024, "html_size": 0},
+    "large_html": {
+        "attachments": 1,
+        "html_size": 4 * 1024 * 1024,
+        "inline_images": 10,
+    },
+    "non_ascii_names": {"attachments": 10, "non_ascii_names": True},
+}
+
+QUICK_SCENARIOS = {
+    "many_attachments": {"attachments": 5, "attachment_size": 32 * 1024},
+    "large_rtf": {"attachments": 1, "rtf_size": 128 * 1024, "html_size": 0},
+    "large_html": {"attachments": 1, "html_size": 256 * 1024, "inline_images": 2},
+    "non_ascii_names": {"attachments": 3, "non_ascii_names": True},
+}
+
+
+def bench_parse(path):
+    """Read and parse a winmail.dat file"""
+
+    def run():
+        with open(path, "rb") as f:
+            tnefparse.TNEF(f.read())
+
+    return run
+
+
+def bench_render(path):
+    """Render the HTML view for an already parsed message"""
+    with open(path, "rb") as f:
+        tnef = tnefparse.TNEF(f.read())
+
+    def run():
+        winmail_opener.create_html_view(tnef, [])
+
+    return run
+
+
+def bench_extract(path):
+    """Run the full extraction pipeline headless"""
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            winmail_opener.extract_winmail_dat(
+                path, launcher=winmail_opener.NullLauncher()
+            )
+
+    return run
+
+
+OPERATIONS = {
+    "parse": bench_parse,
+    "extract": bench_extract,
+    "render": bench_render,
+}
+
+
+def measure(func, repeat):
+    """Return timing samples for func and the peak traced memory of one run"""
+    func()  # Warm up caches and lazy imports
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return samples, peak
+
+
+def run_benchmarks(scenarios, repeat, work_dir):
+    """Run every operation for every scenario and return the results dict"""
+    results = {}
+    for name, options in scenarios.items():
+        corpus_dir = os.path.join(work_dir, name)
+        (path,) = generate_corpus(corpus_dir, count=1, **options)
+        size = os.path.getsize(path)
+        results[name] = {"file_size": size}
+
+        for operation, factory in OPERATIONS.items():
+            samples, peak = measure(factory(path), repeat)
+            median = statistics.median(samples)
+            results[name][operation] = {
+                "median_s": median,
+                "min_s": min(samples),
+                "throughput_mb_s": (size / (1024 * 1024)) / median if median else 0,
+                "peak_memory_bytes": peak,
+            }
+            print(
+                f"{name:<18} {operation:<8} {median * 1000:9.2f} ms "
+                f"{results[name][operation]['throughput_mb_s']:9.1f} MB/s "
+                f"{peak / (1024 * 1024):8.1f} MB peak"
+            )
+
+    return results
+
+
+def compare_results(current, baseline):
+    """Print the relative change of each median time against a baseline run"""
+    print("\nComparison against baseline (median time, lower is better):")
+    for scenario, operations in current.items():
+        for operation, values in operations.items():
+            if not isinstance(values, dict):
+                continue
+            previous = baseline.get(scenario, {}).get(operation)
+            if not previous:
+                continue
+            ratio = values["median_s"] / previous["median_s"]
+            memory_ratio = values["peak_memory_bytes"] / max(
+                previous["peak_memory_bytes"], 1
+            )
+            print(
+                f"{scenario:<18} {operation:<8} time x{ratio:5.2f}  memory x{memory_ratio:5.2f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark py-winmail-opener.")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per case")
+    parser.add_argument(
+        "--quick", action="store_true", help="Use a small corpus (for CI smoke runs)"
+    )
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Compare against a previous JSON result")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="winmail_bench_")
+    original_home = os.environ.get("HOME")
+    os.environ["HOME"] = work_dir
+    os.makedirs(os.path.join(work_dir, "Downloads"), exist_ok=True)
+    try:
+        results = run_benchmarks(
+            QUICK_SCENARIOS if args.quick else SCENARIOS, args.repeat, work_dir
+        )
+    finally:
+        if original_home:
+            os.environ["HOME"] = original_home
+        shutil.rmtree(work_dir)
+
+    report = {
+        "version": winmail_opener.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(results, json.load(f)["results"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+#!/bin/bash
+
+# Script to run the performance benchmarks for py-winmail-opener
+# Pass --quick for a fast smoke run, --output FILE to save results and
+# --compare FILE to compare against a previous run.
+
+# Check if tnefparse is installed
+python -c "import tnefparse" 2>/dev/null || {
+    echo "Error: tnefparse is not installed. Please install it with 'pip install tnefparse'."
+    exit 1
+}
+
+echo "Running benchmarks..."
+python test/benchmark_winmail_opener.py "$@"
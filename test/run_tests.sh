@@ -2,12 +2,6 @@
 
 # Script to run the automated tests for py-winmail-opener
 
-# Check if mpack is installed
-if ! command -v mpack &> /dev/null; then
-    echo "Error: mpack is not installed. Please install it with 'brew install mpack' on macOS."
-    exit 1
-fi
-
 # Check if beautifulsoup4 is installed
 python -c "import bs4" 2>/dev/null || {
     echo "Error: beautifulsoup4 is not installed. Please install it with 'pip install beautifulsoup4'."
@@ -1,17 +1,33 @@
+import contextlib
+import datetime
 import difflib
 import filecmp
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
 import os
 import shutil
+import struct
 import subprocess
 import sys
+import tarfile
 import tempfile
+import threading
+import time
 import unittest
 import unittest.mock
+import zipfile
 
 from bs4 import BeautifulSoup
 
 # Add parent directory to path to import winmail_opener
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+import tnef_generator
+from tnef_generator import TNEFWriter, compress_rtf
+
 import winmail_opener
 
 
@@ -175,6 +191,48 @@ class WinmailOpenerTests(unittest.TestCase):
             self.assertIn("Test Email with Metadata", content)
             self.assertIn("Mon, 01 Jan 2025 12:00:00 +0000", content)
 
+    def test_mapi_property_decoding(self):
+        """Test decoding message properties from the TNEF property stream"""
+        winmail_path = self.write_winmail(
+            subject="Caf\u00e9 plans",
+            sender=("Alice Example", "alice@example.com"),
+            body="Body",
+            extra_properties=[
+                (tnef_generator.PT_UNICODE, tnef_generator.PR_DISPLAY_TO, "Bob; Carol"),
+                (tnef_generator.PT_UNICODE, tnef_generator.PR_DISPLAY_CC, "Dave"),
+                (tnef_generator.PT_LONG, tnef_generator.PR_IMPORTANCE, 2),
+                (tnef_generator.PT_LONG, tnef_generator.PR_SENSITIVITY, 3),
+                (
+                    tnef_generator.PT_UNICODE,
+                    tnef_generator.PR_TRANSPORT_MESSAGE_HEADERS,
+                    "X-Mailer: Outlook\r\n",
+                ),
+            ],
+        )
+        with open(winmail_path, "rb") as f:
+            tnef = winmail_opener.tnefparse.TNEF(f.read())
+
+        props = winmail_opener.decode_properties(tnef)
+        self.assertIs(winmail_opener.decode_properties(tnef), props)
+        self.assertEqual(
+            [(r.kind, r.name) for r in props.recipients],
+            [("To", "Bob"), ("To", "Carol"), ("CC", "Dave")],
+        )
+        self.assertEqual(props.get("internet_headers"), "X-Mailer: Outlook\r\n")
+        self.assertEqual(
+            winmail_opener.extract_metadata(tnef),
+            {
+                "Subject": "Caf\u00e9 plans",
+                "From": "Alice Example <alice@example.com>",
+                "To": "Bob; Carol",
+                "CC": "Dave",
+                "Date Sent": "2025-01-01 12:00:00",
+                "Importance": "High",
+                "Sensitivity": "Confidential",
+                "Message Class": "IPM.Microsoft Mail.Note",
+            },
+        )
+
     def test_attachments_extraction(self):
         """Test extraction of a winmail.dat file with body, metadata, and attachments"""
         # Create mock attachments
@@ -265,6 +323,1024 @@ class WinmailOpenerTests(unittest.TestCase):
             "Document attachment should be extracted",
         )
 
+    def test_deduplicated_attachment_store(self):
+        """Test that identical attachments are stored once and linked into place"""
+        store_dir = os.path.join(self.output_dir, "store")
+        downloads_dir = os.path.join(self.output_dir, "Downloads")
+        first_path = os.path.join(downloads_dir, "first.txt")
+        second_path = os.path.join(downloads_dir, "second.txt")
+
+        store_path, deduplicated = winmail_opener.store_deduplicated_attachment(
+            self.sample_document_data, store_dir, first_path
+        )
+        self.assertFalse(deduplicated)
+        second_store_path, deduplicated = winmail_opener.store_deduplicated_attachment(
+            self.sample_document_data, store_dir, second_path
+        )
+        self.assertTrue(deduplicated)
+        self.assertEqual(store_path, second_store_path)
+
+        # Exactly one physical object, shared by both logical paths
+        stored_objects = [name for _, _, files in os.walk(store_dir) for name in files]
+        self.assertEqual(len(stored_objects), 1)
+        self.assertTrue(os.path.samefile(first_path, store_path))
+        self.assertTrue(os.path.samefile(second_path, store_path))
+        with open(second_path, "rb") as f:
+            self.assertEqual(f.read(), self.sample_document_data)
+
+    def write_winmail(self, name="winmail.dat", **kwargs):
+        """Write a synthetic winmail.dat file with TNEFWriter and return its path"""
+        path = os.path.join(self.temp_dir, name)
+        return TNEFWriter().write(path, **kwargs)
+
+    def test_generated_winmail_extraction(self):
+        """Test end-to-end extraction of a winmail.dat built by TNEFWriter"""
+        winmail_path = self.write_winmail(
+            subject="Generated message",
+            html_body="<html><body><p>Generated body</p></body></html>",
+            attachments=[
+                {"name": "sample_image.txt", "data": self.sample_image_data},
+                {"name": "sample_document.txt", "data": self.sample_document_data},
+            ],
+        )
+
+        launcher = winmail_opener.CommandLauncher("viewer --new-window")
+        with unittest.mock.patch("winmail_opener.subprocess.Popen") as mock_popen:
+            result = winmail_opener.extract_winmail_dat(winmail_path, launcher=launcher)
+            mock_popen.assert_called_once()
+            self.assertEqual(
+                mock_popen.call_args[0][0],
+                ["viewer", "--new-window", result["html_file"]],
+            )
+
+        self.assertEqual(len(result["attachments"]), 2)
+        self.assertEqual(
+            set(result["timings"]),
+            {"read", "parse", "decode", "write", "render", "launch"},
+        )
+
+        downloads_dir = os.path.join(self.output_dir, "Downloads")
+        self.assertEqual(
+            sorted(os.listdir(downloads_dir)),
+            ["manifest.json", "sample_document.txt", "sample_image.txt"],
+        )
+        with open(os.path.join(downloads_dir, "sample_image.txt"), "rb") as f:
+            self.assertEqual(f.read(), self.sample_image_data)
+
+    def test_launchers(self):
+        """Test headless, custom and unavailable viewer launchers"""
+        self.assertFalse(winmail_opener.get_launcher("none").launch("/tmp/view.html"))
+        with self.assertRaises(ValueError):
+            winmail_opener.get_launcher("firefox")
+
+        launcher = winmail_opener.get_launcher(command="viewer {} --wait=no")
+        with unittest.mock.patch("winmail_opener.subprocess.Popen") as mock_popen:
+            self.assertTrue(launcher.launch("/tmp/view.html"))
+        self.assertEqual(
+            mock_popen.call_args[0][0], ["viewer", "/tmp/view.html", "--wait=no"]
+        )
+
+        # A missing viewer binary is reported, not raised
+        missing = winmail_opener.CommandLauncher(["no-such-viewer-binary"])
+        self.assertFalse(missing.launch("/tmp/view.html"))
+
+    def test_batch_index(self):
+        """Test that a batch writes one index page and launches a viewer once"""
+        first = self.write_winmail(
+            "first.dat",
+            subject="Quarterly <report>",
+            attachments=[{"name": "q1.txt", "data": b"q1"}],
+        )
+        second = self.write_winmail("second.dat", subject="Second message")
+        missing = os.path.join(self.temp_dir, "missing.dat")
+        batch_dir = os.path.join(self.output_dir, "batch")
+
+        argv = ["winmail_opener.py", first, second, missing, "--launch-command", "v"]
+        with unittest.mock.patch.object(sys, "argv", argv), unittest.mock.patch(
+            "winmail_opener.tempfile.mkdtemp", return_value=batch_dir
+        ), unittest.mock.patch("winmail_opener.subprocess.Popen") as mock_popen:
+            try:
+                winmail_opener.main()
+            finally:
+                winmail_opener.shutdown_logging()
+
+        index_path = os.path.join(batch_dir, "index.html")
+        mock_popen.assert_called_once()
+        self.assertEqual(mock_popen.call_args[0][0], ["v", index_path])
+        self.assertTrue(os.path.isfile(os.path.join(batch_dir, "0001_first.html")))
+        self.assertTrue(os.path.isfile(os.path.join(batch_dir, "0002_second.html")))
+
+        with open(index_path, encoding="utf-8") as f:
+            index_html = f.read()
+        self.assertIn('href="0001_first.html"', index_html)
+        self.assertIn('href="0002_second.html"', index_html)
+        self.assertIn("Quarterly &lt;report&gt;", index_html)
+        self.assertIn("Second message", index_html)
+        self.assertIn("3 messages, 1 failed", index_html)
+
+    def test_archive_output(self):
+        """Test streaming attachments and the view into zip and tar archives"""
+        winmail_path = self.write_winmail(
+            "archived.dat",
+            attachments=[
+                {"name": "sample_image.txt", "data": self.sample_image_data},
+                {"name": "notes 1.txt", "data": b"notes"},
+            ],
+        )
+        launcher = winmail_opener.NullLauncher()
+        downloads_dir = os.path.join(self.output_dir, "Downloads")
+
+        result = winmail_opener.extract_winmail_dat(
+            winmail_path, launcher=launcher, archive="zip"
+        )
+        self.assertEqual(
+            result["html_file"], os.path.join(downloads_dir, "archived.zip")
+        )
+        with zipfile.ZipFile(result["html_file"]) as archive:
+            self.assertEqual(
+                archive.namelist(),
+                [
+                    "sample_image.txt",
+                    "notes 1.txt",
+                    "manifest.json",
+                    "winmail_view.html",
+                ],
+            )
+            self.assertEqual(archive.read("sample_image.txt"), self.sample_image_data)
+            view = archive.read("winmail_view.html").decode("utf-8")
+        self.assertIn('href="notes%201.txt"', view)
+
+        result = winmail_opener.extract_winmail_dat(
+            winmail_path, launcher=launcher, archive="tar"
+        )
+        with tarfile.open(result["html_file"]) as archive:
+            self.assertEqual(archive.extractfile("notes 1.txt").read(), b"notes")
+            self.assertIn(b"<html>", archive.extractfile("winmail_view.html").read())
+
+        # No loose attachment files are written
+        self.assertEqual(
+            sorted(os.listdir(downloads_dir)), ["archived.tar", "archived.zip"]
+        )
+
+    def test_in_memory_and_stdin_input(self):
+        """Test extracting from bytes, file objects and standard input"""
+        winmail_path = self.write_winmail(
+            html_body="<p>Piped body</p>",
+            attachments=[{"name": "piped.txt", "data": b"piped"}],
+        )
+        with open(winmail_path, "rb") as f:
+            winmail_data = f.read()
+        launcher = winmail_opener.NullLauncher()
+
+        result = winmail_opener.extract_winmail_dat(winmail_data, launcher=launcher)
+        self.assertEqual(result["file"], "<bytes>")
+        self.assertEqual(result["attachments"][0]["size"], 5)
+
+        result = winmail_opener.extract_winmail_dat(
+            io.BytesIO(winmail_data), launcher=launcher
+        )
+        self.assertEqual(len(result["attachments"]), 1)
+        self.assertEqual(winmail_opener.preview(winmail_data), "Piped body")
+
+        script_path = os.path.join(os.path.dirname(__file__), "..", "winmail_opener.py")
+        completed = subprocess.run(
+            [sys.executable, script_path, "-", "--preview"],
+            input=winmail_data,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self.assertEqual(completed.stdout.decode().strip(), "Piped body")
+
+    def test_meeting_request_calendar(self):
+        """Test exporting a meeting request to an .ics file and a combined calendar"""
+        appointment = winmail_opener.PSETID_APPOINTMENT
+        utc = datetime.timezone.utc
+        deleted_day = datetime.datetime(2025, 3, 12) - datetime.datetime(1601, 1, 1)
+        recurrence = struct.pack(
+            "<HHHHHIIIIIIIIIIII",
+            0x3004, 0x3004, 0x200B, 0x0001, 0, 0, 1, 0,
+            0x02 | 0x08,  # Monday and Wednesday
+            0x2022, 10, 0,  # Ends after 10 occurrences
+            1, int(deleted_day.total_seconds() // 60), 0, 0, 0,
+        )  # fmt: skip
+        winmail_path = self.write_winmail(
+            subject="Project sync",
+            sender=("Alice Example", "alice@example.com"),
+            body="Weekly status, agenda; notes",
+            message_class="IPM.Microsoft Schedule.MtgReq",
+            extra_properties=[
+                (
+                    tnef_generator.PT_SYSTIME,
+                    (appointment, 0x820D),
+                    datetime.datetime(2025, 3, 3, 15, tzinfo=utc),
+                ),
+                (
+                    tnef_generator.PT_SYSTIME,
+                    (appointment, 0x820E),
+                    datetime.datetime(2025, 3, 3, 16, tzinfo=utc),
+                ),
+                (tnef_generator.PT_UNICODE, (appointment, 0x8208), "Room 4"),
+                (
+                    tnef_generator.PT_UNICODE,
+                    (appointment, 0x823B),
+                    'Bob "B"\r\nX-EVIL:1; carol@example.com',
+                ),
+                (tnef_generator.PT_BINARY, (appointment, 0x8216), recurrence),
+            ],
+        )
+
+        calendar_file = io.StringIO()
+        calendar = winmail_opener.CalendarWriter(calendar_file)
+        result = winmail_opener.extract_winmail_dat(
+            winmail_path, launcher=winmail_opener.NullLauncher(), calendar=calendar
+        )
+        calendar.close()
+
+        (ics,) = [a for a in result["attachments"] if a["name"] == "Project sync.ics"]
+        with open(ics["path"], encoding="utf-8", newline="") as f:
+            ics_content = f.read()
+        for line in (
+            "BEGIN:VEVENT",
+            "DTSTART:20250303T150000Z",
+            "DTEND:20250303T160000Z",
+            "SUMMARY:Project sync",
+            "LOCATION:Room 4",
+            "RRULE:FREQ=WEEKLY;BYDAY=MO,WE;COUNT=10",
+            "EXDATE:20250312T150000Z",
+            'ORGANIZER;CN="Alice Example":mailto:alice@example.com',
+            # Quotes and line breaks cannot end the quoted CN parameter
+            "ATTENDEE;CN=\"Bob 'B'X-EVIL:1\";ROLE=REQ-PARTICIPANT:invalid:nomail",
+            "DESCRIPTION:Weekly status\\, agenda\\; notes",
+        ):
+            self.assertIn(line + "\r\n", ics_content)
+
+        # The batch calendar got the same event, wrapped in one VCALENDAR
+        self.assertEqual(calendar.count, 1)
+        self.assertTrue(calendar_file.getvalue().endswith("END:VCALENDAR\r\n"))
+        self.assertIn("SUMMARY:Project sync", calendar_file.getvalue())
+        self.assertEqual(result["metadata"]["Location"], "Room 4")
+
+    def test_contact_and_task_export(self):
+        """Test exporting contact items to vCard/JSON and tasks to JSON"""
+        address = winmail_opener.PSETID_ADDRESS
+        task = winmail_opener.PSETID_TASK
+        launcher = winmail_opener.NullLauncher()
+        contact_path = self.write_winmail(
+            "contact.dat",
+            subject="Jane Doe",
+            message_class="IPM.Contact",
+            body="Met at the conference",
+            extra_properties=[
+                (tnef_generator.PT_UNICODE, 0x3001, "Jane Doe"),
+                (tnef_generator.PT_UNICODE, 0x3A06, "Jane"),
+                (tnef_generator.PT_UNICODE, 0x3A11, "Doe"),
+                (tnef_generator.PT_UNICODE, 0x3A16, "Example, Inc."),
+                (tnef_generator.PT_UNICODE, 0x3A1C, "+1 555 0100"),
+                (tnef_generator.PT_UNICODE, 0x3A27, "Springfield"),
+                (tnef_generator.PT_UNICODE, (address, 0x8083), "jane@example.com"),
+            ],
+        )
+        result = winmail_opener.extract_winmail_dat(contact_path, launcher=launcher)
+        exports = {a["name"]: a["path"] for a in result["attachments"]}
+        self.assertEqual(sorted(exports), ["Jane Doe.json", "Jane Doe.vcf"])
+
+        with open(exports["Jane Doe.vcf"], encoding="utf-8", newline="") as f:
+            vcard = f.read()
+        for line in (
+            "BEGIN:VCARD",
+            "VERSION:4.0",
+            "FN:Jane Doe",
+            "N:Doe;Jane;;;",
+            "ORG:Example\\, Inc.;",
+            "EMAIL:jane@example.com",
+            'TEL;VALUE=text;TYPE="cell":+1 555 0100',
+            "ADR;TYPE=work:;;;Springfield;;;",
+            "NOTE:Met at the conference",
+        ):
+            self.assertIn(line + "\r\n", vcard)
+
+        with open(exports["Jane Doe.json"], encoding="utf-8") as f:
+            contact = json.load(f)
+        self.assertEqual(contact["type"], "contact")
+        self.assertEqual(contact["email"], "jane@example.com")
+        self.assertEqual(contact["company"], "Example, Inc.")
+
+        task_path = self.write_winmail(
+            "task.dat",
+            subject="File expenses",
+            message_class="IPM.Task",
+            extra_properties=[
+                (tnef_generator.PT_LONG, (task, 0x8101), 1),
+                (
+                    tnef_generator.PT_SYSTIME,
+                    (task, 0x8105),
+                    datetime.datetime(2025, 4, 1, tzinfo=datetime.timezone.utc),
+                ),
+            ],
+        )
+        result = winmail_opener.extract_winmail_dat(task_path, launcher=launcher)
+        (export,) = result["attachments"]
+        with open(export["path"], encoding="utf-8") as f:
+            self.assertEqual(
+                json.load(f),
+                {
+                    "type": "task",
+                    "subject": "File expenses",
+                    "task_status": "In Progress",
+                    "due_date": "2025-04-01T00:00:00",
+                },
+            )
+
+    def test_attachment_content_sniffing(self):
+        """Test fixing missing, truncated and wrong extensions from magic bytes"""
+        png = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+        winmail_path = self.write_winmail(
+            attachments=[
+                {"name": "IMAGE001", "data": png},
+                {"name": "REPORT~1.DOC", "data": b"PK\x03\x04" + b"\x00" * 64},
+                {"name": "notes.txt", "data": b"BM is not a bitmap here"},
+                {"name": "invoice.txt", "data": b"%PDF-1.7\n"},
+            ]
+        )
+        result = winmail_opener.extract_winmail_dat(
+            winmail_path, launcher=winmail_opener.NullLauncher()
+        )
+        self.assertEqual(
+            [
+                (a["name"], a["mime_type"], a["extension"])
+                for a in result["attachments"]
+            ],
+            [
+                ("IMAGE001.png", "image/png", ".png"),
+                (
+                    "REPORT~1.docx",
+                    "application/vnd.openxmlformats-officedocument."
+                    "wordprocessingml.document",
+                    ".docx",
+                ),
+                ("notes.txt", "text/plain", ".txt"),
+                ("invoice.txt.pdf", "application/pdf", ".pdf"),
+            ],
+        )
+        with open(
+            os.path.join(self.output_dir, "Downloads", "IMAGE001.png"), "rb"
+        ) as f:
+            self.assertEqual(f.read(), png)
+
+    def test_attachment_sniffing_keeps_container_formats(self):
+        """Test keeping specific extensions of formats built on zip, PDF or MP4"""
+        zip_data = b"PK\x03\x04" + b"\x00" * 64
+        cases = [
+            ("Budget.xlsm", zip_data, "Budget.xlsm"),
+            ("Letter.docm", zip_data, "Letter.docm"),
+            ("Slides.ppsx", zip_data, "Slides.ppsx"),
+            ("Places.kmz", zip_data, "Places.kmz"),
+            ("logo.ai", b"%PDF-1.5\n", "logo.ai"),
+            ("photo.avif", b"\x00\x00\x00\x1cftypavif", "photo.avif"),
+            ("song.m4a", b"\x00\x00\x00\x1cftypmp42", "song.m4a"),
+            ("icon.svg", b"<?xml version='1.0'?><svg/>", "icon.svg"),
+            ("memo.doc", b"{\\rtf1\\ansi}", "memo.doc"),
+            # A different family still gets the sniffed extension
+            ("photo.jpg", zip_data, "photo.jpg.zip"),
+            ("song.txt", b"\x00\x00\x00\x1cftypmp42", "song.txt.mp4"),
+        ]
+        for name, data, expected in cases:
+            with self.subTest(name=name):
+                self.assertEqual(
+                    winmail_opener.fix_attachment_name(name, data)[0], expected
+                )
+        self.assertEqual(
+            winmail_opener.fix_attachment_name("Budget.xlsm", zip_data)[1],
+            "application/vnd.ms-excel.sheet.macroEnabled.12",
+        )
+
+    def test_long_attachment_names(self):
+        """Test preferring long file names and MIME tags from the property table"""
+        decomposed = "Re\u0301sume\u0301 final.pdf"
+        winmail_path = self.write_winmail(
+            attachments=[
+                {
+                    "name": "RESUME~1.PDF",
+                    "long_name": decomposed,
+                    "data": b"%PDF-1.4\n",
+                },
+                {
+                    "name": "DATA~1",
+                    "mime_type": "text/csv",
+                    "data": b"a,b\n1,2\n",
+                },
+                {"name": "../escape.txt", "data": b"contained"},
+            ]
+        )
+        result = winmail_opener.extract_winmail_dat(
+            winmail_path, launcher=winmail_opener.NullLauncher()
+        )
+        self.assertEqual(
+            [(a["name"], a["mime_type"]) for a in result["attachments"]],
+            [
+                ("R\u00e9sum\u00e9 final.pdf", "application/pdf"),
+                ("DATA~1.csv", "text/csv"),
+                ("escape.txt", "text/plain"),
+            ],
+        )
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.output_dir, "Downloads"))),
+            ["DATA~1.csv", "R\u00e9sum\u00e9 final.pdf", "escape.txt", "manifest.json"],
+        )
+
+    def test_attachment_filters(self):
+        """Test that filtered attachments are neither decoded nor written"""
+        self.assertEqual(winmail_opener.parse_size("1.5K"), 1536)
+        self.assertEqual(winmail_opener.parse_size("2m"), 2 * 1024 * 1024)
+        with self.assertRaises(ValueError):
+            winmail_opener.parse_size("lots")
+
+        winmail_path = self.write_winmail(
+            attachments=[
+                {"name": "report.pdf", "data": b"%PDF-1.4\n" + b"x" * 2048},
+                {"name": "logo", "data": b"\x89PNG\r\n\x1a\n" + b"x" * 256},
+                {"name": "notes.txt", "data": b"notes" * 100},
+                {
+                    "name": "TINYSU~1.PDF",
+                    "long_name": "tiny summary.pdf",
+                    "data": b"%PDF-1.4\n",
+                },
+            ]
+        )
+        attachment_filter = winmail_opener.AttachmentFilter(
+            include=["*.PDF", "image/*"], exclude=["logo*"], min_size=100
+        )
+        skipped = winmail_opener.METRICS.get("winmail_opener_attachments_skipped_total")
+        with unittest.mock.patch(
+            "winmail_opener.index_attachment_properties",
+            wraps=winmail_opener.index_attachment_properties,
+        ) as index_properties:
+            result = winmail_opener.extract_winmail_dat(
+                winmail_path,
+                launcher=winmail_opener.NullLauncher(),
+                attachment_filter=attachment_filter,
+            )
+
+        self.assertEqual(index_properties.call_count, 4)
+        self.assertEqual([a["name"] for a in result["attachments"]], ["report.pdf"])
+        self.assertEqual(
+            result["skipped_attachments"],
+            ["logo.png", "notes.txt", "tiny summary.pdf"],
+        )
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.output_dir, "Downloads"))),
+            ["manifest.json", "report.pdf"],
+        )
+        self.assertEqual(
+            winmail_opener.METRICS.get("winmail_opener_attachments_skipped_total"),
+            skipped + 3,
+        )
+
+    def test_checksum_manifest(self):
+        """Test SHA-256 checksums computed while writing attachments"""
+        large = os.urandom(winmail_opener.HASH_CHUNK_SIZE * 2 + 17)
+        winmail_path = self.write_winmail(
+            "hashed.dat",
+            attachments=[
+                {"name": "large.bin", "data": large},
+                {"name": "notes.txt", "data": b"notes"},
+            ],
+        )
+        launcher = winmail_opener.NullLauncher()
+        result = winmail_opener.extract_winmail_dat(winmail_path, launcher=launcher)
+
+        expected = {
+            "large.bin": hashlib.sha256(large).hexdigest(),
+            "notes.txt": hashlib.sha256(b"notes").hexdigest(),
+        }
+        self.assertEqual(
+            {entry["name"]: entry["sha256"] for entry in result["manifest"]}, expected
+        )
+        self.assertEqual(result["manifest"][1]["size"], 5)
+        self.assertEqual(result["manifest"][1]["mime_type"], "text/plain")
+        with open(result["manifest_file"], encoding="utf-8") as f:
+            manifest = json.load(f)
+        self.assertEqual(
+            {entry["name"]: entry["sha256"] for entry in manifest["files"]}, expected
+        )
+        self.assertEqual(manifest["files"][0]["source"], winmail_path)
+
+        # Archives carry their own manifest, hashed through the tar stream
+        result = winmail_opener.extract_winmail_dat(
+            winmail_path, launcher=launcher, archive="tar"
+        )
+        with tarfile.open(result["html_file"]) as archive:
+            manifest = json.load(archive.extractfile("manifest.json"))
+        self.assertEqual(
+            {entry["name"]: entry["sha256"] for entry in manifest["files"]}, expected
+        )
+
+    def test_attachment_writer_pool(self):
+        """Test background writes keep per-path order and surface failures"""
+        written = []
+        with winmail_opener.AttachmentWriterPool(workers=3, max_pending=1) as pool:
+            for value in range(20):
+                pool.submit(f"path{value % 2}", written.append, (value % 2, value))
+        for key in (0, 1):
+            values = [value for k, value in written if k == key]
+            self.assertEqual(values, sorted(values))
+        self.assertEqual(len(written), 20)
+
+        def fail():
+            raise OSError("disk full")
+
+        pool = winmail_opener.AttachmentWriterPool(workers=2)
+        pool.submit("a", fail)
+        with self.assertRaises(OSError):
+            pool.close()
+        self.assertEqual(pool.threads, [])
+
+        # Without spare cores the writes run inline
+        with winmail_opener.AttachmentWriterPool(workers=0) as pool:
+            pool.submit("a", written.append, "inline")
+            self.assertEqual(written[-1], "inline")
+
+        # A failed write fails the message instead of producing a partial manifest
+        winmail_path = self.write_winmail(
+            attachments=[{"name": "notes.txt", "data": b"notes"}]
+        )
+        with unittest.mock.patch(
+            "winmail_opener.write_file_hashed", side_effect=OSError("disk full")
+        ):
+            self.assertIsNone(
+                winmail_opener.extract_winmail_dat(
+                    winmail_path, launcher=winmail_opener.NullLauncher()
+                )
+            )
+
+    def test_threaded_writes_to_dedup_store(self):
+        """Test writer threads storing identical payloads from one message"""
+        payload = os.urandom(64 * 1024)
+        winmail_path = self.write_winmail(
+            attachments=[{"name": f"copy{i}.bin", "data": payload} for i in range(8)]
+        )
+        digest = hashlib.sha256(payload).hexdigest()
+        replace = os.replace
+        barrier = threading.Barrier(2, timeout=1)
+
+        def overlapping_replace(source, target):
+            # Let two writer threads reach the store at the same moment
+            if os.path.basename(target) == digest:
+                with contextlib.suppress(threading.BrokenBarrierError):
+                    barrier.wait()
+            replace(source, target)
+
+        with unittest.mock.patch(
+            "winmail_opener.WRITER_THREADS", 4
+        ), unittest.mock.patch("os.replace", side_effect=overlapping_replace):
+            for run in range(3):
+                barrier.reset()
+                store_dir = os.path.join(self.output_dir, f"store{run}")
+                result = winmail_opener.extract_winmail_dat(
+                    winmail_path,
+                    launcher=winmail_opener.NullLauncher(),
+                    dedup_store=store_dir,
+                )
+                self.assertIsNotNone(result)
+                self.assertEqual(len(result["attachments"]), 8)
+                # One object and no temporary files are left in the store
+                self.assertEqual(
+                    os.listdir(os.path.join(store_dir, digest[:2])), [digest]
+                )
+
+        downloads_dir = os.path.join(self.output_dir, "Downloads")
+        for i in range(8):
+            with open(os.path.join(downloads_dir, f"copy{i}.bin"), "rb") as f:
+                self.assertEqual(f.read(), payload)
+
+    def test_directory_watcher(self):
+        """Test that dropped files are only reported once they stop changing"""
+        drop_dir = os.path.join(self.output_dir, "drop")
+        os.makedirs(drop_dir)
+        existing = os.path.join(drop_dir, "existing.dat")
+        with open(existing, "wb") as f:
+            f.write(b"already here")
+
+        watcher = winmail_opener.DirectoryWatcher(
+            drop_dir, settle=0.2, poll_interval=0.05, use_inotify=False
+        )
+        self.assertEqual(watcher.mode, "polling")
+        self.assertEqual(watcher.poll(0), [])
+        self.assertEqual(watcher.poll(1), [existing])
+
+        growing = os.path.join(drop_dir, "growing.dat")
+        with open(growing, "wb") as f:
+            f.write(b"part 1")
+        with open(os.path.join(drop_dir, "upload.dat.part"), "wb") as f:
+            f.write(b"partial upload")
+        self.assertEqual(watcher.poll(0.1), [])
+        with open(growing, "ab") as f:
+            f.write(b"part 2")
+        # The append restarts the quiet period
+        self.assertEqual(watcher.poll(0.15), [])
+        self.assertEqual(watcher.poll(1), [growing])
+        self.assertEqual(watcher.poll(0.3), [])
+
+    def test_watch_directory(self):
+        """Test processing dropped files in warm worker processes"""
+        drop_dir = os.path.join(self.output_dir, "drop")
+        os.makedirs(drop_dir)
+        processed = winmail_opener.METRICS.get("winmail_opener_files_processed_total")
+        results = {}
+
+        with winmail_opener.WorkerPool(1) as pool:
+            # The worker is started up front, not when the first file arrives
+            self.assertEqual(len(pool.idle), 1)
+            self.assertTrue(pool.idle[0][0].is_alive())
+
+            source = self.write_winmail(
+                "watched.dat", attachments=[{"name": "notes.txt", "data": b"notes"}]
+            )
+            shutil.copy(source, os.path.join(drop_dir, "watched.dat"))
+            with open(os.path.join(drop_dir, "broken.dat"), "wb") as f:
+                f.write(b"not a TNEF file")
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                winmail_opener.watch_directory(
+                    drop_dir,
+                    pool,
+                    settle=0.05,
+                    poll_interval=0.05,
+                    stop=lambda: len(results) == 2,
+                    on_result=lambda path, result: results.update(
+                        {os.path.basename(path): result}
+                    ),
+                )
+
+        self.assertIsNone(results["broken.dat"])
+        self.assertEqual(
+            [a["name"] for a in results["watched.dat"]["attachments"]], ["notes.txt"]
+        )
+        self.assertEqual(
+            results["watched.dat"]["html_file"],
+            os.path.join(drop_dir, "processed", "watched.dat.html"),
+        )
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(drop_dir, "processed"))),
+            ["watched.dat", "watched.dat.html"],
+        )
+        self.assertEqual(os.listdir(os.path.join(drop_dir, "failed")), ["broken.dat"])
+        # Metrics recorded by the worker are merged into this process
+        self.assertEqual(
+            winmail_opener.METRICS.get("winmail_opener_files_processed_total"),
+            processed + 1,
+        )
+
+    @unittest.skipUnless(
+        multiprocessing.get_start_method() == "fork",
+        "the slowed-down json.dump must reach the workers",
+    )
+    def test_concurrent_manifest_updates(self):
+        """Test that workers sharing an output folder keep every manifest entry"""
+        names = [f"message{i}.dat" for i in range(10)]
+        for name in names:
+            self.write_winmail(
+                name, attachments=[{"name": f"{name}.txt", "data": name.encode()}]
+            )
+        dump = json.dump
+
+        def slow_dump(*args, **kwargs):
+            # Widen the window between reading and replacing the manifest
+            time.sleep(0.02)
+            return dump(*args, **kwargs)
+
+        results = []
+        with unittest.mock.patch(
+            "json.dump", side_effect=slow_dump
+        ), contextlib.redirect_stdout(io.StringIO()):
+            with winmail_opener.WorkerPool(2) as pool:
+                for name in names:
+                    pool.submit(os.path.join(self.temp_dir, name))
+                while pool:
+                    results.extend(pool.results())
+
+        self.assertTrue(all(result for _, result, _ in results))
+        with open(
+            os.path.join(self.output_dir, "Downloads", "manifest.json"),
+            encoding="utf-8",
+        ) as f:
+            manifest = json.load(f)
+        self.assertEqual(
+            sorted(entry["name"] for entry in manifest["files"]),
+            sorted(f"{name}.txt" for name in names),
+        )
+
+    @unittest.skipUnless(
+        sys.platform.startswith("linux")
+        and multiprocessing.get_start_method() == "fork",
+        "needs forked workers and an enforced RLIMIT_AS",
+    )
+    def test_worker_limits(self):
+        """Test that stuck and memory-hungry files only cost their own worker"""
+        read_source = winmail_opener.read_winmail_source
+        worker_logger = logging.getLogger("winmail_opener.test")
+
+        def misbehaving_read(source):
+            name = os.path.basename(source)
+            worker_logger.warning(f"reading {name}")
+            if name == "slow.dat":
+                for _ in range(600):
+                    # Killed in the middle of sending log records
+                    worker_logger.warning("still reading")
+                    time.sleep(0.1)
+            elif name == "bomb.dat":
+                bytearray(8 << 30)  # Far above the worker memory limit
+            return read_source(source)
+
+        for name in ("slow.dat", "bomb.dat", "good1.dat", "good2.dat"):
+            self.write_winmail(
+                name, attachments=[{"name": f"{name}.txt", "data": b"data"}]
+            )
+        results = {}
+        messages = []
+        # Workers drop the root handlers they inherit, so this only sees
+        # records forwarded to the parent
+        handler = logging.Handler()
+        handler.emit = lambda record: messages.append(record.getMessage())
+        logging.getLogger().addHandler(handler)
+        self.addCleanup(logging.getLogger().removeHandler, handler)
+        started = time.monotonic()
+        with unittest.mock.patch(
+            "winmail_opener.read_winmail_source", side_effect=misbehaving_read
+        ), contextlib.redirect_stdout(io.StringIO()):
+            with winmail_opener.WorkerPool(
+                2, timeout=1.0, memory_limit=1 << 30
+            ) as pool:
+                pids = {process.pid for process, _ in pool.idle}
+                for name in ("slow.dat", "bomb.dat", "good1.dat", "good2.dat"):
+                    pool.submit(os.path.join(self.temp_dir, name))
+                while pool:
+                    for path, result, error in pool.results():
+                        results[os.path.basename(path)] = (result, error)
+                restarted = {process.pid for process, _ in pool.idle} - pids
+
+        self.assertLess(time.monotonic() - started, 30)
+        self.assertEqual(results["slow.dat"], (None, "timed out after 1.0s"))
+        self.assertEqual(results["bomb.dat"], (None, "exceeded the memory limit"))
+        for name in ("good1.dat", "good2.dat"):
+            result, error = results[name]
+            self.assertIsNone(error)
+            self.assertEqual(
+                [a["name"] for a in result["attachments"]], [f"{name}.txt"]
+            )
+        self.assertEqual(len(restarted), 2)
+        for name in ("slow.dat", "bomb.dat", "good1.dat", "good2.dat"):
+            self.assertIn(f"reading {name}", messages)
+        self.assertIn("still reading", messages)
+
+    def test_metrics_collection(self):
+        """Test that extraction successes and failures are recorded as metrics"""
+        metrics = winmail_opener.METRICS
+        processed = metrics.get("winmail_opener_files_processed_total")
+        written = metrics.get("winmail_opener_attachments_written_total")
+        failures = metrics.get("winmail_opener_failures_total", reason="ValueError")
+
+        winmail_path = self.write_winmail(
+            attachments=[{"name": "metrics.txt", "data": b"metrics"}]
+        )
+        invalid_path = os.path.join(self.temp_dir, "invalid.dat")
+        with open(invalid_path, "wb") as f:
+            f.write(b"not a TNEF file")
+
+        launcher = winmail_opener.NullLauncher()
+        winmail_opener.extract_winmail_dat(winmail_path, launcher=launcher)
+        self.assertIsNone(
+            winmail_opener.extract_winmail_dat(invalid_path, launcher=launcher)
+        )
+
+        self.assertEqual(
+            metrics.get("winmail_opener_files_processed_total"), processed + 1
+        )
+        self.assertEqual(
+            metrics.get("winmail_opener_attachments_written_total"), written + 1
+        )
+        self.assertEqual(
+            metrics.get("winmail_opener_failures_total", reason="ValueError"),
+            failures + 1,
+        )
+
+        metrics_file = os.path.join(self.output_dir, "winmail.prom")
+        metrics.write_textfile(metrics_file)
+        with open(metrics_file) as f:
+            exposition = f.read()
+        self.assertIn("# TYPE winmail_opener_parse_seconds histogram", exposition)
+        self.assertIn('winmail_opener_failures_total{reason="ValueError"}', exposition)
+        self.assertIn('winmail_opener_parse_seconds_bucket{le="+Inf"}', exposition)
+
+    def test_configure_logging_rotates(self):
+        """Test that queued logging writes to a size-rotated log file"""
+        import logging
+
+        log_file = os.path.join(self.output_dir, "winmail.log")
+        root = logging.getLogger()
+        original_level = root.level
+        try:
+            winmail_opener.configure_logging(
+                level="debug", log_file=log_file, max_bytes=2048, backup_count=2
+            )
+            for index in range(200):
+                winmail_opener.logger.debug(f"log line {index} " + "x" * 40)
+        finally:
+            winmail_opener.shutdown_logging()
+            root.setLevel(original_level)
+
+        self.assertTrue(os.path.exists(log_file))
+        self.assertTrue(os.path.exists(f"{log_file}.1"))
+        self.assertFalse(os.path.exists(f"{log_file}.3"))
+        self.assertLessEqual(os.path.getsize(log_file), 2048)
+        with open(log_file) as f:
+            self.assertIn("log line 199", f.read())
+
+    def test_decompress_rtf(self):
+        """Test the native compressed RTF decoder, including prefixes and CRC checks"""
+        rtf = b"{\\rtf1\\ansi " + b"Hello RTF world\\par " * 500 + b"}"
+        compressed = compress_rtf(rtf)
+
+        self.assertEqual(winmail_opener.decompress_rtf(compressed), rtf)
+        self.assertEqual(
+            winmail_opener.decompress_rtf(compressed, max_size=100), rtf[:100]
+        )
+        self.assertEqual(
+            winmail_opener.decompress_rtf(compress_rtf(rtf, compress=False)), rtf
+        )
+
+        corrupted = bytearray(compressed)
+        corrupted[40] ^= 0xFF
+        with self.assertRaises(ValueError):
+            winmail_opener.decompress_rtf(bytes(corrupted))
+
+    def test_rtf_body_rendering(self):
+        """Test that compressed RTF bodies are decompressed for the HTML view"""
+        import tnefparse
+
+        winmail_path = self.write_winmail(
+            rtf_body=b"{\\rtf1\\ansi\\deff0 Quarterly RTF report\\par}"
+        )
+        with open(winmail_path, "rb") as f:
+            tnef = tnefparse.TNEF(f.read())
+
+        html_content = winmail_opener.create_html_view(tnef, [])
+        self.assertIn("Quarterly RTF report", html_content)
+
+    def test_body_preview(self):
+        """Test that previews return plain text from HTML, RTF and text bodies"""
+        html_path = self.write_winmail(
+            name="html.dat",
+            html_body="<html><head><style>p { color: red }</style></head>"
+            "<body><script>alert(1)</script><p>Hello &amp; welcome</p>"
+            + "<p>filler text</p>" * 1000
+            + "</body></html>",
+        )
+        self.assertEqual(
+            winmail_opener.preview(html_path, 30), "Hello & welcome filler text fi"
+        )
+
+        rtf_path = self.write_winmail(
+            name="rtf.dat",
+            rtf_body=b"{\\rtf1\\ansi{\\fonttbl{\\f0 Arial;}}\\f0 Status report"
+            + b"\\par more" * 5000
+            + b"}",
+        )
+        self.assertEqual(winmail_opener.preview(rtf_path, 17), "Status report mor")
+
+        text_path = self.write_winmail(name="text.dat", body="Plain\n\ntext body")
+        self.assertEqual(winmail_opener.preview(text_path), "Plain text body")
+
+    def test_text_and_markdown_renderers(self):
+        """Test that text and Markdown renderers share the HTML body selection"""
+        mock_tnef = MockTNEF(
+            htmlbody="<html><head><style>p {}</style></head>"
+            "<body><p>Rendered <b>body</b></p></body></html>",
+            body="Plain fallback that should not be used",
+            subject="Renderer test",
+        )
+        attachments = [
+            {
+                "name": "report.pdf",
+                "path": "/tmp/report.pdf",
+                "size": 2048,
+                "url": "file:///tmp/report.pdf",
+            }
+        ]
+
+        text = winmail_opener.get_renderer("text").render_to_string(
+            mock_tnef, attachments
+        )
+        self.assertIn("Subject: Renderer test", text)
+        self.assertIn("Rendered body", text)
+        self.assertNotIn("Plain fallback", text)
+        self.assertNotIn("<", text)
+        self.assertIn("report.pdf (2.0 KB) /tmp/report.pdf", text)
+
+        markdown = winmail_opener.get_renderer("markdown").render_to_string(
+            mock_tnef, attachments
+        )
+        self.assertTrue(markdown.startswith("# Renderer test\n"))
+        self.assertIn("Rendered body", markdown)
+        self.assertIn("- [report.pdf](file:///tmp/report.pdf) (2.0 KB)", markdown)
+
+        with self.assertRaises(ValueError):
+            winmail_opener.get_renderer("pdf")
+
+    def test_custom_html_template(self):
+        """Test user-supplied templates and CSS, and reuse of compiled templates"""
+        template_path = os.path.join(self.output_dir, "theme.html")
+        with open(template_path, "w") as f:
+            f.write(
+                "<html><style>{{ css }}</style><main>{{ body }}</main>"
+                "<aside>{{attachments}}</aside></html>"
+            )
+        css_path = os.path.join(self.output_dir, "theme.css")
+        with open(css_path, "w") as f:
+            f.write("main { color: purple }")
+
+        renderer = winmail_opener.HTMLRenderer(template=template_path, css=css_path)
+        html_content = renderer.render_to_string(MockTNEF(body="Themed body"), [])
+        self.assertEqual(
+            html_content,
+            "<html><style>main { color: purple }</style>"
+            "<main><div>Themed body</div></main>"
+            "<aside><p>No attachments found</p></aside></html>",
+        )
+
+        # The compiled template is cached and shared by later renderers
+        self.assertIs(
+            winmail_opener.HTMLRenderer(template=template_path).template,
+            renderer.template,
+        )
+
+        with open(template_path, "w") as f:
+            f.write("{{ unknown_field }}")
+        with self.assertRaises(ValueError):
+            winmail_opener.HTMLRenderer(template=template_path)
+
+    def test_html_sanitizer(self):
+        """Test that scripts, handlers and remote resources are stripped"""
+        html_body = (
+            b"<html><head><style>p { color: red }</style>"
+            b"<script>alert(1)</script></head><body onload='evil()'>"
+            b"<style>@import url(http://x.example/a.css); div { margin: 0 }</style>"
+            b"<p onclick='steal()'>Hello &amp; welcome</p>"
+            b"<img src='https://tracker.example/pixel.gif'><img src='cid:logo'>"
+            b"<a href='javascript:alert(1)'>bad</a>"
+            b"<iframe src='https://x.example/'><p>framed</p></iframe></body></html>"
+        )
+        sanitized = winmail_opener.sanitize_html_content(html_body)
+
+        self.assertNotIn("script", sanitized)
+        self.assertNotIn("onclick", sanitized)
+        self.assertNotIn("onload", sanitized)
+        self.assertNotIn("javascript:", sanitized)
+        self.assertNotIn("@import", sanitized)
+        self.assertNotIn("framed", sanitized)
+        self.assertIn("<style>p { color: red }</style>", sanitized)
+        self.assertIn("div { margin: 0 }", sanitized)
+        self.assertIn("<p>Hello &amp; welcome</p>", sanitized)
+        self.assertIn(
+            '<img data-blocked-src="https://tracker.example/pixel.gif">', sanitized
+        )
+        self.assertIn('<img src="cid:logo">', sanitized)
+
+        allowed = winmail_opener.sanitize_html_content(
+            html_body, allow_remote_images=True
+        )
+        self.assertIn('<img src="https://tracker.example/pixel.gif">', allowed)
+
+    def test_html_sanitizer_css_escapes(self):
+        """Test that CSS escapes, comments and image-set() do not hide remote URLs"""
+        html_body = (
+            b"<p style='background:u\\72l(http://t.example/a.png)'>1</p>"
+            b"<p style='background:u\\5c 72l(http://t.example/b.png)'>2</p>"
+            b"<p style='background:image-set(\"//t.example/c.png\" 1x)'>3</p>"
+            b"<style>@imp/**/ort 'http://t.example/d.css'; "
+            b"p { background: -webkit-image-set(url(x.png) 1x) }</style>"
+        )
+        sanitized = winmail_opener.sanitize_html_content(html_body)
+
+        self.assertNotIn("t.example", sanitized)
+        self.assertNotIn("\\", sanitized)
+        self.assertIn("-webkit-image-set(url(x.png) 1x)", sanitized)
+
+    def test_streaming_html_sanitizer(self):
+        """Test that chunked sanitizing matches sanitizing the whole body"""
+        html_body = (
+            "<p style='color: red'>Caf\u00e9 &amp; cr\u00e8me</p><script>x()</script>"
+            * 50
+        ).encode("utf-8")
+        expected = winmail_opener.sanitize_html_content(html_body)
+
+        pieces = []
+        # Small chunks split tags, entities and multi-byte characters
+        winmail_opener.sanitize_html(io.BytesIO(html_body), pieces.append, chunk_size=7)
+        self.assertEqual("".join(pieces), expected)
+        self.assertIn("Caf\u00e9 &amp; cr\u00e8me", expected)
+        self.assertNotIn("x()", expected)
+
     def test_command_line_interface(self):
         """Test the command-line interface of winmail_opener.py"""
         # Mock the extract_winmail_dat function to avoid actually running it
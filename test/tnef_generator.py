@@ -1,7 +1,11 @@
+import argparse
 import os
+import random
 import shutil
+import struct
 import subprocess
 import tempfile
+import zlib
 from datetime import datetime
 from email.mime.application import MIMEApplication
 from email.mime.multipart import MIMEMultipart
@@ -182,3 +186,484 @@ class TNEFGenerator:
             attachments=["sample_image.txt", "sample_document.txt"],
             html_body=True,
         )
+
+
+# TNEF attribute levels and identifiers (MS-OXTNEF 2.1.3)
+TNEF_SIGNATURE = 0x223E9F78
+LVL_MESSAGE = 0x01
+LVL_ATTACHMENT = 0x02
+
+ATP_TRIPLES = 0x0000
+ATP_STRING = 0x0001
+ATP_TEXT = 0x0002
+ATP_DATE = 0x0003
+ATP_SHORT = 0x0004
+ATP_BYTE = 0x0006
+ATP_WORD = 0x0007
+ATP_DWORD = 0x0008
+
+ATT_FROM = 0x8000
+ATT_SUBJECT = 0x8004
+ATT_DATE_SENT = 0x8005
+ATT_MESSAGE_CLASS = 0x8008
+ATT_BODY = 0x800C
+ATT_ATTACH_DATA = 0x800F
+ATT_ATTACH_TITLE = 0x8010
+ATT_ATTACH_REND_DATA = 0x9002
+ATT_MSG_PROPS = 0x9003
+ATT_ATTACHMENT = 0x9005
+ATT_TNEF_VERSION = 0x9006
+ATT_OEM_CODEPAGE = 0x9007
+
+# MAPI property types and the tags used by the generator (MS-OXCDATA 2.11.1)
+PT_SHORT = 0x0002
+PT_LONG = 0x0003
+PT_BOOLEAN = 0x000B
+PT_STRING8 = 0x001E
+PT_UNICODE = 0x001F
+PT_SYSTIME = 0x0040
+PT_BINARY = 0x0102
+
+PR_IMPORTANCE = 0x0017
+PR_MESSAGE_CLASS = 0x001A
+PR_SENSITIVITY = 0x0036
+PR_SUBJECT = 0x0037
+PR_TRANSPORT_MESSAGE_HEADERS = 0x007D
+PR_DISPLAY_CC = 0x0E03
+PR_DISPLAY_TO = 0x0E04
+PR_BODY = 0x1000
+PR_RTF_COMPRESSED = 0x1009
+PR_BODY_HTML = 0x1013
+PR_ATTACH_FILENAME = 0x3704
+PR_ATTACH_LONG_FILENAME = 0x3707
+PR_ATTACH_MIME_TAG = 0x370E
+PR_ATTACH_CONTENT_ID = 0x3712
+PR_INTERNET_CPID = 0x3FDE
+
+# Initial dictionary contents for MS compressed RTF (MS-OXRTFCP 3.1.2)
+LZFU_INITIAL_DICTIONARY = (
+    b"{\\rtf1\\ansi\\mac\\deff0\\deftab720{\\fonttbl;}{\\f0\\fnil \\froman "
+    b"\\fswiss \\fmodern \\fscript \\fdecor MS Sans SerifSymbolArialTimes New "
+    b"RomanCourier{\\colortbl\\red0\\green0\\blue0\r\n\\par "
+    b"\\pard\\plain\\f0\\fs20\\b\\i\\u\\tab\\tx"
+)
+LZFU_COMPRESSED = 0x75465A4C  # "LZFu"
+LZFU_UNCOMPRESSED = 0x414C454D  # "MELA"
+
+FILETIME_EPOCH_OFFSET = 116444736000000000
+
+
+def lzfu_crc(data):
+    """CRC-32 variant used by compressed RTF: no pre- or post-inversion"""
+    return zlib.crc32(data, 0xFFFFFFFF) ^ 0xFFFFFFFF
+
+
+def compress_rtf(rtf, compress=True):
+    """
+    Encode RTF bytes in the MS compressed RTF (LZFu) container.
+
+    A greedy encoder that only looks at a handful of recent 3-byte matches is
+    enough to produce realistic, decodable streams quickly. With compress=False
+    the uncompressed "MELA" container is produced instead.
+    """
+    if not compress:
+        return struct.pack("<IIII", len(rtf) + 12, len(rtf), LZFU_UNCOMPRESSED, 0) + rtf
+
+    stream = LZFU_INITIAL_DICTIONARY + rtf
+    start = len(LZFU_INITIAL_DICTIONARY)
+    candidates = {}
+    for i in range(start - 2):
+        candidates.setdefault(stream[i : i + 3], []).append(i)
+
+    out = bytearray()
+    pos = start
+    while True:
+        control_index = len(out)
+        out.append(0)
+        control = 0
+        for bit in range(8):
+            if pos >= len(stream):
+                # End-of-stream marker: a reference to the current write offset
+                control |= 1 << bit
+                out += struct.pack(">H", (pos % 4096) << 4)
+                out[control_index] = control
+                payload = bytes(out)
+                header = struct.pack(
+                    "<IIII",
+                    len(payload) + 12,
+                    len(rtf),
+                    LZFU_COMPRESSED,
+                    lzfu_crc(payload),
+                )
+                return header + payload
+
+            best_length = 0
+            best_offset = 0
+            key = stream[pos : pos + 3]
+            for candidate in reversed(candidates.get(key, ())[-8:]):
+                if pos - candidate >= 4095:
+                    break
+                length = 0
+                while (
+                    length < 17
+                    and pos + length < len(stream)
+                    and stream[candidate + length] == stream[pos + length]
+                ):
+                    length += 1
+                if length > best_length:
+                    best_length = length
+                    best_offset = candidate % 4096
+                    if length == 17:
+                        break
+
+            if best_length >= 3:
+                control |= 1 << bit
+                out += struct.pack(">H", (best_offset << 4) | (best_length - 2))
+                advance = best_length
+            else:
+                out.append(stream[pos])
+                advance = 1
+
+            for i in range(pos, pos + advance):
+                if i + 3 <= len(stream):
+                    candidates.setdefault(stream[i : i + 3], []).append(i)
+            pos += advance
+        out[control_index] = control
+
+
+def tnef_attribute(level, attr_id, attr_type, data):
+    """Encode a single TNEF attribute with its trailing checksum"""
+    header = struct.pack("<BHHI", level, attr_id, attr_type, len(data))
+    checksum = sum(data) & 0xFFFF
+    return header + data + struct.pack("<H", checksum)
+
+
+def tnef_date(value):
+    """Encode a datetime as a TNEF DTR structure"""
+    return struct.pack(
+        "<7H",
+        value.year,
+        value.month,
+        value.day,
+        value.hour,
+        value.minute,
+        value.second,
+        (value.weekday() + 1) % 7,
+    )
+
+
+def tnef_triples(name, email):
+    """Encode the sender triple used by attFrom"""
+    name_bytes = name.encode("cp1252", "replace") + b"\x00"
+    address = b"SMTP:" + email.encode("ascii") + b"\x00"
+    body = name_bytes + address
+    return struct.pack("<HHHH", 4, len(body) + 8, len(name_bytes), len(address)) + body
+
+
+def _padded(data):
+    return data + b"\x00" * (-len(data) % 4)
+
+
+def mapi_properties(properties):
+    """
+    Encode a MAPI property stream for attMsgProps / attAttachment.
+
+    properties is a list of (prop_type, prop_id, value) tuples. Named properties
+    are given as (prop_type, (guid, lid), value) where guid is a uuid.UUID.
+    """
+    out = bytearray(struct.pack("<I", len(properties)))
+    for prop_type, prop_id, value in properties:
+        if isinstance(prop_id, tuple):
+            guid, lid = prop_id
+            out += struct.pack("<HH", prop_type, 0x8000)
+            out += guid.bytes_le + struct.pack("<II", 0, lid)
+        else:
+            out += struct.pack("<HH", prop_type, prop_id)
+
+        if prop_type in (PT_SHORT, PT_BOOLEAN):
+            out += struct.pack("<hH", int(value), 0)
+        elif prop_type == PT_LONG:
+            out += struct.pack("<i", value)
+        elif prop_type == PT_SYSTIME:
+            filetime = int(value.timestamp() * 10000000) + FILETIME_EPOCH_OFFSET
+            out += struct.pack("<Q", filetime)
+        elif prop_type in (PT_STRING8, PT_UNICODE, PT_BINARY):
+            if prop_type == PT_STRING8:
+                value = value.encode("cp1252", "replace") + b"\x00"
+            elif prop_type == PT_UNICODE:
+                value = value.encode("utf-16-le") + b"\x00\x00"
+            out += struct.pack("<II", 1, len(value)) + _padded(value)
+        else:
+            raise ValueError(f"Unsupported MAPI property type {prop_type:#06x}")
+    return bytes(out)
+
+
+class TNEFWriter:
+    """
+    Pure-Python winmail.dat writer.
+
+    Unlike TNEFGenerator this does not need any external tools, so it works
+    on Linux CI and can build large synthetic corpora for benchmarks.
+    """
+
+    def __init__(self, key=0x0101, codepage=1252):
+        self.key = key
+        self.codepage = codepage
+
+    def build(
+        self,
+        subject="Test Email",
+        sender=("Test Sender", "sender@example.com"),
+        date=None,
+        body=None,
+        html_body=None,
+        rtf_body=None,
+        attachments=None,
+        message_class="IPM.Microsoft Mail.Note",
+        extra_properties=None,
+    ):
+        """
+        Build a winmail.dat payload and return it as bytes
+
+        Args:
+            subject: Email subject
+            sender: (display name, email address) tuple
+            date: Date sent (datetime)
+            body: Plain text body
+            html_body: HTML body (str or bytes)
+            rtf_body: RTF body (bytes), stored as compressed RTF
+            attachments: List of dicts with name, data and optional long_name,
+                mime_type and content_id keys
+            message_class: MAPI message class
+            extra_properties: Additional (prop_type, prop_id, value) tuples
+                added to the message property stream
+
+        Returns:
+            The encoded TNEF stream
+        """
+        date = date or datetime(2025, 1, 1, 12, 0, 0)
+        out = bytearray(struct.pack("<IH", TNEF_SIGNATURE, self.key))
+
+        def message(attr_id, attr_type, data):
+            out.extend(tnef_attribute(LVL_MESSAGE, attr_id, attr_type, data))
+
+        message(ATT_TNEF_VERSION, ATP_DWORD, struct.pack("<I", 0x10000))
+        message(ATT_OEM_CODEPAGE, ATP_BYTE, struct.pack("<II", self.codepage, 0))
+        message(ATT_MESSAGE_CLASS, ATP_WORD, message_class.encode("ascii") + b"\x00")
+        if sender:
+            message(ATT_FROM, ATP_TRIPLES, tnef_triples(*sender))
+        if subject is not None:
+            message(
+                ATT_SUBJECT, ATP_STRING, subject.encode("cp1252", "replace") + b"\x00"
+            )
+        message(ATT_DATE_SENT, ATP_DATE, tnef_date(date))
+
+        properties = [(PT_LONG, PR_INTERNET_CPID, 65001)]
+        if subject is not None:
+            properties.append((PT_UNICODE, PR_SUBJECT, subject))
+        properties.append((PT_STRING8, PR_MESSAGE_CLASS, message_class))
+        if body is not None:
+            properties.append((PT_UNICODE, PR_BODY, body))
+        if html_body is not None:
+            if isinstance(html_body, str):
+                html_body = html_body.encode("utf-8")
+            properties.append((PT_BINARY, PR_BODY_HTML, html_body))
+        if rtf_body is not None:
+            properties.append((PT_BINARY, PR_RTF_COMPRESSED, compress_rtf(rtf_body)))
+        properties.extend(extra_properties or [])
+        message(ATT_MSG_PROPS, ATP_BYTE, mapi_properties(properties))
+
+        for attachment in attachments or []:
+            out.extend(self._attachment(attachment))
+
+        return bytes(out)
+
+    def _attachment(self, attachment):
+        """Encode the attribute block for one attachment"""
+        name = attachment["name"]
+        data = attachment["data"]
+        long_name = attachment.get("long_name")
+        rend_data = struct.pack("<HIHHI", 1, 0xFFFFFFFF, 0, 0, 0)
+
+        properties = [(PT_STRING8, PR_ATTACH_FILENAME, name)]
+        if long_name:
+            properties.append((PT_UNICODE, PR_ATTACH_LONG_FILENAME, long_name))
+        if attachment.get("mime_type"):
+            properties.append((PT_STRING8, PR_ATTACH_MIME_TAG, attachment["mime_type"]))
+        if attachment.get("content_id"):
+            properties.append(
+                (PT_STRING8, PR_ATTACH_CONTENT_ID, attachment["content_id"])
+            )
+
+        return b"".join(
+            [
+                tnef_attribute(
+                    LVL_ATTACHMENT, ATT_ATTACH_REND_DATA, ATP_BYTE, rend_data
+                ),
+                tnef_attribute(
+                    LVL_ATTACHMENT,
+                    ATT_ATTACH_TITLE,
+                    ATP_STRING,
+                    name.encode("ascii", "replace") + b"\x00",
+                ),
+                tnef_attribute(LVL_ATTACHMENT, ATT_ATTACH_DATA, ATP_BYTE, data),
+                tnef_attribute(
+                    LVL_ATTACHMENT,
+                    ATT_ATTACHMENT,
+                    ATP_BYTE,
+                    mapi_properties(properties),
+                ),
+            ]
+        )
+
+    def write(self, output_path, **kwargs):
+        """Build a winmail.dat payload and save it to output_path"""
+        directory = os.path.dirname(output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(output_path, "wb") as f:
+            f.write(self.build(**kwargs))
+        return output_path
+
+
+def synthetic_rtf(size):
+    """Generate an RTF document of roughly size bytes"""
+    paragraph = (
+        b"\\pard\\plain\\f0\\fs20 Lorem ipsum dolor sit amet, consectetur "
+        b"adipiscing elit, sed do eiusmod tempor incididunt ut labore.\\par\r\n"
+    )
+    header = b"{\\rtf1\\ansi\\ansicpg1252\\deff0{\\fonttbl{\\f0 Arial;}}\r\n"
+    count = max(1, (size - len(header)) // len(paragraph))
+    return header + paragraph * count + b"}"
+
+
+def synthetic_html(size, inline_images=0):
+    """Generate an HTML body of roughly size bytes referencing inline images"""
+    paragraph = (
+        '<p style="color:#333">Lorem ipsum <b>dolor</b> sit amet, '
+        '<a href="https://example.com/">consectetur</a> adipiscing elit.</p>\n'
+    )
+    images = "".join(
+        f'<img src="cid:image{index}@example.com" alt="image {index}">\n'
+        for index in range(inline_images)
+    )
+    count = max(1, size // len(paragraph))
+    return (
+        "<html><head><style>p { margin: 0 }</style></head><body>"
+        + images
+        + paragraph * count
+        + "</body></html>"
+    )
+
+
+def _random_bytes(rng, size):
+    """Random bytes from a seeded generator (random.randbytes needs Python 3.9)"""
+    return rng.getrandbits(size * 8).to_bytes(size, "little") if size else b""
+
+
+def generate_corpus(
+    output_dir,
+    count=10,
+    attachments=3,
+    attachment_size=64 * 1024,
+    rtf_size=0,
+    html_size=16 * 1024,
+    inline_images=0,
+    non_ascii_names=False,
+    seed=0,
+):
+    """
+    Generate a corpus of synthetic winmail.dat files
+
+    Args:
+        output_dir: Directory to write the files to
+        count: Number of winmail.dat files
+        attachments: Number of regular attachments per message
+        attachment_size: Size in bytes of each attachment
+        rtf_size: Size of the compressed RTF body (0 for none)
+        html_size: Size of the HTML body (0 for none)
+        inline_images: Number of inline images referenced from the HTML body
+        non_ascii_names: Use non-ASCII long file names for attachments
+        seed: Seed for the pseudo-random attachment contents
+
+    Returns:
+        List of generated file paths
+    """
+    rng = random.Random(seed)
+    writer = TNEFWriter()
+    rtf_body = synthetic_rtf(rtf_size) if rtf_size else None
+    html_body = synthetic_html(html_size, inline_images) if html_size else None
+    paths = []
+
+    for index in range(count):
+        message_attachments = []
+        for number in range(attachments):
+            long_name = (
+                f"Überweisung_{index}_{number}_報告書.bin"
+                if non_ascii_names
+                else f"attachment_{index}_{number}.bin"
+            )
+            message_attachments.append(
+                {
+                    "name": f"ATT{number:05d}.BIN",
+                    "long_name": long_name,
+                    "data": _random_bytes(rng, attachment_size),
+                    "mime_type": "application/octet-stream",
+                }
+            )
+        for number in range(inline_images):
+            message_attachments.append(
+                {
+                    "name": f"image{number}.png",
+                    "data": b"\x89PNG\r\n\x1a\n" + _random_bytes(rng, 4096),
+                    "mime_type": "image/png",
+                    "content_id": f"image{number}@example.com",
+                }
+            )
+
+        path = os.path.join(output_dir, f"winmail_{index:05d}.dat")
+        writer.write(
+            path,
+            subject=f"Synthetic message {index}",
+            body="Synthetic plain text body.\n" * 8,
+            html_body=html_body,
+            rtf_body=rtf_body,
+            attachments=message_attachments,
+        )
+        paths.append(path)
+
+    return paths
+
+
+def main():
+    """Command-line entry point for generating synthetic corpora"""
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic winmail.dat files without external tools."
+    )
+    parser.add_argument("output_dir", help="Directory to write the corpus to")
+    parser.add_argument("--count", type=int, default=10)
+    parser.add_argument("--attachments", type=int, default=3)
+    parser.add_argument("--attachment-size", type=int, default=64 * 1024)
+    parser.add_argument("--rtf-size", type=int, default=0)
+    parser.add_argument("--html-size", type=int, default=16 * 1024)
+    parser.add_argument("--inline-images", type=int, default=0)
+    parser.add_argument("--non-ascii-names", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    paths = generate_corpus(
+        args.output_dir,
+        count=args.count,
+        attachments=args.attachments,
+        attachment_size=args.attachment_size,
+        rtf_size=args.rtf_size,
+        html_size=args.html_size,
+        inline_images=args.inline_images,
+        non_ascii_names=args.non_ascii_names,
+        seed=args.seed,
+    )
+    print(f"Generated {len(paths)} winmail.dat files in {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
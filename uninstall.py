@@ -176,7 +176,10 @@ def remove_log_files():
     log_file = os.path.expanduser("~/WinmailOpener_log.txt")
     debug_log = os.path.expanduser("~/winmail_opener_debug.log")
 
-    for file_path in [log_file, debug_log]:
+    # Include rotated copies (e.g. winmail_opener_debug.log.1)
+    rotated_logs = glob.glob(f"{log_file}.*") + glob.glob(f"{debug_log}.*")
+
+    for file_path in [log_file, debug_log] + rotated_logs:
         if os.path.exists(file_path):
             print(f"Removing log file: {file_path}")
             try:
@@ -1,31 +1,141 @@
 import argparse  # Used for parsing command-line arguments
+import atexit  # Used for flushing queued log records on exit
+import codecs  # Used for incremental decoding of HTML bodies
+import collections  # Used for the job queue of the worker pool
+import contextlib  # Used for stage timing context managers
 import datetime  # Used for formatting dates
+import fnmatch  # Used for --include/--exclude attachment patterns
+import functools  # Used for caching compiled templates
+import hashlib  # Used for content-addressing deduplicated attachments
+import html  # Used for escaping text in generated HTML
+import io  # Used for rendering to in-memory text buffers
+import json  # Used for exporting contacts and tasks
 import logging  # Used for logging debug information
+import logging.handlers  # Used for queued, rotating log output
+import mimetypes  # Used for MIME types of attachments that could not be sniffed
+import multiprocessing  # Used for the warm worker pool of watch mode
+import multiprocessing.connection  # Used for waiting on several workers at once
 import os  # Used for file system operations
+import queue  # Used for handing log records and attachments to worker threads
 import re  # Used for RTF conversion
-import subprocess  # Used for opening the email body with the default text editor
+import select  # Used for waiting on inotify events
+import shlex  # Used for splitting custom viewer commands
+import shutil  # Used for copying files when hardlinks are not possible
+import struct  # Used for decoding compressed RTF headers
+import subprocess  # Used for opening the message view in a viewer
 import sys  # Used for accessing command line arguments
+import tarfile  # Used for --archive tar output
+import tempfile  # Used for output directories outside the sandbox
+import threading  # Used for the metrics server, counters and attachment writers
+import time  # Used for timing pipeline stages
+import unicodedata  # Used for normalizing attachment names
+import urllib.parse  # Used for quoting attachment links inside archives
+import uuid  # Used for MAPI named property sets
+import weakref  # Used for caching decoded message properties
+import zipfile  # Used for --archive zip output
+import zlib  # Used for compressed RTF CRC validation
+from html.parser import HTMLParser  # Used for extracting text from HTML bodies
+
+try:
+    import fcntl  # Used for locking the shared manifest.json
+except ImportError:  # Windows
+    fcntl = None
 
 # Version information - keep in sync with setup.py
 __version__ = "2.0.27"
 
-# Configure logging first before any imports that might use it
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    filename=os.path.expanduser("~/winmail_opener_debug.log"),
-    filemode="a",
-)
+# Module logger; handlers are attached to the root logger by configure_logging()
+logger = logging.getLogger("winmail_opener")
+
+# Logging defaults - override with --log-level/--log-file or the environment
+DEFAULT_LOG_FILE = "~/winmail_opener_debug.log"
+DEFAULT_LOG_LEVEL = "INFO"
+DEFAULT_LOG_MAX_BYTES = 5 * 1024 * 1024
+DEFAULT_LOG_BACKUP_COUNT = 3
+
+# Queue handler installed on the root logger and the background listener
+# that performs the actual log file writes
+_log_handler = None
+_log_listener = None
+
+
+def configure_logging(level=None, log_file=None, max_bytes=None, backup_count=None):
+    """
+    Configure logging so it never blocks the extraction thread.
+
+    Records are handed to a QueueHandler and written to a size-rotated log file
+    by a QueueListener thread. Unset arguments fall back to the
+    WINMAIL_OPENER_LOG_LEVEL, WINMAIL_OPENER_LOG_FILE,
+    WINMAIL_OPENER_LOG_MAX_BYTES and WINMAIL_OPENER_LOG_BACKUP_COUNT environment
+    variables and then to the module defaults. Calling it again replaces the
+    previous configuration.
+    """
+    global _log_handler, _log_listener
+
+    level = level or os.environ.get("WINMAIL_OPENER_LOG_LEVEL", DEFAULT_LOG_LEVEL)
+    log_file = log_file or os.environ.get("WINMAIL_OPENER_LOG_FILE", DEFAULT_LOG_FILE)
+    if max_bytes is None:
+        max_bytes = int(
+            os.environ.get("WINMAIL_OPENER_LOG_MAX_BYTES", DEFAULT_LOG_MAX_BYTES)
+        )
+    if backup_count is None:
+        backup_count = int(
+            os.environ.get("WINMAIL_OPENER_LOG_BACKUP_COUNT", DEFAULT_LOG_BACKUP_COUNT)
+        )
+
+    numeric_level = logging.getLevelName(str(level).upper())
+    if not isinstance(numeric_level, int):
+        numeric_level = logging.INFO
+
+    shutdown_logging()
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        os.path.expanduser(log_file),
+        maxBytes=max_bytes,
+        backupCount=backup_count,
+        encoding="utf-8",
+        delay=True,
+    )
+    file_handler.setFormatter(
+        logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+    )
+
+    log_queue = queue.SimpleQueue()
+    _log_handler = logging.handlers.QueueHandler(log_queue)
+    root = logging.getLogger()
+    root.addHandler(_log_handler)
+    root.setLevel(numeric_level)
+
+    _log_listener = logging.handlers.QueueListener(log_queue, file_handler)
+    _log_listener.start()
+    return _log_listener
+
+
+def shutdown_logging():
+    """Flush pending log records and stop the background listener"""
+    global _log_handler, _log_listener
+
+    if _log_handler is not None:
+        logging.getLogger().removeHandler(_log_handler)
+        _log_handler = None
+    if _log_listener is not None:
+        _log_listener.stop()
+        for handler in _log_listener.handlers:
+            handler.close()
+        _log_listener = None
+
+
+atexit.register(shutdown_logging)
 
 # Try to import required libraries with improved error messages
 try:
     import tnefparse  # Used for parsing Winmail.dat files
 
     TNEFPARSE_AVAILABLE = True
-    logging.debug("Successfully imported tnefparse")
+    logger.debug("Successfully imported tnefparse")
 except ImportError:
     TNEFPARSE_AVAILABLE = False
-    logging.error("Failed to import tnefparse")
+    logger.error("Failed to import tnefparse")
     print(
         """
 Error: Required dependency 'tnefparse' is not available.
@@ -43,10 +153,10 @@ try:
     import chardet  # Used for detecting character encoding of attachment names
 
     CHARDET_AVAILABLE = True
-    logging.debug("Successfully imported chardet")
+    logger.debug("Successfully imported chardet")
 except ImportError:
     CHARDET_AVAILABLE = False
-    logging.error("Failed to import chardet")
+    logger.error("Failed to import chardet")
     print(
         """
 Warning: Optional dependency 'chardet' is not available.
@@ -61,539 +171,4226 @@ For manual installation:
     )
 
 
-def extract_winmail_dat(winmail_dat_file):
+class StageTimer:
+    """Accumulates wall-clock time spent in each stage of the extraction pipeline"""
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Context manager that adds the time spent inside it to the named stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+    def total(self):
+        return sum(self.timings.values())
+
+    def format_report(self):
+        """Format the collected timings as a human-readable table"""
+        lines = ["Stage timings:"]
+        for name, elapsed in self.timings.items():
+            lines.append(f"  {name:<10} {elapsed * 1000:10.2f} ms")
+        lines.append(f"  {'total':<10} {self.total() * 1000:10.2f} ms")
+        return "\n".join(lines)
+
+
+class MetricsRegistry:
+    """
+    Prometheus-style counters and histograms collected during extraction.
+
+    Metrics can be exported in the Prometheus text format, either by writing a
+    file for the node_exporter textfile collector or by serving /metrics over HTTP.
+    """
+
+    # Metric name -> (type, help text)
+    METRIC_DEFINITIONS = {
+        "winmail_opener_files_processed_total": (
+            "counter",
+            "Winmail.dat files extracted successfully.",
+        ),
+        "winmail_opener_bytes_read_total": (
+            "counter",
+            "Bytes read from Winmail.dat files.",
+        ),
+        "winmail_opener_attachments_written_total": (
+            "counter",
+            "Attachments written to the output directory.",
+        ),
+        "winmail_opener_attachment_bytes_written_total": (
+            "counter",
+            "Attachment bytes written to the output directory.",
+        ),
+        "winmail_opener_attachments_skipped_total": (
+            "counter",
+            "Attachments left out by --include/--exclude/size filters.",
+        ),
+        "winmail_opener_failures_total": (
+            "counter",
+            "Files that could not be processed, by exception type.",
+        ),
+        "winmail_opener_parse_seconds": (
+            "histogram",
+            "Time spent parsing the TNEF stream.",
+        ),
+        "winmail_opener_extract_seconds": (
+            "histogram",
+            "Total time spent extracting a Winmail.dat file.",
+        ),
+    }
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}
+        # (name, labels) -> [bucket counts..., sum, count]
+        self._histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        """Increment a counter"""
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Record an observation in a histogram"""
+        key = self._key(name, labels)
+        with self._lock:
+            state = self._histograms.get(key)
+            if state is None:
+                state = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def get(self, name, **labels):
+        """Return the current value of a counter (0 if never incremented)"""
+        with self._lock:
+            return self._counters.get(self._key(name, labels), 0)
+
+    def drain(self):
+        """Return the collected values and reset the registry"""
+        with self._lock:
+            state = (self._counters, self._histograms)
+            self._counters, self._histograms = {}, {}
+        return state
+
+    def merge(self, state):
+        """Add values returned by drain(), e.g. from a worker process"""
+        counters, histograms = state
+        with self._lock:
+            for key, value in counters.items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, values in histograms.items():
+                current = self._histograms.setdefault(key, [0] * len(values))
+                for index, value in enumerate(values):
+                    current[index] += value
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ""
+        parts = []
+        for key, value in labels:
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+            value = value.replace("\n", "\\n")
+            parts.append(f'{key}="{value}"')
+        return "{" + ",".join(parts) + "}"
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(state) for key, state in self._histograms.items()}
+
+        lines = []
+        for name, (metric_type, help_text) in self.METRIC_DEFINITIONS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            if metric_type == "counter":
+                series = [(k[1], v) for k, v in counters.items() if k[0] == name]
+                if not series and name != "winmail_opener_failures_total":
+                    series = [((), 0)]
+                for labels, value in sorted(series):
+                    lines.append(f"{name}{self._format_labels(labels)} {value}")
+            else:
+                for (metric, labels), state in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in zip(self.buckets, state):
+                        bucket_labels = labels + (("le", repr(float(bound))),)
+                        lines.append(
+                            f"{name}_bucket{self._format_labels(bucket_labels)} {count}"
+                        )
+                    inf_labels = labels + (("le", "+Inf"),)
+                    lines.append(
+                        f"{name}_bucket{self._format_labels(inf_labels)} {state[-1]}"
+                    )
+                    lines.append(f"{name}_sum{self._format_labels(labels)} {state[-2]}")
+                    lines.append(
+                        f"{name}_count{self._format_labels(labels)} {state[-1]}"
+                    )
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """Atomically write the metrics to path for the textfile collector"""
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(temp_path, path)
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serve /metrics on a background thread and return the HTTP server"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(f"Metrics request: {format % args}")
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        return server
+
+
+# Process-wide metrics collected by extract_winmail_dat
+METRICS = MetricsRegistry()
+
+
+def is_path(source):
+    """Return True if a winmail.dat source is a file system path"""
+    return isinstance(source, (str, os.PathLike))
+
+
+def get_source_name(source):
+    """Return a display name for a winmail.dat source"""
+    if is_path(source):
+        return os.fspath(source)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return "<bytes>"
+    return getattr(source, "name", "<stream>")
+
+
+def read_winmail_source(source):
+    """
+    Return the raw bytes of a winmail.dat source.
+
+    source is a path, a bytes-like object (used as is, without copying bytes)
+    or a binary file object such as sys.stdin.buffer, which is read to the end.
+    """
+    if is_path(source):
+        with open(source, "rb") as f:
+            return f.read()
+    if isinstance(source, bytes):
+        return source
+    if isinstance(source, (bytearray, memoryview)):
+        return bytes(source)
+    return source.read()
+
+
+def extract_winmail_dat(
+    winmail_dat_file,
+    dedup_store=None,
+    timer=None,
+    output_format="html",
+    renderer=None,
+    launcher=None,
+    view_file=None,
+    archive=None,
+    calendar=None,
+    attachment_filter=None,
+):
     """
     Extracts attachments and email body from a Winmail.dat file.
     Displays content as HTML with metadata and attachment links.
+
+    winmail_dat_file is a path, the raw bytes of the file, or a binary file
+    object such as sys.stdin.buffer (see read_winmail_source).
+
+    If dedup_store is given, attachment contents are kept once in that
+    content-addressed directory and linked into the output directory.
+
+    output_format selects the renderer for the message view ("html", "text"
+    or "markdown", see RENDERERS). A configured Renderer instance can be passed
+    as renderer instead, e.g. an HTMLRenderer with a custom template.
+
+    launcher opens the rendered view (see get_launcher); the platform default
+    is used if none is given. Pass NullLauncher() to run headless. The view is
+    written to view_file, by default /tmp/winmail_view with the renderer's
+    extension.
+
+    If archive is "zip" or "tar", the attachments and the rendered view are
+    streamed into a single archive named after the input file in the output
+    directory instead of being written as loose files, and nothing is launched.
+
+    Meeting requests, contacts and tasks are exported next to the attachments
+    by ITEM_EXPORTERS (.ics, .vcf, .json). If calendar (a CalendarWriter) is
+    given, meeting requests are also appended to it.
+
+    attachment_filter (an AttachmentFilter) selects the attachments to extract.
+    Sizes are checked before anything else and names and MIME types before the
+    attachment is written, so skipped attachments are never written or hashed.
+
+    Time spent in each stage (read, parse, decode, write, render, launch) is
+    recorded on timer, a StageTimer created on demand.
+
+    Returns a dict describing the extraction (file, output_dir, attachments,
+    skipped_attachments, manifest, manifest_file, html_file, metadata,
+    timings), or None if the file could not be processed.
     """
-    logging.debug(f"Starting extraction for file: {winmail_dat_file}")
+    source_name = get_source_name(winmail_dat_file)
+    logger.debug(f"Starting extraction for file: {source_name}")
+    timer = timer or StageTimer()
+    renderer = renderer or get_renderer(output_format)
+    launcher = launcher or get_launcher()
+    started = time.perf_counter()
 
     try:
         # Validate file
-        if not os.path.exists(winmail_dat_file):
+        if is_path(winmail_dat_file) and not os.path.exists(winmail_dat_file):
             error_msg = f"File does not exist: {winmail_dat_file}"
-            logging.error(error_msg)
+            logger.error(error_msg)
             print(error_msg)
+            METRICS.inc("winmail_opener_failures_total", reason="FileNotFoundError")
             return
 
         # Parse the winmail.dat file
-        logging.debug(f"Opening file: {winmail_dat_file}")
-        with open(winmail_dat_file, "rb") as tnef_file:
-            file_content = tnef_file.read()
-            logging.debug(f"Read {len(file_content)} bytes from file")
-
-            # Check if file is empty
-            if len(file_content) == 0:
-                error_msg = f"Error: The file {winmail_dat_file} is empty"
-                logging.error(error_msg)
-                print(error_msg)
-                return
+        logger.debug(f"Opening file: {source_name}")
+        with timer.stage("read"):
+            file_content = read_winmail_source(winmail_dat_file)
+        logger.debug(f"Read {len(file_content)} bytes from file")
+        METRICS.inc("winmail_opener_bytes_read_total", len(file_content))
 
-            try:
+        # Check if file is empty
+        if len(file_content) == 0:
+            error_msg = f"Error: The file {source_name} is empty"
+            logger.error(error_msg)
+            print(error_msg)
+            METRICS.inc("winmail_opener_failures_total", reason="EmptyFile")
+            return
+
+        parse_started = time.perf_counter()
+        try:
+            with timer.stage("parse"):
                 tnef = tnefparse.TNEF(file_content)
-            except Exception as e:
-                error_msg = (
-                    f"Error: {winmail_dat_file} is not a valid TNEF (Winmail.dat) file"
-                )
-                logging.error(f"{error_msg}: {str(e)}")
-                print(f"{error_msg}: {str(e)}")
-                return
+        except Exception as e:
+            error_msg = f"Error: {source_name} is not a valid TNEF (Winmail.dat) file"
+            logger.error(f"{error_msg}: {str(e)}")
+            print(f"{error_msg}: {str(e)}")
+            METRICS.inc("winmail_opener_failures_total", reason=type(e).__name__)
+            return
+        METRICS.observe(
+            "winmail_opener_parse_seconds", time.perf_counter() - parse_started
+        )
 
         # Determine the output directory
         # When launched via file association, the working directory is often / (root)
         # In this case, we need to use a more accessible directory due to sandboxing
         working_dir = os.getcwd()
         is_sandboxed = working_dir == "/"
-        logging.debug(f"Is running in sandboxed environment: {is_sandboxed}")
+        logger.debug(f"Is running in sandboxed environment: {is_sandboxed}")
 
         if is_sandboxed:
             # When sandboxed, use a temporary directory which is usually accessible
-            import tempfile
-
             output_dir = os.path.join(tempfile.gettempdir(), "winmail_attachments")
-            logging.debug(f"Using sandboxed-safe output directory: {output_dir}")
+            logger.debug(f"Using sandboxed-safe output directory: {output_dir}")
         else:
             # Standard case - use Downloads folder
             output_dir = os.path.expanduser("~/Downloads")
-            logging.debug(f"Using standard output directory: {output_dir}")
+            logger.debug(f"Using standard output directory: {output_dir}")
 
         os.makedirs(output_dir, exist_ok=True)
 
         # Track extracted attachments for link generation
         extracted_attachments = []
-        logging.debug(f"Found {len(tnef.attachments)} attachments")
+        skipped_attachments = []
+        logger.debug(f"Found {len(tnef.attachments)} attachments")
 
-        for attachment in tnef.attachments:
-            attachment_name = ""
-            if isinstance(attachment.name, bytes):
-                # Detect encoding and decode attachment name
-                encoding = chardet.detect(attachment.name)["encoding"] or "utf-8"
-                try:
-                    attachment_name = attachment.name.decode(encoding)
-                except:
-                    attachment_name = attachment.name.decode("utf-8", "ignore")
+        archive_path = None
+        if archive:
+            if is_path(winmail_dat_file):
+                base_name = os.path.splitext(os.path.basename(winmail_dat_file))[0]
             else:
-                attachment_name = attachment.name
-
-            attachment_path = os.path.join(output_dir, attachment_name)
-            extracted_attachments.append(
-                {
-                    "name": attachment_name,
-                    "path": attachment_path,
-                    "size": len(attachment.data),
-                    "url": f"file://{attachment_path}",
-                }
+                base_name = "winmail"
+            archive_path = os.path.join(
+                output_dir, base_name + ARCHIVE_FORMATS[archive]
             )
 
-            print(f"Extracted attachment: {attachment_name} to {output_dir}")
-            with open(attachment_path, "wb") as f:
-                f.write(attachment.data)
+        # Archive members must be written one at a time, in order, so archives
+        # get a single writer thread (none when writer threads are disabled)
+        writer_threads = min(1, WRITER_THREADS) if archive else WRITER_THREADS
+        with (
+            ArchiveWriter(archive_path, archive)
+            if archive
+            else contextlib.nullcontext()
+        ) as archive_writer, AttachmentWriterPool(writer_threads) as writer_pool:
+            for attachment in tnef.attachments:
+                with timer.stage("decode"):
+                    attachment_properties = index_attachment_properties(attachment)
+                    attachment_name, declared_type = get_attachment_name(
+                        attachment, attachment_properties
+                    )
+                    size = len(attachment.data)
+                    if attachment_filter and not attachment_filter.size_matches(size):
+                        skipped_attachments.append(attachment_name)
+                        METRICS.inc("winmail_opener_attachments_skipped_total")
+                        logger.debug(
+                            f"Skipped attachment {attachment_name} ({size} bytes)"
+                        )
+                        continue
+
+                    # Outlook often truncates names to 8.3 or drops the extension
+                    attachment_name, mime_type = fix_attachment_name(
+                        attachment_name, attachment.data, declared_type
+                    )
+                    if attachment_filter and not attachment_filter.matches(
+                        attachment_name, mime_type
+                    ):
+                        skipped_attachments.append(attachment_name)
+                        METRICS.inc("winmail_opener_attachments_skipped_total")
+                        logger.debug(
+                            f"Skipped attachment {attachment_name} ({mime_type})"
+                        )
+                        continue
+
+                    if archive_writer:
+                        # Links in the archived view are relative to the archive root
+                        attachment_path = f"{archive_path}/{attachment_name}"
+                        url = urllib.parse.quote(attachment_name)
+                    else:
+                        attachment_path = os.path.join(output_dir, attachment_name)
+                        url = f"file://{attachment_path}"
+                    attachment_info = {
+                        "name": attachment_name,
+                        "path": attachment_path,
+                        "size": len(attachment.data),
+                        "url": url,
+                        "mime_type": mime_type,
+                        "extension": os.path.splitext(attachment_name)[1].lower(),
+                    }
+                    extracted_attachments.append(attachment_info)
+
+                print(
+                    f"Extracted attachment: {attachment_name} to {archive_path or output_dir}"
+                )
+                # Written on a writer thread while the next attachment is decoded
+                with timer.stage("write"):
+                    writer_pool.submit(
+                        attachment_path,
+                        write_attachment,
+                        attachment_info,
+                        attachment.data,
+                        archive_writer,
+                        dedup_store,
+                    )
+                METRICS.inc("winmail_opener_attachments_written_total")
+                METRICS.inc(
+                    "winmail_opener_attachment_bytes_written_total",
+                    len(attachment.data),
+                )
+
+            # Meeting requests, contacts and tasks are exported to calendar, vCard
+            # and JSON files, linked from the view like attachments
+            props = decode_properties(tnef)
+            for exporter in ITEM_EXPORTERS:
+                if not exporter.accepts(props):
+                    continue
+                with timer.stage("write"):
+                    export_name = exporter.file_name(props)
+                    export_data = exporter.export_bytes(tnef, props)
+                    if archive_writer:
+                        export_path = f"{archive_path}/{export_name}"
+                        url = urllib.parse.quote(export_name)
+                    else:
+                        export_path = os.path.join(output_dir, export_name)
+                        url = f"file://{export_path}"
+                    export_info = {
+                        "name": export_name,
+                        "path": export_path,
+                        "size": len(export_data),
+                        "url": url,
+                        "mime_type": exporter.mime_type,
+                        "extension": exporter.extension,
+                    }
+                    writer_pool.submit(
+                        export_path,
+                        write_attachment,
+                        export_info,
+                        export_data,
+                        archive_writer,
+                    )
+                    if calendar and exporter.name == "ics":
+                        calendar.add(tnef, props)
+                extracted_attachments.append(export_info)
+                print(
+                    f"Exported {exporter.description}: {export_name} to {archive_path or output_dir}"
+                )
+
+            if skipped_attachments:
+                print(
+                    f"Skipped {len(skipped_attachments)} attachment(s) by filter: "
+                    + ", ".join(skipped_attachments)
+                )
+
+            # Loose files are still being written while the view is rendered; the
+            # archive stream has to be finished first
+            if not archive_writer:
+                with timer.stage("render"):
+                    temp_html_file = (
+                        view_file or f"/tmp/winmail_view{renderer.extension}"
+                    )
+                    with open(temp_html_file, "w", encoding="utf-8") as f:
+                        renderer.render(tnef, extracted_attachments, f)
+
+            with timer.stage("write"):
+                writer_pool.close()
+
+                # Checksums were computed while writing; nothing is read back
+                manifest = [
+                    {
+                        "name": info["name"],
+                        "size": info["size"],
+                        "mime_type": info.get("mime_type"),
+                        "sha256": info["sha256"],
+                    }
+                    for info in extracted_attachments
+                ]
+                if archive_writer:
+                    manifest_file = f"{archive_path}/manifest.json"
+                    archive_writer.add(
+                        "manifest.json", manifest_json(source_name, manifest)
+                    )
+                elif manifest:
+                    manifest_file = update_manifest(output_dir, source_name, manifest)
+                else:
+                    manifest_file = None
 
-        # Create HTML content
-        html_content = create_html_view(tnef, extracted_attachments)
+            if archive_writer:
+                with timer.stage("render"):
+                    temp_html_file = archive_path
+                    with archive_writer.open_text(
+                        f"winmail_view{renderer.extension}"
+                    ) as f:
+                        renderer.render(tnef, extracted_attachments, f)
 
-        # Save HTML to temporary file
-        temp_html_file = "/tmp/winmail_view.html"
-        with open(temp_html_file, "w", encoding="utf-8") as f:
-            f.write(html_content)
+        if archive_writer:
+            # The archive is the deliverable; there is nothing to open
+            print(f"Message archived to: {archive_path}")
+        else:
+            # Open with the configured viewer without waiting for it
+            with timer.stage("launch"):
+                launched = launcher.launch(temp_html_file)
+            if launched:
+                print(f"Opened winmail.dat content in browser")
+            else:
+                print(f"Message view written to: {temp_html_file}")
 
-        # Open with default browser
-        subprocess.call(["open", temp_html_file])
-        print(f"Opened winmail.dat content in browser")
+        METRICS.inc("winmail_opener_files_processed_total")
+        METRICS.observe("winmail_opener_extract_seconds", time.perf_counter() - started)
+        return {
+            "file": source_name,
+            "output_dir": output_dir,
+            "attachments": extracted_attachments,
+            "skipped_attachments": skipped_attachments,
+            "manifest": manifest,
+            "manifest_file": manifest_file,
+            "html_file": temp_html_file,
+            "metadata": extract_metadata(tnef),
+            "timings": dict(timer.timings),
+        }
 
     except ValueError as e:
         # Handle ValueError which is what tnefparse raises for invalid TNEF files
         print(f"TNEF parsing error: {e}")
-    except FileNotFoundError:
+        METRICS.inc("winmail_opener_failures_total", reason=type(e).__name__)
+    except FileNotFoundError as e:
         print("Error: Winmail.dat file not found.")
+        METRICS.inc("winmail_opener_failures_total", reason=type(e).__name__)
     except OSError as e:
         print(f"OS error: {e}")
+        METRICS.inc("winmail_opener_failures_total", reason=type(e).__name__)
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
-        logging.exception("Error in extract_winmail_dat")
+        logger.exception("Error in extract_winmail_dat")
+        METRICS.inc("winmail_opener_failures_total", reason=type(e).__name__)
 
 
-def create_html_view(tnef, attachments):
-    """
-    Creates an HTML representation of winmail.dat content including:
-    - Metadata (From, To, Subject, Date, etc.)
-    - Email body (converted from RTF if available)
-    - Attachment links
-    """
-    # CSS styling for a clean, modern look
-    css = """
-    <style>
-        body {
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Oxygen, Ubuntu, Cantarell, 'Open Sans', sans-serif;
-            line-height: 1.6;
-            color: #333;
-            max-width: 800px;
-            margin: 0 auto;
-            padding: 20px;
-        }
-        .header {
-            background-color: #f8f9fa;
-            border-radius: 8px;
-            padding: 15px;
-            margin-bottom: 20px;
-            box-shadow: 0 1px 3px rgba(0,0,0,0.1);
-        }
-        .metadata-item {
-            margin-bottom: 8px;
-        }
-        .metadata-label {
-            font-weight: bold;
-            color: #555;
-            width: 100px;
-            display: inline-block;
-        }
-        .body-container {
-            background-color: white;
-            border-radius: 8px;
-            padding: 20px;
-            margin-bottom: 20px;
-            border: 1px solid #e1e4e8;
-        }
-        .attachments {
-            background-color: #f8f9fa;
-            border-radius: 8px;
-            padding: 15px;
-            box-shadow: 0 1px 3px rgba(0,0,0,0.1);
-        }
-        .attachment-list {
-            list-style-type: none;
-            padding-left: 0;
-        }
-        .attachment-item {
-            padding: 8px 0;
-            border-bottom: 1px solid #eee;
-        }
-        .attachment-item:last-child {
-            border-bottom: none;
-        }
-        .attachment-link {
-            text-decoration: none;
-            color: #0366d6;
-        }
-        .attachment-link:hover {
-            text-decoration: underline;
-        }
-        .attachment-size {
-            color: #666;
-            font-size: 0.9em;
-        }
-        h1 {
-            color: #24292e;
-            font-size: 24px;
-            font-weight: 600;
-            margin-top: 0;
-        }
-        h2 {
-            color: #24292e;
-            font-size: 20px;
-            font-weight: 600;
-            margin-top: 0;
-            border-bottom: 1px solid #eaecef;
-            padding-bottom: 8px;
-        }
-    </style>
-    """
+# Magic numbers for attachment content sniffing: (pattern, MIME type, extension,
+# other accepted extensions). A pattern is a sequence of bytes objects and
+# integers; an integer skips that many bytes (a wildcard).
+MAGIC_SIGNATURES = (
+    ((b"%PDF-",), "application/pdf", ".pdf", (".ai",)),
+    ((b"\x89PNG\r\n\x1a\n",), "image/png", ".png", ()),
+    ((b"\xff\xd8\xff",), "image/jpeg", ".jpg", (".jpeg", ".jpe", ".jfif")),
+    ((b"GIF87a",), "image/gif", ".gif", ()),
+    ((b"GIF89a",), "image/gif", ".gif", ()),
+    ((b"BM",), "image/bmp", ".bmp", (".dib",)),
+    ((b"II*\x00",), "image/tiff", ".tif", (".tiff",)),
+    ((b"MM\x00*",), "image/tiff", ".tif", (".tiff",)),
+    ((b"\x00\x00\x01\x00",), "image/x-icon", ".ico", ()),
+    ((b"8BPS",), "image/vnd.adobe.photoshop", ".psd", ()),
+    ((b"RIFF", 4, b"WEBP"), "image/webp", ".webp", ()),
+    ((b"RIFF", 4, b"WAVE"), "audio/wav", ".wav", ()),
+    ((b"RIFF", 4, b"AVI "), "video/x-msvideo", ".avi", ()),
+    (
+        (4, b"ftyp"),
+        "video/mp4",
+        ".mp4",
+        (".m4v", ".m4a", ".m4b", ".3gp", ".3g2", ".mov", ".avif", ".heic", ".heif"),
+    ),
+    ((4, b"ftypqt  "), "video/quicktime", ".mov", ()),
+    ((4, b"ftypM4A "), "audio/mp4", ".m4a", ()),
+    ((4, b"ftypheic"), "image/heic", ".heic", (".heif",)),
+    ((4, b"ftypmif1"), "image/heic", ".heic", (".heif",)),
+    ((b"\x1a\x45\xdf\xa3",), "video/webm", ".webm", (".mkv",)),
+    ((b"ID3",), "audio/mpeg", ".mp3", ()),
+    ((b"OggS",), "audio/ogg", ".ogg", (".oga", ".ogv", ".ogx", ".opus", ".spx")),
+    ((b"fLaC",), "audio/flac", ".flac", ()),
+    (
+        (b"PK\x03\x04",),
+        "application/zip",
+        ".zip",
+        (
+            ".docx", ".docm", ".dotx", ".dotm", ".xlsx", ".xlsm", ".xltx", ".xltm",
+            ".xlsb", ".xlam", ".pptx", ".pptm", ".potx", ".potm", ".ppsx", ".ppsm",
+            ".vsdx", ".vsdm", ".odt", ".ods", ".odp", ".odg", ".ott", ".ots",
+            ".key", ".pages", ".numbers", ".jar", ".war", ".apk", ".ipa", ".xpi",
+            ".epub", ".kmz", ".xps", ".oxps", ".3mf", ".cbz", ".whl", ".nupkg",
+        ),  # fmt: skip
+    ),
+    (
+        (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1",),
+        "application/x-ole-storage",
+        None,  # Word, Excel, PowerPoint, Outlook...: keep the given extension
+        (".doc", ".xls", ".ppt", ".msg", ".dot", ".xlt", ".pps", ".vsd", ".pub"),
+    ),
+    ((b"{\\rtf",), "application/rtf", ".rtf", (".doc", ".wri")),
+    ((b"\x1f\x8b",), "application/gzip", ".gz", (".tgz",)),
+    ((b"BZh",), "application/x-bzip2", ".bz2", ()),
+    ((b"\xfd7zXZ\x00",), "application/x-xz", ".xz", ()),
+    ((b"7z\xbc\xaf\x27\x1c",), "application/x-7z-compressed", ".7z", ()),
+    ((b"Rar!\x1a\x07",), "application/vnd.rar", ".rar", ()),
+    ((257, b"ustar"), "application/x-tar", ".tar", ()),
+    ((b"SQLite format 3\x00",), "application/vnd.sqlite3", ".sqlite", (".db",)),
+    ((b"%!PS",), "application/postscript", ".ps", (".eps", ".ai")),
+    ((b"wOFF",), "font/woff", ".woff", ()),
+    ((b"wOF2",), "font/woff2", ".woff2", ()),
+    ((b"BEGIN:VCARD",), "text/vcard", ".vcf", ()),
+    ((b"BEGIN:VCALENDAR",), "text/calendar", ".ics", ()),
+    (
+        (b"<?xml",),
+        "application/xml",
+        ".xml",
+        (".svg", ".xsd", ".xsl", ".xslt", ".rss", ".atom", ".kml", ".gpx", ".plist"),
+    ),
+    ((b"MZ",), "application/x-msdownload", None, (".exe", ".dll")),
+)
 
-    # Start building HTML
-    html = f"""<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Winmail.dat Content</title>
-    {css}
-</head>
-<body>
-    <div class="header">
-        <h1>Email Content</h1>
-    """
+# Number of leading bytes the sniffer looks at
+SNIFF_SIZE = 512
 
-    # Extract and display metadata
-    metadata = extract_metadata(tnef)
-    for key, value in metadata.items():
-        if value:  # Only display non-empty metadata
-            html += f'<div class="metadata-item"><span class="metadata-label">{key}:</span> {value}</div>\n'
-
-    html += "</div>"  # Close header
-
-    # Email body content
-    html += '<div class="body-container">'
-
-    # Try to get HTML body first, then RTF, then plain text
-    if hasattr(tnef, "htmlbody") and tnef.htmlbody:
-        # Use the HTML body content
-        html_content = sanitize_html_content(tnef.htmlbody)
-        html += f"<div>{html_content}</div>"
-    elif hasattr(tnef, "rtfbody") and tnef.rtfbody:
-        # Convert RTF to HTML
-        body_html = convert_rtf_to_html(tnef.rtfbody)
-        html += f"<div>{body_html}</div>"
-    elif hasattr(tnef, "body") and tnef.body:
-        # If no RTF, use plain text with simple formatting
-        if isinstance(tnef.body, bytes):
-            body_text = tnef.body.decode("utf-8", "ignore")
-        else:
-            body_text = tnef.body
+# Shorter signatures (e.g. "BM", "MZ") only name files without an extension
+MIN_RENAME_SIGNATURE = 4
 
-        # Format plain text for HTML display (preserve line breaks)
-        body_html = (
-            body_text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
-        )
-        body_html = body_html.replace("\n", "<br>").replace("  ", "&nbsp;&nbsp;")
-        html += f"<div>{body_html}</div>"
-    else:
-        html += "<div><em>No email body content found</em></div>"
+# Generic containers whose declared MIME type is more specific than the sniffed one
+CONTAINER_TYPES = {"application/zip", "application/x-ole-storage"}
 
-    html += "</div>"  # Close body container
+# Generic containers that many specific formats are built on: sniffed extension
+# -> MIME major types of the formats that may keep their own extension
+CONTAINER_FAMILIES = {
+    ".zip": ("application",),
+    ".mp4": ("video", "audio", "image"),
+    ".ogg": ("audio", "video"),
+    ".pdf": ("application",),
+    ".ps": ("application",),
+    ".rtf": ("application", "text"),
+    ".xml": ("application", "text", "image"),
+}
 
-    # Attachments section
-    html += """
-    <div class="attachments">
-        <h2>Attachments</h2>
+# Zip-based Office formats: extension -> MIME type
+OOXML_TYPES = {
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ".pptx": "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+}
+
+
+def build_signature_trie(signatures):
+    """
+    Build a prefix trie of magic numbers: {byte: node, None: wildcard node,
+    "match": signature}.
     """
+    root = {}
+    for signature in signatures:
+        node = root
+        for part in signature[0]:
+            keys = [None] * part if isinstance(part, int) else part
+            for key in keys:
+                node = node.setdefault(key, {})
+        node["match"] = signature
+    return root
 
-    if attachments:
-        html += '<ul class="attachment-list">'
-        for attachment in attachments:
-            size_str = format_file_size(attachment["size"])
-            html += f"""
-            <li class="attachment-item">
-                <a href="{attachment['url']}" class="attachment-link">{attachment['name']}</a>
-                <span class="attachment-size"> ({size_str})</span>
-            </li>
-            """
-        html += "</ul>"
-    else:
-        html += "<p>No attachments found</p>"
 
-    html += "</div>"  # Close attachments
+SIGNATURE_TRIE = build_signature_trie(MAGIC_SIGNATURES)
 
-    # Close HTML document
-    html += """
-</body>
-</html>
+
+def sniff_content_type(data):
     """
+    Identify data by its magic number.
 
-    return html
+    Only the first SNIFF_SIZE bytes are inspected by walking SIGNATURE_TRIE; the
+    longest matching signature wins. Returns (mime_type, extension, accepted
+    extensions, signature length) or None.
+    """
+    head = memoryview(data)[:SNIFF_SIZE]
+    best = None
+    best_depth = -1
+    stack = [(SIGNATURE_TRIE, 0)]
+    while stack:
+        node, depth = stack.pop()
+        match = node.get("match")
+        if match and depth > best_depth:
+            best, best_depth = match, depth
+        if depth < len(head):
+            child = node.get(head[depth])
+            if child:
+                stack.append((child, depth + 1))
+        wildcard = node.get(None)
+        if wildcard and depth < len(head):
+            stack.append((wildcard, depth + 1))
+    return (*best[1:], best_depth) if best else None
 
 
-def extract_metadata(tnef):
-    """Extract all available metadata from TNEF object"""
-    metadata = {}
-
-    # Map TNEF attributes to human-readable labels
-    attribute_map = {
-        "subject": "Subject",
-        "from": "From",
-        "sender_name": "Sender",
-        "message_id": "Message ID",
-        "date_sent": "Date Sent",
-        "date_received": "Date Received",
-        "message_class": "Message Class",
-        "priority": "Priority",
-        "conversation_id": "Conversation",
-    }
+def fix_attachment_name(name, data, declared_type=None):
+    """
+    Return (name, mime_type) for an attachment, adding the extension matching
+    its content when the name has none or one that does not fit.
 
-    # Try to extract common metadata values
-    if hasattr(tnef, "subject"):
-        metadata["Subject"] = get_tnef_value(tnef.subject)
-
-    # 'from' is a Python reserved keyword, need to use getattr
-    if hasattr(tnef, "from"):
-        metadata["From"] = get_tnef_value(getattr(tnef, "from"))
-
-    if hasattr(tnef, "date_sent"):
-        sent_date = get_tnef_value(tnef.date_sent)
-        if sent_date:
-            # Format date if it's a datetime object
-            if isinstance(sent_date, (datetime.datetime, datetime.date)):
-                sent_date = sent_date.strftime("%Y-%m-%d %H:%M:%S")
-            metadata["Date Sent"] = sent_date
-
-    if hasattr(tnef, "date_received"):
-        recv_date = get_tnef_value(tnef.date_received)
-        if recv_date and isinstance(recv_date, (datetime.datetime, datetime.date)):
-            metadata["Date Received"] = recv_date.strftime("%Y-%m-%d %H:%M:%S")
-
-    # Add any other available metadata from TNEF attributes
-    for attr in dir(tnef):
-        if attr.startswith("__") or attr in (
-            "attachments",
-            "body",
-            "rtfbody",
-            "has_body",
-        ):
-            continue
+    declared_type is the MIME type the sender declared (PR_ATTACH_MIME_TAG). It
+    is used for content the sniffer does not recognise and to tell apart the
+    formats sharing a zip or OLE2 container.
+    """
+    sniffed = sniff_content_type(data)
+    base, extension = os.path.splitext(name)
+    guessed_type = mimetypes.guess_type(name)[0]
+    if not sniffed:
+        if not extension and declared_type:
+            extension = mimetypes.guess_extension(declared_type) or ""
+            name += extension
+        return name, declared_type or guessed_type or "application/octet-stream"
 
-        if attr in attribute_map and not attribute_map[attr] in metadata:
-            value = get_tnef_value(getattr(tnef, attr))
-            if value:
-                metadata[attribute_map[attr]] = value
+    mime_type, sniffed_extension, accepted, length = sniffed
+    extension = extension.lower()
+    if mime_type in CONTAINER_TYPES and declared_type:
+        mime_type = declared_type
+    if sniffed_extension == ".zip":
+        if extension + "x" in OOXML_TYPES:
+            # Outlook's 8.3 short name cut .docx down to .doc
+            return base + extension + "x", OOXML_TYPES[extension + "x"]
+        if extension in OOXML_TYPES:
+            return name, OOXML_TYPES[extension]
+    if extension == sniffed_extension:
+        return name, mime_type
+    if sniffed_extension in CONTAINER_FAMILIES and extension:
+        family = CONTAINER_FAMILIES[sniffed_extension]
+        if extension in accepted or (guessed_type or "").split("/")[0] in family:
+            # A specific format in a generic container (.xlsm, .ai, .svg)
+            return name, declared_type or guessed_type or mime_type
+    if extension in accepted:
+        return name, mime_type
+    if sniffed_extension is None:
+        return name, mime_type
+    if extension and sniffed_extension.startswith(extension):
+        # Truncated extension, e.g. ".web" for ".webp"
+        return base + sniffed_extension, mime_type
+    if extension and length < MIN_RENAME_SIGNATURE:
+        # Too weak to overrule the given extension (a text file may start "BM")
+        return name, guessed_type or "application/octet-stream"
+    return name + sniffed_extension, mime_type
 
-    return metadata
 
+def normalize_attachment_name(name):
+    """
+    Normalize an attachment file name to NFC and strip anything that could
+    escape the output directory.
+    """
+    name = unicodedata.normalize("NFC", name.replace("\x00", ""))
+    name = re.split(r"[\\/]", name)[-1].strip()
+    if name in ("", ".", ".."):
+        return "attachment"
+    return name
 
-def get_tnef_value(value):
-    """Safely extract and decode TNEF attribute values"""
-    if value is None:
-        return None
 
-    if isinstance(value, bytes):
-        try:
-            return value.decode("utf-8", "ignore")
-        except:
-            return str(value)
+def index_attachment_properties(attachment):
+    """
+    Index the MAPI properties of an attachment by tag, once per attachment.
 
-    return str(value)
+    The first occurrence of a tag wins; named properties are skipped.
+    """
+    index = {}
+    for attribute in getattr(attachment, "mapi_attrs", None) or ():
+        if not attribute.guid:
+            index.setdefault(attribute.name, attribute)
+    return index
 
 
-def sanitize_html_content(html_content):
+def get_attachment_name(attachment, properties):
     """
-    Clean up and sanitize HTML content from winmail.dat files
-    to make it safe for display and properly formatted.
+    Return (name, declared MIME type) of an attachment.
+
+    The long file name (PR_ATTACH_LONG_FILENAME) is preferred over the 8.3 short
+    name of attAttachTitle, then the display name; names are NFC-normalized.
     """
-    if isinstance(html_content, bytes):
-        html_content = html_content.decode("utf-8", "ignore")
+    attribute = properties.get(PR_ATTACH_LONG_FILENAME)
+    name = decode_text(attribute.data) if attribute is not None else None
+    if not name:
+        name = attachment.name
+        if isinstance(name, bytes):
+            # Detect encoding and decode attachment name
+            encoding = chardet.detect(name)["encoding"] or "utf-8"
+            try:
+                name = name.decode(encoding)
+            except (LookupError, UnicodeDecodeError):
+                name = name.decode("utf-8", "ignore")
+        if name and PR_ATTACH_LONG_FILENAME not in properties:
+            # Short names lack the extension at times; PR_ATTACH_EXTENSION has it
+            extension = properties.get(PR_ATTACH_EXTENSION)
+            extension = decode_text(extension.data) if extension is not None else ""
+            if extension and not os.path.splitext(name)[1]:
+                name += extension
+    if not name and PR_DISPLAY_NAME in properties:
+        name = decode_text(properties[PR_DISPLAY_NAME].data)
 
-    # Extract just the body content if possible
-    body_start = html_content.find("<body")
-    if body_start >= 0:
-        body_end = html_content.find("</body>", body_start)
-        if body_end >= 0:
-            # Include the body tag itself
-            body_content = html_content[body_start : body_end + 7]
+    mime_tag = properties.get(PR_ATTACH_MIME_TAG)
+    declared_type = decode_text(mime_tag.data) if mime_tag is not None else None
+    return normalize_attachment_name(name or ""), declared_type or None
 
-            # Attempt to preserve styles
-            head_start = html_content.find("<head")
-            head_end = html_content.find("</head>")
-            if head_start >= 0 and head_end >= 0:
-                style_start = html_content.find("<style", head_start)
-                style_end = html_content.find("</style>", style_start)
-                if style_start >= 0 and style_end >= 0:
-                    style_content = html_content[style_start : style_end + 8]
-                    return f"{style_content}{body_content}"
 
-            return body_content
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
 
-    # If we couldn't extract the body, return the full content
-    return html_content
 
+def parse_size(text):
+    """Parse a size such as 500, 200K, 1.5M or 2G into bytes"""
+    match = re.fullmatch(
+        r"\s*(\d+(?:\.\d+)?)\s*([KMG]?)B?\s*", str(text), re.IGNORECASE
+    )
+    if not match:
+        raise ValueError(f"Invalid size: {text}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
 
-def convert_rtf_to_html(rtf_data):
-    """Convert RTF content to HTML"""
-    # For initial implementation, we'll use a simple approach
-    # In a future version, we could integrate a more robust RTF-to-HTML converter
-    if isinstance(rtf_data, bytes):
-        try:
-            rtf_text = rtf_data.decode("utf-8", "ignore")
-        except:
-            return "<pre>RTF content available but could not be converted</pre>"
-    else:
-        rtf_text = str(rtf_data)
 
-    # Very basic RTF cleanup - remove RTF control sequences
-    # This is a minimal implementation - a more robust parser would be better
-    try:
-        # Strip RTF control sequences
-        cleaned_text = re.sub(r"\\[a-z]+[-]?[0-9]*", " ", rtf_text)
-        cleaned_text = re.sub(r"[{}]", "", cleaned_text)
-        cleaned_text = re.sub(r"\\\'[0-9a-f]{2}", "", cleaned_text)
+class AttachmentFilter:
+    """
+    Selects attachments by name, MIME type and size.
 
-        # Replace line breaks
-        cleaned_text = cleaned_text.replace("\\par", "<br>")
+    include and exclude are lists of patterns: shell-style globs on the file
+    name (e.g. "*.pdf"), or MIME types when they contain a slash (e.g.
+    "image/*"). An attachment is kept if it matches any include pattern (or
+    there are none), matches no exclude pattern, and its size is within
+    min_size and max_size.
+    """
 
-        # Handle HTML entities
-        cleaned_text = (
-            cleaned_text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
-        )
+    def __init__(self, include=(), exclude=(), min_size=None, max_size=None):
+        self.include = [pattern.lower() for pattern in include or ()]
+        self.exclude = [pattern.lower() for pattern in exclude or ()]
+        self.min_size = min_size
+        self.max_size = max_size
 
-        return cleaned_text
-    except:
-        # If conversion fails, return the raw RTF in a pre tag
-        safe_rtf = (
-            rtf_text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    def size_matches(self, size):
+        if self.min_size is not None and size < self.min_size:
+            return False
+        return self.max_size is None or size <= self.max_size
+
+    @staticmethod
+    def pattern_matches(pattern, name, mime_type):
+        value = mime_type if "/" in pattern else name
+        return fnmatch.fnmatchcase((value or "").lower(), pattern)
+
+    def matches(self, name, mime_type):
+        if self.include and not any(
+            self.pattern_matches(pattern, name, mime_type) for pattern in self.include
+        ):
+            return False
+        return not any(
+            self.pattern_matches(pattern, name, mime_type) for pattern in self.exclude
         )
-        return f"<pre>{safe_rtf}</pre>"
 
 
-def format_file_size(size_bytes):
-    """Format file size in a human-readable way"""
-    if size_bytes < 1024:
-        return f"{size_bytes} bytes"
-    elif size_bytes < 1024 * 1024:
-        return f"{size_bytes/1024:.1f} KB"
-    else:
-        return f"{size_bytes/(1024*1024):.1f} MB"
+ARCHIVE_FORMATS = {"zip": ".zip", "tar": ".tar"}
 
 
-def main():
+HASH_CHUNK_SIZE = 256 * 1024
+
+
+class HashingStream:
     """
-    Main function to parse command-line arguments and call the extract_winmail_dat function.
+    Wraps a binary stream and computes the SHA-256 of the bytes passing through.
+
+    Data is hashed and written in cache-sized chunks, so each chunk is hashed
+    while it is still hot instead of rereading the output afterwards. Reads are
+    hashed too, which lets tarfile pull a member through the same wrapper.
     """
-    # Log startup information
-    logging.debug("==========================================")
-    logging.debug(f"Starting winmail_opener.py")
-    logging.debug(f"Working directory: {os.getcwd()}")
-    logging.debug(f"Command line args: {sys.argv}")
-    logging.debug(f"Python version: {sys.version}")
 
-    parser = argparse.ArgumentParser(
-        description="Extract attachments and email body from Winmail.dat files."
-    )  # Create an argument parser
-    parser.add_argument(
-        "winmail_dat_file", nargs="?", help="Path to the Winmail.dat file."
-    )  # Add an argument for the Winmail.dat file path
-    parser.add_argument(
-        "--file",
-        help="Alternative way to specify the Winmail.dat file path (for use with Open With)",
-    )
-    parser.add_argument(
-        "--version", action="version", version=f"winmail_opener {__version__}"
-    )
+    def __init__(self, stream):
+        self.stream = stream
+        self.hash = hashlib.sha256()
 
-    # Try to parse args, but don't exit on error
-    try:
-        args, unknown = parser.parse_known_args()
-        logging.debug(f"Parsed args: {args}")
-        if unknown:
-            logging.debug(f"Unknown args: {unknown}")
-    except Exception as e:
-        logging.error(f"Error parsing arguments: {e}")
-        args = None
+    def write(self, data):
+        view = memoryview(data)
+        for start in range(0, len(view), HASH_CHUNK_SIZE):
+            chunk = view[start : start + HASH_CHUNK_SIZE]
+            self.hash.update(chunk)
+            self.stream.write(chunk)
+        return len(view)
 
-    # Determine which file path to use with extensive logging
-    file_path = None
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.hash.update(data)
+        return data
 
-    # Try different ways to get the file path
-    if args and args.winmail_dat_file:
-        file_path = args.winmail_dat_file
-        logging.debug(f"Using file path from positional argument: {file_path}")
-    elif args and args.file:
-        file_path = args.file
-        logging.debug(f"Using file path from --file option: {file_path}")
-    elif len(sys.argv) > 1:
-        # This is a fallback in case argparse doesn't work
-        file_path = sys.argv[1]
-        logging.debug(f"Using file path from raw sys.argv[1]: {file_path}")
-    else:
-        logging.error("No file path specified in arguments")
+    def hexdigest(self):
+        return self.hash.hexdigest()
 
-    # Try to interpret macOS-specific paths if nothing else worked
-    if not file_path and len(sys.argv) > 1:
+
+# Writers only pay off with a spare core; on one CPU the handoff costs more
+WRITER_THREADS = min(4, (os.cpu_count() or 1) - 1)
+
+
+class AttachmentWriterPool:
+    """
+    Writes extracted files on background threads while the caller keeps going.
+
+    Each writer thread consumes a bounded queue, so submit() blocks once
+    max_pending writes are waiting. File I/O and SHA-256 hashing release the
+    GIL, which lets writes overlap with decoding the next attachment and
+    rendering the view. Jobs with the same key (the output path) always go to
+    the same thread, so a repeated file name is still written last-one-wins.
+    close() waits for every write and re-raises the first failure. Use as a
+    context manager so the writer threads are always stopped. With no workers,
+    jobs run synchronously in submit().
+    """
+
+    def __init__(self, workers=WRITER_THREADS, max_pending=2):
+        self.queues = [queue.Queue(max_pending) for _ in range(workers)]
+        self.errors = []
+        self.threads = [
+            threading.Thread(
+                target=self.run, args=(jobs,), name="winmail-writer", daemon=True
+            )
+            for jobs in self.queues
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, key, func, *args):
+        if self.queues:
+            self.queues[hash(key) % len(self.queues)].put((func, args))
+        else:
+            func(*args)
+
+    def run(self, jobs):
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            func, args = job
+            try:
+                func(*args)
+            except Exception as e:
+                self.errors.append(e)
+
+    def close(self):
+        threads, self.threads = self.threads, []
+        if threads:
+            for jobs in self.queues:
+                jobs.put(None)
+        for thread in threads:
+            thread.join()
+        if self.errors:
+            raise self.errors.pop(0)
+
+
+def write_attachment(attachment_info, data, archive_writer=None, dedup_store=None):
+    """Write one extracted file and record its SHA-256 in attachment_info"""
+    if archive_writer:
+        digest = archive_writer.add(attachment_info["name"], data)
+    elif dedup_store:
+        store_path, deduplicated = store_deduplicated_attachment(
+            data, dedup_store, attachment_info["path"]
+        )
+        # Store objects are named after their SHA-256
+        digest = os.path.basename(store_path)
+        attachment_info["store_path"] = store_path
+        attachment_info["deduplicated"] = deduplicated
+    else:
+        digest = write_file_hashed(attachment_info["path"], data)
+    attachment_info["sha256"] = digest
+
+
+def write_file_hashed(path, data):
+    """Write data to path and return its SHA-256 hex digest"""
+    with open(path, "wb") as f:
+        stream = HashingStream(f)
+        stream.write(data)
+    return stream.hexdigest()
+
+
+def manifest_json(source_name, entries):
+    """Serialize manifest entries for one message as UTF-8 JSON"""
+    manifest = {"source": source_name, "files": entries}
+    return json.dumps(manifest, indent=2, ensure_ascii=False).encode("utf-8")
+
+
+def update_manifest(output_dir, source_name, entries):
+    """
+    Merge entries into the manifest.json of output_dir and return its path.
+
+    The manifest lists every file extracted into the folder, keyed by name, so
+    a later message that reuses a name replaces the older entry. The file is
+    replaced atomically so readers never see a partial manifest, and the
+    update holds a lock so concurrent workers do not drop each other's entries.
+    """
+    manifest_path = os.path.join(output_dir, "manifest.json")
+    with locked_directory(output_dir):
+        merge_manifest(manifest_path, source_name, entries)
+    return manifest_path
+
+
+@contextlib.contextmanager
+def locked_directory(directory):
+    """
+    Hold an exclusive lock on directory while the block runs.
+
+    Locking the directory itself leaves no lock file among the extracted
+    files. Without fcntl (Windows) the block runs unlocked.
+    """
+    if not fcntl:
+        yield
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)  # Closing the descriptor releases the lock
+
+
+def merge_manifest(manifest_path, source_name, entries):
+    files = {}
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            files = {entry["name"]: entry for entry in json.load(f)["files"]}
+    except (OSError, ValueError, KeyError, TypeError):
+        pass  # Missing or unreadable manifests are rebuilt from scratch
+
+    for entry in entries:
+        files[entry["name"]] = dict(entry, source=source_name)
+
+    temp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"files": [files[name] for name in sorted(files)]},
+            f,
+            indent=2,
+            ensure_ascii=False,
+        )
+    os.replace(temp_path, manifest_path)
+
+
+class ArchiveWriter:
+    """
+    Streams attachments and the rendered view into one zip or tar archive.
+
+    Members are written directly from memory, so no loose files are created
+    on disk. Use as a context manager to finish the archive.
+    """
+
+    def __init__(self, path, archive_format):
+        self.path = path
+        self.format = archive_format
+        if archive_format == "zip":
+            self.archive = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+        elif archive_format == "tar":
+            self.archive = tarfile.open(path, "w")
+        else:
+            raise ValueError(f"Unknown archive format: {archive_format}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, name, data):
+        """Add a member with the given bytes and return their SHA-256 hex digest"""
+        if self.format == "zip":
+            with self.archive.open(name, "w") as member:
+                stream = HashingStream(member)
+                stream.write(data)
+        else:
+            stream = HashingStream(io.BytesIO(data))
+            self.add_tar_member(name, stream, len(data))
+        return stream.hexdigest()
+
+    def add_tar_member(self, name, fileobj, size):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        self.archive.addfile(info, fileobj)
+
+    @contextlib.contextmanager
+    def open_text(self, name):
+        """Yield a UTF-8 text stream whose contents become a member"""
+        if self.format == "zip":
+            with self.archive.open(name, "w") as member:
+                yield codecs.getwriter("utf-8")(member)
+        else:
+            # tar headers need the size up front; small views stay in memory
+            with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as spool:
+                yield codecs.getwriter("utf-8")(spool)
+                size = spool.tell()
+                spool.seek(0)
+                self.add_tar_member(name, spool, size)
+
+    def close(self):
+        self.archive.close()
+
+
+def store_deduplicated_attachment(data, store_dir, target_path):
+    """
+    Store attachment data once in a content-addressed store and link it to target_path.
+
+    Store objects live at <store_dir>/<first two hex digits>/<sha256>. The target
+    is a hardlink to the stored object, falling back to a reflink or a plain copy
+    when the store is on another filesystem.
+
+    Returns a tuple (store_path, deduplicated) where deduplicated is True if the
+    content was already present in the store.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    store_path = os.path.join(store_dir, digest[:2], digest)
+    deduplicated = os.path.exists(store_path)
+
+    if not deduplicated:
+        os.makedirs(os.path.dirname(store_path), exist_ok=True)
+        # Write to a unique temporary name first so concurrent writers (other
+        # processes or writer threads storing the same payload) never see or
+        # clobber partial objects
+        fd, temp_path = tempfile.mkstemp(
+            prefix=f"{digest}.", suffix=".tmp", dir=os.path.dirname(store_path)
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            # Stored objects are shared by every link, so protect them from edits
+            os.chmod(temp_path, 0o444)
+            os.replace(temp_path, store_path)
+        except FileNotFoundError:
+            # Identical content stored concurrently is just as good
+            if not os.path.exists(store_path):
+                raise
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        logger.debug(f"Stored new attachment object: {store_path}")
+    else:
+        logger.debug(f"Attachment already in store: {store_path}")
+
+    if os.path.lexists(target_path):
+        if os.path.exists(target_path) and os.path.samefile(store_path, target_path):
+            return store_path, deduplicated
+        os.remove(target_path)
+
+    try:
+        os.link(store_path, target_path)
+    except OSError as e:
+        logger.debug(f"Hardlink failed ({e}), falling back to reflink/copy")
+        clone_or_copy_file(store_path, target_path)
+
+    return store_path, deduplicated
+
+
+def clone_or_copy_file(source_path, target_path):
+    """Create target_path as a copy-on-write clone of source_path, or a plain copy"""
+    if sys.platform.startswith("linux"):
+        try:
+            import fcntl
+
+            FICLONE = 0x40049409
+            with open(source_path, "rb") as src, open(target_path, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return
+        except (ImportError, OSError) as e:
+            logger.debug(f"Reflink not available: {e}")
+    elif sys.platform == "darwin":
+        try:
+            import ctypes
+
+            libc = ctypes.CDLL(None, use_errno=True)
+            if (
+                libc.clonefile(os.fsencode(source_path), os.fsencode(target_path), 0)
+                == 0
+            ):
+                return
+        except (AttributeError, OSError) as e:
+            logger.debug(f"clonefile not available: {e}")
+
+    shutil.copyfile(source_path, target_path)
+
+
+# RTF destinations whose contents are never part of the visible text
+RTF_SKIPPED_DESTINATIONS = {
+    "fonttbl",
+    "colortbl",
+    "stylesheet",
+    "info",
+    "pict",
+    "header",
+    "footer",
+    "listtable",
+    "listoverridetable",
+    "rsidtbl",
+    "generator",
+    "themedata",
+    "colorschememapping",
+    "latentstyles",
+    "datastore",
+    "xmlnstbl",
+}
+
+RTF_TOKEN_PATTERN = re.compile(
+    rb"\\([a-zA-Z]+)(-?\d+)? ?|\\'([0-9a-fA-F]{2})|\\(.)|([{}])|([^\\{}\r\n]+)|[\r\n]+",
+    re.DOTALL,
+)
+
+
+def rtf_to_text(rtf_data, max_chars=None):
+    """
+    Extract the visible text from RTF data.
+
+    Font tables, style sheets, pictures and other ignorable destinations are
+    skipped. Stops early once max_chars characters have been produced.
+    """
+    text = []
+    produced = 0
+    for piece in iter_rtf_text(rtf_data):
+        text.append(piece)
+        produced += len(piece)
+        if max_chars is not None and produced >= max_chars:
+            break
+    return "".join(text)
+
+
+def iter_rtf_text(rtf_data):
+    """Yield the visible text of RTF data piece by piece"""
+    skip_depth = None
+    depth = 0
+    pending_skip = False
+    unicode_skip = 0
+
+    for match in RTF_TOKEN_PATTERN.finditer(rtf_data):
+        word, argument, hex_byte, symbol, brace, plain = match.groups()
+        if brace:
+            if brace == b"{":
+                depth += 1
+                pending_skip = True
+            else:
+                if skip_depth is not None and depth <= skip_depth:
+                    skip_depth = None
+                depth -= 1
+            continue
+
+        starts_group = pending_skip
+        pending_skip = False
+        if skip_depth is not None:
+            continue
+
+        piece = ""
+        if word:
+            name = word.decode("ascii")
+            if starts_group and name in RTF_SKIPPED_DESTINATIONS:
+                skip_depth = depth
+            elif name in ("par", "line"):
+                piece = "\n"
+            elif name == "tab":
+                piece = "\t"
+            elif name == "u" and argument:
+                piece = chr(int(argument) % 0x10000)
+                unicode_skip = 1
+        elif symbol:
+            if symbol == b"*" and starts_group:
+                # {\* ...} marks an ignorable destination
+                skip_depth = depth
+            elif symbol in (b"\\", b"{", b"}"):
+                piece = symbol.decode("ascii")
+            elif symbol == b"~":
+                piece = " "
+        elif hex_byte:
+            if unicode_skip:
+                unicode_skip -= 1
+            else:
+                piece = bytes([int(hex_byte, 16)]).decode("cp1252", "replace")
+        elif plain:
+            piece = plain.decode("cp1252", "replace")
+            if unicode_skip:
+                piece = piece[unicode_skip:]
+                unicode_skip = 0
+
+        if piece:
+            yield piece
+
+
+class HTMLTextExtractor(HTMLParser):
+    """Collects the visible text of an HTML document fed to it in chunks"""
+
+    HIDDEN_TAGS = {"script", "style", "head", "title", "noscript", "template"}
+    BREAK_TAGS = {"br", "p", "div", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6"}
+
+    def __init__(self, write=None):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        # Text goes straight to write when given, otherwise it is collected
+        self.write = write or self.parts.append
+        self.length = 0
+        self.hidden_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.HIDDEN_TAGS:
+            self.hidden_depth += 1
+        elif tag in self.BREAK_TAGS:
+            self.write("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.HIDDEN_TAGS and self.hidden_depth:
+            self.hidden_depth -= 1
+
+    def handle_data(self, data):
+        if not self.hidden_depth:
+            self.write(data)
+            self.length += len(data)
+
+    def text(self):
+        return "".join(self.parts)
+
+
+def html_to_text(html_data, max_chars=None, chunk_size=8192, write=None):
+    """
+    Extract the visible text from an HTML body (str or bytes).
+
+    The body is decoded and parsed chunk by chunk, and parsing stops as soon as
+    max_chars characters of text have been collected. If write is given, text is
+    streamed to it as it is found and an empty string is returned.
+    """
+    extractor = HTMLTextExtractor(write)
+    decoder = None
+    if isinstance(html_data, (bytes, bytearray)):
+        decoder = codecs.getincrementaldecoder("utf-8")("ignore")
+        html_data = memoryview(html_data)
+
+    for start in range(0, len(html_data), chunk_size):
+        chunk = html_data[start : start + chunk_size]
+        extractor.feed(decoder.decode(chunk) if decoder else chunk)
+        if max_chars is not None and extractor.length >= max_chars:
+            break
+    else:
+        extractor.close()
+
+    return extractor.text()
+
+
+def collapse_whitespace(text):
+    """Collapse runs of whitespace into single spaces"""
+    return " ".join(text.split())
+
+
+def get_body_preview(tnef, max_chars=200):
+    """
+    Return the first max_chars characters of the message body as plain text.
+
+    Uses the same body preference as the HTML view (HTML, then RTF, then plain
+    text) but only decodes as much of the body as the preview needs.
+    """
+    html_body = getattr(tnef, "htmlbody", None)
+    if html_body:
+        return collapse_whitespace(html_to_text(html_body, max_chars))[:max_chars]
+
+    if getattr(tnef, "_rtfbody", None) or getattr(tnef, "rtfbody", None):
+        # RTF headers (font and colour tables) come first, so grow the
+        # decompressed prefix until it yields enough visible text
+        prefix_size = max(4096, max_chars * 8)
+        while True:
+            rtf_body = get_rtf_body(tnef, max_size=prefix_size)
+            if not rtf_body:
+                break
+            text = collapse_whitespace(rtf_to_text(rtf_body, max_chars))
+            if len(text) >= max_chars or len(rtf_body) < prefix_size:
+                return text[:max_chars]
+            prefix_size *= 4
+
+    body = getattr(tnef, "body", None)
+    if body:
+        if isinstance(body, bytes):
+            body = body[: max_chars * 4].decode("utf-8", "ignore")
+        return collapse_whitespace(body[: max_chars * 2])[:max_chars]
+
+    return ""
+
+
+def preview(winmail_dat_file, max_chars=200):
+    """
+    Return a plain-text preview of the body of a Winmail.dat file (a path, bytes
+    or binary file object).
+
+    Nothing is extracted or rendered; only the start of the body is decoded.
+    Raises ValueError for files that are not valid TNEF.
+    """
+    file_content = read_winmail_source(winmail_dat_file)
+    tnef = tnefparse.TNEF(file_content, do_checksum=False)
+    return get_body_preview(tnef, max_chars)
+
+
+def select_body(tnef):
+    """
+    Select the message body to render, shared by all renderers.
+
+    Prefers the HTML body, then the RTF body, then plain text. Returns a tuple
+    (kind, content) where kind is "html", "rtf", "text" or None.
+    """
+    html_body = getattr(tnef, "htmlbody", None)
+    if html_body:
+        return "html", html_body
+
+    rtf_body = get_rtf_body(tnef)
+    if rtf_body:
+        return "rtf", rtf_body
+
+    body = getattr(tnef, "body", None)
+    if body:
+        if isinstance(body, bytes):
+            body = body.decode("utf-8", "ignore")
+        return "text", body
+
+    return None, None
+
+
+# Default stylesheet for the HTML view - replace it with --css
+DEFAULT_CSS = """
+    body {
+        font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Oxygen, Ubuntu, Cantarell, 'Open Sans', sans-serif;
+        line-height: 1.6;
+        color: #333;
+        max-width: 800px;
+        margin: 0 auto;
+        padding: 20px;
+    }
+    .header {
+        background-color: #f8f9fa;
+        border-radius: 8px;
+        padding: 15px;
+        margin-bottom: 20px;
+        box-shadow: 0 1px 3px rgba(0,0,0,0.1);
+    }
+    .metadata-item {
+        margin-bottom: 8px;
+    }
+    .metadata-label {
+        font-weight: bold;
+        color: #555;
+        width: 100px;
+        display: inline-block;
+    }
+    .body-container {
+        background-color: white;
+        border-radius: 8px;
+        padding: 20px;
+        margin-bottom: 20px;
+        border: 1px solid #e1e4e8;
+    }
+    .attachments {
+        background-color: #f8f9fa;
+        border-radius: 8px;
+        padding: 15px;
+        box-shadow: 0 1px 3px rgba(0,0,0,0.1);
+    }
+    .attachment-list {
+        list-style-type: none;
+        padding-left: 0;
+    }
+    .attachment-item {
+        padding: 8px 0;
+        border-bottom: 1px solid #eee;
+    }
+    .attachment-item:last-child {
+        border-bottom: none;
+    }
+    .attachment-link {
+        text-decoration: none;
+        color: #0366d6;
+    }
+    .attachment-link:hover {
+        text-decoration: underline;
+    }
+    .attachment-size {
+        color: #666;
+        font-size: 0.9em;
+    }
+    h1 {
+        color: #24292e;
+        font-size: 24px;
+        font-weight: 600;
+        margin-top: 0;
+    }
+    h2 {
+        color: #24292e;
+        font-size: 20px;
+        font-weight: 600;
+        margin-top: 0;
+        border-bottom: 1px solid #eaecef;
+        padding-bottom: 8px;
+    }
+"""
+
+# Default page shell for the HTML view - replace it with --template.
+# {{ field }} placeholders are filled from HTML_TEMPLATE_FIELDS.
+DEFAULT_HTML_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{{ title }}</title>
+    <style>{{ css }}</style>
+</head>
+<body>
+    <div class="header">
+        <h1>Email Content</h1>
+        {{ metadata }}
+    </div>
+    <div class="body-container">{{ body }}</div>
+    <div class="attachments">
+        <h2>Attachments</h2>
+        {{ attachments }}
+    </div>
+</body>
+</html>
+"""
+
+HTML_TEMPLATE_FIELDS = {"title", "css", "version", "metadata", "body", "attachments"}
+
+TEMPLATE_FIELD_PATTERN = re.compile(r"\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}")
+
+
+class CompiledTemplate:
+    """
+    A template compiled into a Python function.
+
+    Rendering calls write once per literal segment and once per field, so
+    large sections (like the message body) can be streamed by passing a
+    callable that takes write as the field value.
+    """
+
+    __slots__ = ("fields", "_render")
+
+    def __init__(self, fields, render_function):
+        self.fields = fields
+        self._render = render_function
+
+    def render(self, write, context):
+        """Render the template, writing output pieces with write"""
+        self._render(write, context)
+
+
+def _write_template_value(write, value):
+    if callable(value):
+        value(write)
+    elif value is not None:
+        write(str(value))
+
+
+@functools.lru_cache(maxsize=32)
+def compile_template(source, name="<template>"):
+    """
+    Compile template source with {{ field }} placeholders.
+
+    The template is turned into Python source with one write call per segment
+    and compiled to bytecode once; the result is cached by source text, so a
+    long-running process reuses the compiled template for every message.
+    """
+    parts = TEMPLATE_FIELD_PATTERN.split(source)
+    lines = ["def render(write, context):"]
+    fields = set()
+    for index, part in enumerate(parts):
+        if index % 2 == 0:
+            if part:
+                lines.append(f"    write({part!r})")
+        else:
+            fields.add(part)
+            lines.append(f"    emit(write, context[{part!r}])")
+    lines.append("    return None")
+
+    namespace = {"emit": _write_template_value}
+    exec(compile("\n".join(lines), name, "exec"), namespace)
+    return CompiledTemplate(frozenset(fields), namespace["render"])
+
+
+def load_template(path):
+    """Load and compile a template file (compiled templates are cached)"""
+    path = os.path.abspath(os.path.expanduser(path))
+    with open(path, "r", encoding="utf-8") as f:
+        source = f.read()
+    return compile_template(source, path)
+
+
+class Renderer:
+    """
+    Base class for message renderers.
+
+    Renderers write their output incrementally to a text stream (anything with a
+    write method) instead of building the whole document in memory.
+    """
+
+    name = None
+    extension = None
+
+    def render(self, tnef, attachments, out):
+        """Render the message and its extracted attachments to out"""
+        raise NotImplementedError
+
+    def render_to_string(self, tnef, attachments):
+        """Render the message and return the output as a string"""
+        buffer = io.StringIO()
+        self.render(tnef, attachments, buffer)
+        return buffer.getvalue()
+
+
+class HTMLRenderer(Renderer):
+    """
+    Renders the styled HTML page opened in the browser.
+
+    The page shell comes from a template (DEFAULT_HTML_TEMPLATE unless a
+    template file is given) that is compiled once and cached. A custom
+    stylesheet can replace DEFAULT_CSS. Remote images in HTML bodies are
+    blocked unless allow_remote_images is set.
+    """
+
+    name = "html"
+    extension = ".html"
+
+    def __init__(self, template=None, css=None, allow_remote_images=False):
+        self.allow_remote_images = allow_remote_images
+        if template:
+            self.template = load_template(template)
+        else:
+            self.template = compile_template(DEFAULT_HTML_TEMPLATE)
+        unknown_fields = self.template.fields - HTML_TEMPLATE_FIELDS
+        if unknown_fields:
+            raise ValueError(
+                f"Unknown template fields: {', '.join(sorted(unknown_fields))} "
+                f"(available: {', '.join(sorted(HTML_TEMPLATE_FIELDS))})"
+            )
+
+        if css:
+            with open(os.path.expanduser(css), "r", encoding="utf-8") as f:
+                self.css = f.read()
+        else:
+            self.css = DEFAULT_CSS
+
+    def render(self, tnef, attachments, out):
+        """
+        Write an HTML representation of winmail.dat content including:
+        - Metadata (From, To, Subject, Date, etc.)
+        - Email body (converted from RTF if available)
+        - Attachment links
+        """
+        context = {
+            "title": "Winmail.dat Content",
+            "css": self.css,
+            "version": __version__,
+            "metadata": lambda write: self.write_metadata(tnef, write),
+            "body": lambda write: self.write_body(tnef, write),
+            "attachments": lambda write: self.write_attachments(attachments, write),
+        }
+        self.template.render(out.write, context)
+
+    def write_metadata(self, tnef, write):
+        # Extract and display metadata
+        metadata = extract_metadata(tnef)
+        for key, value in metadata.items():
+            if value:  # Only display non-empty metadata
+                write(
+                    f'<div class="metadata-item"><span class="metadata-label">{key}:</span> {html.escape(str(value))}</div>\n'
+                )
+
+    def write_body(self, tnef, write):
+        kind, body = select_body(tnef)
+        if kind == "html":
+            # Use the HTML body content
+            write("<div>")
+            sanitize_html(body, write, allow_remote_images=self.allow_remote_images)
+            write("</div>")
+        elif kind == "rtf":
+            # Convert RTF to HTML
+            write(f"<div>{convert_rtf_to_html(body)}</div>")
+        elif kind == "text":
+            # Format plain text for HTML display (preserve line breaks)
+            body_html = html.escape(body, quote=False)
+            body_html = body_html.replace("\n", "<br>").replace("  ", "&nbsp;&nbsp;")
+            write(f"<div>{body_html}</div>")
+        else:
+            write("<div><em>No email body content found</em></div>")
+
+    def write_attachments(self, attachments, write):
+        if attachments:
+            write('<ul class="attachment-list">')
+            for attachment in attachments:
+                size_str = format_file_size(attachment["size"])
+                write(
+                    f"""
+            <li class="attachment-item">
+                <a href="{html.escape(attachment['url'])}" class="attachment-link">{html.escape(attachment['name'])}</a>
+                <span class="attachment-size"> ({size_str})</span>
+            </li>
+            """
+                )
+            write("</ul>")
+        else:
+            write("<p>No attachments found</p>")
+
+
+class TextRenderer(Renderer):
+    """Renders the message as plain text for terminals and indexing"""
+
+    name = "text"
+    extension = ".txt"
+
+    def write_body(self, tnef, out):
+        """Stream the selected body to out as plain text"""
+        kind, body = select_body(tnef)
+        if kind == "html":
+            html_to_text(body, write=out.write)
+        elif kind == "rtf":
+            for piece in iter_rtf_text(body):
+                out.write(piece)
+        elif kind == "text":
+            out.write(body)
+        else:
+            out.write("(No email body content found)")
+        out.write("\n")
+
+    def render(self, tnef, attachments, out):
+        for key, value in extract_metadata(tnef).items():
+            if value:
+                out.write(f"{key}: {value}\n")
+        out.write("\n")
+
+        self.write_body(tnef, out)
+
+        if attachments:
+            out.write("\nAttachments:\n")
+            for attachment in attachments:
+                size_str = format_file_size(attachment["size"])
+                out.write(f"  {attachment['name']} ({size_str}) {attachment['path']}\n")
+
+
+class MarkdownRenderer(TextRenderer):
+    """Renders the message as Markdown"""
+
+    name = "markdown"
+    extension = ".md"
+
+    def render(self, tnef, attachments, out):
+        metadata = extract_metadata(tnef)
+        out.write(f"# {metadata.get('Subject') or 'Email Content'}\n\n")
+        for key, value in metadata.items():
+            if value and key != "Subject":
+                out.write(f"- **{key}:** {value}\n")
+        out.write("\n")
+
+        self.write_body(tnef, out)
+
+        out.write("\n## Attachments\n\n")
+        if attachments:
+            for attachment in attachments:
+                size_str = format_file_size(attachment["size"])
+                url = attachment["url"].replace(" ", "%20")
+                out.write(f"- [{attachment['name']}]({url}) ({size_str})\n")
+        else:
+            out.write("No attachments found\n")
+
+
+# Output formats selectable with --format
+RENDERERS = {
+    renderer.name: renderer
+    for renderer in (HTMLRenderer, TextRenderer, MarkdownRenderer)
+}
+
+
+def get_renderer(name="html", **options):
+    """
+    Return a renderer instance for the given output format name.
+
+    Extra options (such as template and css for HTML) are passed to the
+    renderer's constructor.
+    """
+    try:
+        renderer_class = RENDERERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown output format: {name}") from None
+    return renderer_class(**options)
+
+
+def create_html_view(tnef, attachments):
+    """
+    Creates an HTML representation of winmail.dat content including:
+    - Metadata (From, To, Subject, Date, etc.)
+    - Email body (converted from RTF if available)
+    - Attachment links
+    """
+    return HTMLRenderer().render_to_string(tnef, attachments)
+
+
+# Page shell for the batch index. Rows are appended as messages are processed,
+# so the index never holds more than one message in memory.
+BATCH_INDEX_HEADER = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Winmail.dat Batch</title>
+    <style>{css}
+    .message-table {{ width: 100%; border-collapse: collapse; }}
+    .message-table th, .message-table td {{
+        text-align: left;
+        padding: 8px;
+        border-bottom: 1px solid #eee;
+        vertical-align: top;
+    }}
+    .message-failed {{ color: #b31d28; }}
+    </style>
+</head>
+<body>
+    <div class="header">
+        <h1>Winmail.dat Batch</h1>
+    </div>
+    <table class="message-table">
+        <tr><th>File</th><th>Subject</th><th>From</th><th>Date</th><th>Attachments</th></tr>
+"""
+
+BATCH_INDEX_FOOTER = """    </table>
+    {links}
+    <p class="attachment-size">{count} messages, {failed} failed</p>
+</body>
+</html>
+"""
+
+
+class BatchIndex:
+    """
+    Index page listing every message of a batch run.
+
+    Each message view is written into the batch directory by view_path(), and
+    add() appends the message's row to the index as soon as it is processed.
+    Only the index is opened in a viewer, once, at the end of the batch.
+    """
+
+    def __init__(self, directory, css=DEFAULT_CSS):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "index.html")
+        self.count = 0
+        self.failed = 0
+        self.links = []
+        self.file = open(self.path, "w", encoding="utf-8")
+        self.file.write(BATCH_INDEX_HEADER.format(css=css))
+
+    def view_path(self, file_path, extension, number=None):
+        """Return the path of the view for message number (default: the next one)"""
+        base_name = os.path.splitext(os.path.basename(file_path))[0]
+        number = number or self.count + 1
+        return os.path.join(self.directory, f"{number:04d}_{base_name}{extension}")
+
+    def add(self, file_path, result, error=None):
+        """Append a row for a processed message (result None if it failed)"""
+        self.count += 1
+        name = html.escape(os.path.basename(file_path))
+        if not result:
+            self.failed += 1
+            reason = html.escape((error or "could not be processed").capitalize())
+            self.file.write(
+                f'        <tr class="message-failed"><td>{name}</td>'
+                f'<td colspan="4">{reason}</td></tr>\n'
+            )
+            return
+
+        metadata = result.get("metadata", {})
+        link = html.escape(os.path.relpath(result["html_file"], self.directory))
+        cells = [
+            f'<a href="{link}" class="attachment-link">{name}</a>',
+            html.escape(str(metadata.get("Subject") or "")),
+            html.escape(str(metadata.get("From") or "")),
+            html.escape(str(metadata.get("Date Sent") or "")),
+            str(len(result["attachments"])),
+        ]
+        self.file.write(
+            "        <tr>" + "".join(f"<td>{cell}</td>" for cell in cells) + "</tr>\n"
+        )
+
+    def add_link(self, label, path):
+        """Link a batch-wide file, such as the combined calendar, below the list"""
+        link = html.escape(os.path.relpath(path, self.directory))
+        self.links.append(
+            f'<p><a href="{link}" class="attachment-link">{html.escape(label)}</a></p>'
+        )
+
+    def close(self):
+        """Finish the index page and return its path"""
+        if not self.file.closed:
+            self.file.write(
+                BATCH_INDEX_FOOTER.format(
+                    links="\n    ".join(self.links),
+                    count=self.count,
+                    failed=self.failed,
+                )
+            )
+            self.file.close()
+        return self.path
+
+
+class Launcher:
+    """
+    Opens a rendered message view in a viewer.
+
+    Launchers never wait for the viewer: the process is started in the
+    background and extraction continues immediately.
+    """
+
+    name = None
+
+    def launch(self, path):
+        """Open path, returning True if a viewer was started"""
+        raise NotImplementedError
+
+
+class NullLauncher(Launcher):
+    """Headless mode: leaves the rendered view on disk without opening it"""
+
+    name = "none"
+
+    def launch(self, path):
+        return False
+
+
+class CommandLauncher(Launcher):
+    """
+    Opens the view with an external command, e.g. "open" or "xdg-open".
+
+    command is a string or argument list. A "{}" argument is replaced with the
+    path of the view, otherwise the path is appended.
+    """
+
+    def __init__(self, command, name=None):
+        self.command = shlex.split(command) if isinstance(command, str) else command
+        self.name = name or self.command[0]
+
+    def launch(self, path):
+        if "{}" in self.command:
+            args = [path if arg == "{}" else arg for arg in self.command]
+        else:
+            args = self.command + [path]
+        try:
+            # Fire and forget; the viewer must not hold up extraction
+            subprocess.Popen(
+                args,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True,
+            )
+        except OSError as e:
+            logger.warning(f"Could not start viewer {args[0]}: {e}")
+            return False
+        logger.debug(f"Started viewer: {args}")
+        return True
+
+
+LAUNCHERS = {
+    "none": NullLauncher,
+    "open": lambda: CommandLauncher(["open"]),
+    "xdg-open": lambda: CommandLauncher(["xdg-open"]),
+}
+
+
+def get_launcher(name="auto", command=None):
+    """
+    Return a launcher by name ("auto", "none", "open" or "xdg-open"), or a
+    CommandLauncher for a custom command.
+
+    "auto" uses open on macOS and xdg-open elsewhere, falling back to headless
+    mode when no viewer command is available.
+    """
+    if command:
+        return CommandLauncher(command)
+    if name == "auto":
+        name = "open" if sys.platform == "darwin" else "xdg-open"
+        if not shutil.which(name):
+            name = "none"
+    try:
+        return LAUNCHERS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown launcher: {name}") from None
+
+
+def decode_text(value):
+    """Decode a string property (str, bytes or a list of either)"""
+    if isinstance(value, list):
+        value = value[0] if value else None
+    return get_tnef_value(value)
+
+
+def decode_date(value):
+    """Format a date property"""
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return get_tnef_value(value)
+
+
+def decode_int(value):
+    """Decode an integer property (int or little-endian bytes)"""
+    if isinstance(value, (bytes, bytearray)):
+        return int.from_bytes(value[:4], "little", signed=True)
+    return value
+
+
+def decode_enum(names):
+    """Return a decoder mapping integer property values to names"""
+
+    def decode(value):
+        value = decode_int(value)
+        return names.get(value, str(value))
+
+    return decode
+
+
+def decode_sender(value):
+    """Format an attFrom triple (display name, address type, address)"""
+    if isinstance(value, (tuple, list)) and len(value) == 3:
+        name, _, address = (get_tnef_value(part) or "" for part in value)
+        name = name.rstrip("\x00")
+        address = address.rstrip("\x00")
+        if name and address and name != address:
+            return f"{name} <{address}>"
+        return name or address
+    return get_tnef_value(value)
+
+
+def decode_binary(value):
+    """Keep binary properties as bytes"""
+    return value
+
+
+def decode_value(value):
+    """Keep a property value as decoded by tnefparse (dates, booleans)"""
+    return value
+
+
+# TNEF message attribute ids (attFrom, attSubject, ...) and MAPI property tags
+# decoded into message properties: id -> (key, decoder). MAPI properties are
+# applied after TNEF attributes, so the Unicode MAPI values win.
+TNEF_ATTRIBUTE_TABLE = {
+    0x8000: ("from", decode_sender),
+    0x8004: ("subject", decode_text),
+    0x8005: ("date_sent", decode_date),
+    0x8006: ("date_received", decode_date),
+    0x8008: ("message_class", decode_text),
+    0x8009: ("message_id", decode_text),
+    0x800B: ("conversation_id", decode_text),
+    0x000D: ("priority", decode_enum({1: "High", 2: "Normal", 3: "Low"})),
+    0x0006: ("start", decode_value),
+    0x0007: ("end", decode_value),
+}
+
+MAPI_PROPERTY_TABLE = {
+    0x0017: ("importance", decode_enum({0: "Low", 1: "Normal", 2: "High"})),
+    0x001A: ("message_class", decode_text),
+    0x0026: ("priority", decode_enum({-1: "Low", 0: "Normal", 1: "Urgent"})),
+    0x0036: (
+        "sensitivity",
+        decode_enum({0: "Normal", 1: "Personal", 2: "Private", 3: "Confidential"}),
+    ),
+    0x0037: ("subject", decode_text),
+    0x0039: ("date_sent", decode_date),
+    0x0042: ("sent_representing_name", decode_text),
+    0x0070: ("conversation_topic", decode_text),
+    0x007D: ("internet_headers", decode_text),
+    0x0C1A: ("sender_name", decode_text),
+    0x0C1F: ("sender_email", decode_text),
+    0x0E02: ("bcc", decode_text),
+    0x0E03: ("cc", decode_text),
+    0x0E04: ("to", decode_text),
+    0x0E06: ("date_received", decode_date),
+    0x1035: ("message_id", decode_text),
+    0x1042: ("in_reply_to", decode_text),
+    # Contact properties
+    0x3001: ("display_name", decode_text),
+    0x3A05: ("name_suffix", decode_text),
+    0x3A06: ("given_name", decode_text),
+    0x3A08: ("business_phone", decode_text),
+    0x3A09: ("home_phone", decode_text),
+    0x3A16: ("company", decode_text),
+    0x3A17: ("job_title", decode_text),
+    0x3A18: ("department", decode_text),
+    0x3A11: ("surname", decode_text),
+    0x3A1C: ("mobile_phone", decode_text),
+    0x3A24: ("business_fax", decode_text),
+    0x3A26: ("work_country", decode_text),
+    0x3A27: ("work_city", decode_text),
+    0x3A28: ("work_state", decode_text),
+    0x3A29: ("work_street", decode_text),
+    0x3A2A: ("work_postal_code", decode_text),
+    0x3A42: ("birthday", decode_value),
+    0x3A44: ("middle_name", decode_text),
+    0x3A45: ("name_prefix", decode_text),
+    0x3A50: ("personal_home_page", decode_text),
+    0x3A51: ("business_home_page", decode_text),
+    0x3A59: ("home_city", decode_text),
+    0x3A5A: ("home_country", decode_text),
+    0x3A5B: ("home_postal_code", decode_text),
+    0x3A5C: ("home_state", decode_text),
+    0x3A5D: ("home_street", decode_text),
+}
+
+PT_BINARY = 0x0102
+
+# Attachment properties
+PR_DISPLAY_NAME = 0x3001
+PR_ATTACH_EXTENSION = 0x3703
+PR_ATTACH_LONG_FILENAME = 0x3707
+PR_ATTACH_MIME_TAG = 0x370E
+
+# MAPI named property sets
+PSETID_APPOINTMENT = uuid.UUID("00062002-0000-0000-C000-000000000046")
+PSETID_MEETING = uuid.UUID("6ED8DA90-450B-101B-98DA-00AA003F1305")
+PSETID_TASK = uuid.UUID("00062003-0000-0000-C000-000000000046")
+PSETID_ADDRESS = uuid.UUID("00062004-0000-0000-C000-000000000046")
+
+TASK_STATUSES = {
+    0: "Not Started",
+    1: "In Progress",
+    2: "Completed",
+    3: "Waiting on someone else",
+    4: "Deferred",
+}
+
+# Named properties: (property set, long id) -> (key, decoder)
+NAMED_PROPERTY_TABLE = {
+    (PSETID_APPOINTMENT, 0x8208): ("location", decode_text),
+    (PSETID_APPOINTMENT, 0x820D): ("start", decode_value),
+    (PSETID_APPOINTMENT, 0x820E): ("end", decode_value),
+    (PSETID_APPOINTMENT, 0x8215): ("all_day", decode_value),
+    (PSETID_APPOINTMENT, 0x8216): ("recurrence", decode_binary),
+    (PSETID_APPOINTMENT, 0x8232): ("recurrence_pattern", decode_text),
+    (PSETID_APPOINTMENT, 0x823B): ("required_attendees", decode_text),
+    (PSETID_APPOINTMENT, 0x823C): ("optional_attendees", decode_text),
+    (PSETID_MEETING, 0x0002): ("where", decode_text),
+    (PSETID_MEETING, 0x0003): ("global_object_id", decode_binary),
+    (PSETID_TASK, 0x8101): ("task_status", decode_enum(TASK_STATUSES)),
+    (PSETID_TASK, 0x8102): ("percent_complete", decode_value),
+    (PSETID_TASK, 0x8104): ("task_start", decode_value),
+    (PSETID_TASK, 0x8105): ("due_date", decode_value),
+    (PSETID_TASK, 0x810F): ("date_completed", decode_value),
+    (PSETID_TASK, 0x811C): ("complete", decode_value),
+    (PSETID_TASK, 0x811F): ("task_owner", decode_text),
+    (PSETID_ADDRESS, 0x8005): ("file_under", decode_text),
+    (PSETID_ADDRESS, 0x8083): ("email", decode_text),
+    (PSETID_ADDRESS, 0x8093): ("email2", decode_text),
+    (PSETID_ADDRESS, 0x80A3): ("email3", decode_text),
+}
+
+# Properties shown as message metadata, in display order: key -> label
+METADATA_LABELS = {
+    "subject": "Subject",
+    "from": "From",
+    "to": "To",
+    "cc": "CC",
+    "bcc": "BCC",
+    "date_sent": "Date Sent",
+    "date_received": "Date Received",
+    "start": "Start",
+    "end": "End",
+    "location": "Location",
+    "recurrence_pattern": "Recurrence",
+    "importance": "Importance",
+    "sensitivity": "Sensitivity",
+    "priority": "Priority",
+    "message_class": "Message Class",
+    "message_id": "Message ID",
+    "conversation_id": "Conversation",
+    "display_name": "Name",
+    "company": "Company",
+    "email": "Email",
+    "task_status": "Status",
+    "due_date": "Due",
+}
+
+# Recipient display properties: key -> recipient kind
+RECIPIENT_KINDS = {"to": "To", "cc": "CC", "bcc": "BCC"}
+
+
+class MAPIProperty:
+    """A decoded message property"""
+
+    __slots__ = ("tag", "key", "value")
+
+    def __init__(self, tag, key, value):
+        self.tag = tag
+        self.key = key
+        self.value = value
+
+    def __repr__(self):
+        return f"MAPIProperty(0x{self.tag:04X}, {self.key!r}, {self.value!r})"
+
+
+class Recipient:
+    """A message recipient from the To, CC or BCC display list"""
+
+    __slots__ = ("kind", "name")
+
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+
+    def __repr__(self):
+        return f"Recipient({self.kind!r}, {self.name!r})"
+
+
+class MessageProperties:
+    """
+    Message properties decoded from a TNEF object, indexed by key.
+
+    Built by decode_properties in one pass over the TNEF attributes and the
+    MAPI property stream; lookups are plain dictionary accesses.
+    """
+
+    __slots__ = ("properties", "recipients")
+
+    def __init__(self):
+        self.properties = {}
+        self.recipients = []
+
+    def add(self, tag, key, value):
+        if value is not None and value != "":
+            self.properties[key] = MAPIProperty(tag, key, value)
+
+    def get(self, key, default=None):
+        prop = self.properties.get(key)
+        return prop.value if prop else default
+
+    def __contains__(self, key):
+        return key in self.properties
+
+    def metadata(self):
+        """Return the displayable properties as an ordered {label: value} dict"""
+        return {
+            label: self.properties[key].value
+            for key, label in METADATA_LABELS.items()
+            if key in self.properties
+        }
+
+
+# Attribute names read from objects without TNEF property streams, such as
+# message objects built in memory: attribute -> (key, decoder)
+LEGACY_ATTRIBUTES = {
+    "subject": ("subject", decode_text),
+    "from": ("from", decode_sender),
+    "to": ("to", decode_text),
+    "date_sent": ("date_sent", decode_date),
+    "date_received": ("date_received", decode_date),
+    "message_id": ("message_id", decode_text),
+    "message_class": ("message_class", decode_text),
+    "priority": ("priority", decode_text),
+    "conversation_id": ("conversation_id", decode_text),
+}
+
+# Decoded properties per TNEF object, so renderers and exporters share one pass
+_property_cache = weakref.WeakKeyDictionary()
+
+
+def decode_properties(tnef):
+    """
+    Decode the message properties of a TNEF object into MessageProperties.
+
+    TNEF attributes (msgprops) and MAPI properties (mapiprops) are looked up
+    by tag in TNEF_ATTRIBUTE_TABLE, MAPI_PROPERTY_TABLE and, for named
+    properties, NAMED_PROPERTY_TABLE; unknown tags are skipped. The result is
+    cached per object.
+    """
+    try:
+        return _property_cache[tnef]
+    except (KeyError, TypeError):
+        pass
+
+    props = MessageProperties()
+    msgprops = getattr(tnef, "msgprops", None)
+    mapiprops = getattr(tnef, "mapiprops", None)
+    if msgprops is None and mapiprops is None:
+        for attribute, (key, decoder) in LEGACY_ATTRIBUTES.items():
+            value = getattr(tnef, attribute, None)
+            if value is not None:
+                props.add(0, key, decoder(value))
+
+    for attribute in msgprops or ():
+        entry = TNEF_ATTRIBUTE_TABLE.get(attribute.name)
+        if entry:
+            key, decoder = entry
+            props.add(attribute.name, key, decoder(attribute.data))
+
+    for attribute in mapiprops or ():
+        if attribute.guid:
+            tag = attribute.guid_prop
+            entry = NAMED_PROPERTY_TABLE.get((attribute.guid, tag))
+        else:
+            tag = attribute.name
+            entry = MAPI_PROPERTY_TABLE.get(tag)
+        if entry:
+            key, decoder = entry
+            if attribute.attr_type == PT_BINARY:
+                # .data strips trailing NULs, which are significant in binary blobs;
+                # raw_data keeps them (padded to a multiple of four bytes)
+                value = b"".join(attribute.raw_data)
+            else:
+                value = attribute.data
+            props.add(tag or 0, key, decoder(value))
+
+    for key, kind in RECIPIENT_KINDS.items():
+        for name in (props.get(key) or "").split(";"):
+            if name.strip():
+                props.recipients.append(Recipient(kind, name.strip()))
+
+    try:
+        _property_cache[tnef] = props
+    except TypeError:
+        pass
+    return props
+
+
+def extract_metadata(tnef):
+    """Extract all available metadata from TNEF object"""
+    return decode_properties(tnef).metadata()
+
+
+# Message classes of calendar items -> iCalendar event STATUS
+CALENDAR_MESSAGE_CLASSES = {
+    "IPM.Appointment": "CONFIRMED",
+    "IPM.Microsoft Schedule.MtgReq": "CONFIRMED",
+    "IPM.Schedule.Meeting.Request": "CONFIRMED",
+    "IPM.Microsoft Schedule.MtgCncl": "CANCELLED",
+    "IPM.Schedule.Meeting.Canceled": "CANCELLED",
+}
+
+# Recurrence blob (PidLidAppointmentRecur) constants, see [MS-OXOCAL] 2.2.1.44
+RECUR_FREQUENCIES = {
+    0x200A: "DAILY",
+    0x200B: "WEEKLY",
+    0x200C: "MONTHLY",
+    0x200D: "YEARLY",
+}
+RECUR_WEEKDAYS = ("SU", "MO", "TU", "WE", "TH", "FR", "SA")
+RECUR_END_AFTER_DATE = 0x2021
+RECUR_END_AFTER_COUNT = 0x2022
+MAPI_EPOCH = datetime.datetime(1601, 1, 1)
+
+
+def is_calendar_item(props):
+    """Return True if the decoded message is a meeting request or appointment"""
+    return props.get("message_class") in CALENDAR_MESSAGE_CLASSES and "start" in props
+
+
+def recurrence_rule(blob, start=None):
+    """
+    Convert a PidLidAppointmentRecur blob into (RRULE value, excluded dates).
+
+    Daily, weekly, monthly (by day or nth weekday) and yearly patterns are
+    supported; returns (None, []) for anything else.
+    """
+    try:
+        frequency, pattern_type = struct.unpack_from("<HH", blob, 4)
+        (period,) = struct.unpack_from("<I", blob, 14)
+        offset = 22
+        days = nth = month_day = None
+        if pattern_type == 0x0001:
+            (days,) = struct.unpack_from("<I", blob, offset)
+            offset += 4
+        elif pattern_type in (0x0002, 0x0004):
+            (month_day,) = struct.unpack_from("<I", blob, offset)
+            offset += 4
+        elif pattern_type == 0x0003:
+            days, nth = struct.unpack_from("<II", blob, offset)
+            offset += 8
+        elif pattern_type != 0x0000:
+            return None, []
+        end_type, count, _, deleted = struct.unpack_from("<IIII", blob, offset)
+        offset += 16
+        deleted_dates = struct.unpack_from(f"<{deleted}I", blob, offset)
+        offset += 4 * deleted
+        (modified,) = struct.unpack_from("<I", blob, offset)
+        offset += 4 + 4 * modified
+        _, end_date = struct.unpack_from("<II", blob, offset)
+    except struct.error:
+        return None, []
+
+    freq = RECUR_FREQUENCIES.get(frequency)
+    if not freq:
+        return None, []
+    if freq == "DAILY" and pattern_type == 0x0001:
+        freq, interval = "WEEKLY", period  # Every weekday
+    elif freq == "DAILY":
+        interval = max(period // 1440, 1)
+    elif freq == "YEARLY":
+        interval = max(period // 12, 1)
+    else:
+        interval = period
+
+    parts = [f"FREQ={freq}"]
+    if interval > 1:
+        parts.append(f"INTERVAL={interval}")
+    if days:
+        weekdays = [day for bit, day in enumerate(RECUR_WEEKDAYS) if days & (1 << bit)]
+        parts.append(f"BYDAY={','.join(weekdays)}")
+    if nth:
+        parts.append(f"BYSETPOS={-1 if nth == 5 else nth}")
+    if month_day:
+        parts.append(f"BYMONTHDAY={-1 if pattern_type == 0x0004 else month_day}")
+    if freq == "YEARLY" and start:
+        parts.append(f"BYMONTH={start.month}")
+    if end_type == RECUR_END_AFTER_COUNT:
+        parts.append(f"COUNT={count}")
+    elif end_type == RECUR_END_AFTER_DATE:
+        until = MAPI_EPOCH + datetime.timedelta(minutes=end_date)
+        parts.append(f"UNTIL={until:%Y%m%d}T235959Z")
+
+    excluded = []
+    for minutes in deleted_dates:
+        date = MAPI_EPOCH + datetime.timedelta(minutes=minutes)
+        if start:
+            date = datetime.datetime.combine(date.date(), start.time())
+        excluded.append(date)
+    return ";".join(parts), excluded
+
+
+def escape_ics_text(value):
+    """Escape a TEXT value for iCalendar and vCard"""
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def quote_ics_param(value):
+    """Quote a parameter value (e.g. CN) for iCalendar"""
+    # Quoted values cannot contain DQUOTE or control characters at all
+    value = "".join(c for c in str(value) if c == "\t" or c >= " " and c != "\x7f")
+    return '"' + value.replace('"', "'") + '"'
+
+
+def fold_ics_line(line):
+    """Fold a content line at 75 octets without splitting UTF-8 characters"""
+    if len(line.encode("utf-8")) <= 75:
+        return line + "\r\n"
+    pieces = []
+    current = ""
+    size = 0
+    for char in line:
+        char_size = len(char.encode("utf-8"))
+        if size + char_size > 75:
+            pieces.append(current)
+            current, size = " ", 1
+        current += char
+        size += char_size
+    pieces.append(current)
+    return "\r\n".join(pieces) + "\r\n"
+
+
+def format_ics_time(value):
+    """Format a UTC datetime as an iCalendar DATE-TIME"""
+    return value.strftime("%Y%m%dT%H%M%SZ")
+
+
+def split_attendees(value):
+    """Split a semicolon-separated attendee list"""
+    return [name.strip() for name in (value or "").split(";") if name.strip()]
+
+
+class CalendarWriter:
+    """
+    Streams meeting requests into an iCalendar (.ics) file.
+
+    The calendar header is written on creation, each add() writes one VEVENT
+    straight to out, and close() ends the calendar, so any number of meetings
+    can be combined without keeping them in memory. With header=False only
+    the VEVENTs are written, for passing to write_events() of another writer.
+    """
+
+    def __init__(self, out, header=True):
+        self.out = out
+        self.count = 0
+        if header:
+            self.write_line("BEGIN:VCALENDAR")
+            self.write_line("VERSION:2.0")
+            self.write_line(f"PRODID:-//py-winmail-opener//{__version__}//EN")
+
+    def write_events(self, text, count):
+        """Append count VEVENTs collected by a header=False writer"""
+        self.out.write(text)
+        self.count += count
+
+    def write_line(self, line):
+        self.out.write(fold_ics_line(line))
+
+    def add(self, tnef, props=None):
+        """Write the meeting request in tnef as a VEVENT"""
+        props = props or decode_properties(tnef)
+        start = props.get("start")
+        end = props.get("end") or start
+        subject = props.get("subject") or ""
+
+        global_id = props.get("global_object_id")
+        if global_id:
+            uid = global_id.hex().upper()
+        else:
+            uid = hashlib.sha1(f"{subject}|{start}".encode("utf-8")).hexdigest()
+
+        self.write_line("BEGIN:VEVENT")
+        self.write_line(f"UID:{uid}")
+        self.write_line(
+            f"DTSTAMP:{format_ics_time(datetime.datetime.now(datetime.timezone.utc))}"
+        )
+        if props.get("all_day"):
+            self.write_line(f"DTSTART;VALUE=DATE:{start:%Y%m%d}")
+            self.write_line(f"DTEND;VALUE=DATE:{end:%Y%m%d}")
+        else:
+            self.write_line(f"DTSTART:{format_ics_time(start)}")
+            self.write_line(f"DTEND:{format_ics_time(end)}")
+        self.write_line(f"SUMMARY:{escape_ics_text(subject)}")
+
+        location = props.get("location") or props.get("where")
+        if location:
+            self.write_line(f"LOCATION:{escape_ics_text(location)}")
+
+        recurrence = props.get("recurrence")
+        if recurrence:
+            rule, excluded = recurrence_rule(recurrence, start)
+            if rule:
+                self.write_line(f"RRULE:{rule}")
+                for date in excluded:
+                    self.write_line(f"EXDATE:{format_ics_time(date)}")
+
+        organizer = props.get("from") or props.get("sender_name")
+        if organizer:
+            name, _, address = organizer.rpartition(" <")
+            if address.endswith(">"):
+                address = address[:-1]
+            else:
+                name, address = organizer, props.get("sender_email") or ""
+            if "@" in address:
+                cn = quote_ics_param(name or address)
+                address = quote_ics_param(address)[1:-1]
+                self.write_line(f"ORGANIZER;CN={cn}:mailto:{address}")
+
+        required = split_attendees(props.get("required_attendees"))
+        optional = split_attendees(props.get("optional_attendees"))
+        if not (required or optional):
+            required = [r.name for r in props.recipients if r.kind == "To"]
+            optional = [r.name for r in props.recipients if r.kind == "CC"]
+        for role, names in (
+            ("REQ-PARTICIPANT", required),
+            ("OPT-PARTICIPANT", optional),
+        ):
+            for name in names:
+                cn = quote_ics_param(name)
+                address = f"mailto:{cn[1:-1]}" if "@" in name else "invalid:nomail"
+                self.write_line(f"ATTENDEE;CN={cn};ROLE={role}:{address}")
+
+        description = getattr(tnef, "body", None)
+        if not description and getattr(tnef, "htmlbody", None):
+            description = html_to_text(tnef.htmlbody)
+        if description:
+            self.write_line(
+                f"DESCRIPTION:{escape_ics_text(get_tnef_value(description))}"
+            )
+
+        status = CALENDAR_MESSAGE_CLASSES.get(props.get("message_class"), "CONFIRMED")
+        self.write_line(f"STATUS:{status}")
+        self.write_line("END:VEVENT")
+        self.count += 1
+
+    def close(self):
+        self.write_line("END:VCALENDAR")
+
+
+def message_class_matches(message_class, classes):
+    """Return True if message_class is one of classes or a subclass of one"""
+    message_class = message_class or ""
+    return any(
+        message_class == name or message_class.startswith(name + ".")
+        for name in classes
+    )
+
+
+def json_value(value):
+    """Convert property values that JSON cannot represent"""
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.hex()
+    return str(value)
+
+
+# Property keys exported for contacts and tasks, in output order
+CONTACT_FIELDS = (
+    "display_name", "name_prefix", "given_name", "middle_name", "surname",
+    "name_suffix", "file_under", "company", "department", "job_title", "email",
+    "email2", "email3", "business_phone", "home_phone", "mobile_phone",
+    "business_fax", "business_home_page", "personal_home_page", "birthday",
+    "work_street", "work_city", "work_state", "work_postal_code", "work_country",
+    "home_street", "home_city", "home_state", "home_postal_code", "home_country",
+)  # fmt: skip
+TASK_FIELDS = (
+    "subject", "task_status", "percent_complete", "complete", "task_start",
+    "due_date", "date_completed", "task_owner", "importance", "sensitivity",
+)  # fmt: skip
+
+
+class ItemExporter:
+    """
+    Exports an Outlook item (meeting, contact, task) carried in a TNEF file.
+
+    Exporters work from the MessageProperties decoded once by
+    decode_properties, so no attribute is parsed twice.
+    """
+
+    name = None
+    extension = None
+    mime_type = None
+    description = None
+    message_classes = ()
+
+    def accepts(self, props):
+        return message_class_matches(props.get("message_class"), self.message_classes)
+
+    def file_name(self, props):
+        title = props.get("subject") or props.get("display_name")
+        return safe_file_name(title, self.description) + self.extension
+
+    def export(self, tnef, props, out):
+        """Write the item to the text stream out"""
+        raise NotImplementedError
+
+    def export_bytes(self, tnef, props):
+        out = io.StringIO()
+        self.export(tnef, props, out)
+        return out.getvalue().encode("utf-8")
+
+
+class ICalendarExporter(ItemExporter):
+    """Meeting requests and appointments as iCalendar"""
+
+    name = "ics"
+    extension = ".ics"
+    mime_type = "text/calendar"
+    description = "meeting"
+
+    def accepts(self, props):
+        return is_calendar_item(props)
+
+    def export(self, tnef, props, out):
+        calendar = CalendarWriter(out)
+        calendar.add(tnef, props)
+        calendar.close()
+
+
+class VCardExporter(ItemExporter):
+    """Contacts as vCard 4.0"""
+
+    name = "vcf"
+    extension = ".vcf"
+    mime_type = "text/vcard"
+    description = "contact"
+    message_classes = ("IPM.Contact",)
+
+    def export(self, tnef, props, out):
+        def line(value):
+            out.write(fold_ics_line(value))
+
+        def components(*keys):
+            return ";".join(escape_ics_text(props.get(key) or "") for key in keys)
+
+        full_name = props.get("display_name") or " ".join(
+            props.get(key)
+            for key in ("given_name", "middle_name", "surname")
+            if props.get(key)
+        )
+        line("BEGIN:VCARD")
+        line("VERSION:4.0")
+        line(f"FN:{escape_ics_text(full_name or props.get('subject') or '')}")
+        line(
+            "N:"
+            + components(
+                "surname", "given_name", "middle_name", "name_prefix", "name_suffix"
+            )
+        )
+        if props.get("company") or props.get("department"):
+            line("ORG:" + components("company", "department"))
+        if props.get("job_title"):
+            line(f"TITLE:{escape_ics_text(props.get('job_title'))}")
+        for key in ("email", "email2", "email3"):
+            if props.get(key):
+                line(f"EMAIL:{escape_ics_text(props.get(key))}")
+        for key, types in (
+            ("business_phone", "work,voice"),
+            ("home_phone", "home,voice"),
+            ("mobile_phone", "cell"),
+            ("business_fax", "work,fax"),
+        ):
+            if props.get(key):
+                line(f'TEL;VALUE=text;TYPE="{types}":{escape_ics_text(props.get(key))}')
+        for kind in ("work", "home"):
+            keys = [
+                f"{kind}_{part}"
+                for part in ("street", "city", "state", "postal_code", "country")
+            ]
+            if any(props.get(key) for key in keys):
+                line(f"ADR;TYPE={kind}:;;" + components(*keys))
+        for key in ("business_home_page", "personal_home_page"):
+            if props.get(key):
+                line(f"URL:{props.get(key)}")
+        birthday = props.get("birthday")
+        if isinstance(birthday, (datetime.datetime, datetime.date)):
+            line(f"BDAY:{birthday:%Y%m%d}")
+        note = get_tnef_value(getattr(tnef, "body", None))
+        if note:
+            line(f"NOTE:{escape_ics_text(note)}")
+        line("END:VCARD")
+
+
+class JSONExporter(ItemExporter):
+    """Contacts and tasks as JSON"""
+
+    name = "json"
+    extension = ".json"
+    mime_type = "application/json"
+    description = "item"
+    message_classes = ("IPM.Contact", "IPM.Task")
+
+    def export(self, tnef, props, out):
+        if message_class_matches(props.get("message_class"), ("IPM.Task",)):
+            item = {"type": "task"}
+            fields = TASK_FIELDS
+        else:
+            item = {"type": "contact"}
+            fields = CONTACT_FIELDS
+        item.update((key, props.get(key)) for key in fields if key in props)
+        body = get_tnef_value(getattr(tnef, "body", None))
+        if body:
+            item["body"] = body
+        json.dump(item, out, indent=2, ensure_ascii=False, default=json_value)
+        out.write("\n")
+
+
+ITEM_EXPORTERS = (ICalendarExporter(), VCardExporter(), JSONExporter())
+
+
+def safe_file_name(name, default="message"):
+    """Turn a subject line into a file name"""
+    name = re.sub(r'[\\/:*?"<>|\x00-\x1f]', "_", name or "").strip(" .")
+    return name[:80] or default
+
+
+def get_tnef_value(value):
+    """Safely extract and decode TNEF attribute values"""
+    if value is None:
+        return None
+
+    if isinstance(value, bytes):
+        try:
+            return value.decode("utf-8", "ignore")
+        except:
+            return str(value)
+
+    return str(value)
+
+
+class HTMLSanitizer(HTMLParser):
+    """
+    Single-pass, allowlist-based HTML sanitizer.
+
+    Only known-safe tags and attributes are kept. Scripts, frames, embedded
+    objects, forms, event handlers and javascript: URLs are removed. Every
+    <style> block is kept, minus imports, expressions and remote url()
+    references. Remote images are blocked unless allow_remote_images is set, so
+    opening a message never contacts trackers. Sanitized output is passed to
+    write as it is produced.
+    """
+
+    ALLOWED_TAGS = {
+        "a", "abbr", "address", "b", "big", "blockquote", "br", "caption",
+        "center", "cite", "code", "col", "colgroup", "dd", "del", "div", "dl",
+        "dt", "em", "font", "h1", "h2", "h3", "h4", "h5", "h6", "hr", "i", "img",
+        "ins", "kbd", "li", "ol", "p", "pre", "q", "s", "small", "span", "strike",
+        "strong", "sub", "sup", "table", "tbody", "td", "tfoot", "th", "thead",
+        "tr", "tt", "u", "ul", "wbr",
+    }  # fmt: skip
+    # Tags removed together with everything inside them
+    DROP_CONTENT_TAGS = {
+        "script", "iframe", "frame", "frameset", "object", "embed", "applet",
+        "noscript", "template", "title", "form", "button", "select", "textarea",
+        "svg", "math", "audio", "video",
+    }  # fmt: skip
+    VOID_TAGS = {"br", "col", "hr", "img", "wbr"}
+    ALLOWED_ATTRIBUTES = {
+        "align", "alt", "bgcolor", "border", "cellpadding", "cellspacing",
+        "class", "color", "colspan", "dir", "face", "height", "href", "id", "lang",
+        "rowspan", "size", "span", "src", "start", "style", "title", "type",
+        "valign", "width",
+    }  # fmt: skip
+    URL_ATTRIBUTES = {"href", "src"}
+    SAFE_URL_SCHEMES = {"http", "https", "mailto", "cid", "file", "tel"}
+
+    REMOTE_URL_PATTERN = re.compile(r"^\s*(https?:)?//", re.IGNORECASE)
+    CSS_IMPORT_PATTERN = re.compile(r"@import[^;]*;?", re.IGNORECASE)
+    CSS_DANGEROUS_PATTERN = re.compile(
+        r"expression\s*\(|javascript:|behavior\s*:|-moz-binding", re.IGNORECASE
+    )
+    CSS_REMOTE_URL_PATTERN = re.compile(
+        r"url\(\s*['\"]?\s*(https?:)?//[^)]*\)", re.IGNORECASE
+    )
+    CSS_IMAGE_SET_PATTERN = re.compile(
+        r"(-webkit-)?image-set\s*\((?:[^()]|\([^()]*\))*\)?", re.IGNORECASE
+    )
+    CSS_REMOTE_STRING_PATTERN = re.compile(r"['\"(]\s*(https?:)?//", re.IGNORECASE)
+    CSS_ESCAPE_PATTERN = re.compile(r"\\([0-9a-fA-F]{1,6}\s?|.)", re.DOTALL)
+    CSS_COMMENT_PATTERN = re.compile(r"/\*.*?(\*/|$)", re.DOTALL)
+
+    def __init__(self, write, allow_remote_images=False):
+        super().__init__(convert_charrefs=True)
+        self.write = write
+        self.allow_remote_images = allow_remote_images
+        self.drop_stack = []
+        self.in_style = False
+
+    @staticmethod
+    def decode_css_escape(match):
+        escape = match.group(1)
+        if escape == "\n":
+            return ""  # Line continuation
+        try:
+            code_point = int(escape, 16)
+        except ValueError:
+            return escape  # An escaped literal character
+        if not 0 < code_point <= sys.maxunicode or 0xD800 <= code_point <= 0xDFFF:
+            return "\ufffd"
+        return chr(code_point)
+
+    def sanitize_css(self, css):
+        """Remove imports, expressions and (optionally) remote resources from CSS"""
+        # Decode escapes and comments first so "u\72l(" or "@imp/**/ort" cannot
+        # hide from the patterns below; decoding repeats until nothing changes
+        # so the output is never decoded into something else by the browser
+        while True:
+            decoded = self.CSS_ESCAPE_PATTERN.sub(self.decode_css_escape, css)
+            decoded = self.CSS_COMMENT_PATTERN.sub("", decoded)
+            if decoded == css:
+                break
+            css = decoded
+        css = css.replace("\\", "")
+        css = self.CSS_IMPORT_PATTERN.sub("", css)
+        css = self.CSS_DANGEROUS_PATTERN.sub("blocked:", css)
+        if not self.allow_remote_images:
+            css = self.CSS_REMOTE_URL_PATTERN.sub("none", css)
+            css = self.CSS_IMAGE_SET_PATTERN.sub(self.block_remote_image_set, css)
+        return css
+
+    def block_remote_image_set(self, match):
+        # image-set() takes bare strings as well as url()s
+        if self.CSS_REMOTE_STRING_PATTERN.search(match.group()):
+            return "none"
+        return match.group()
+
+    def is_safe_url(self, url):
+        url = url.strip()
+        scheme, separator, _ = url.partition(":")
+        if not separator or "/" in scheme or "?" in scheme or "#" in scheme:
+            return True  # Relative URL
+        scheme = scheme.lower()
+        if scheme == "data":
+            return url[5:].lstrip().lower().startswith("image/")
+        return scheme in self.SAFE_URL_SCHEMES
+
+    def format_attributes(self, tag, attrs):
+        parts = []
+        for name, value in attrs:
+            if name not in self.ALLOWED_ATTRIBUTES or value is None:
+                continue
+            if name in self.URL_ATTRIBUTES:
+                if not self.is_safe_url(value):
+                    continue
+                if (
+                    tag == "img"
+                    and not self.allow_remote_images
+                    and self.REMOTE_URL_PATTERN.match(value)
+                ):
+                    # Keep the address for reference without fetching it
+                    name = "data-blocked-src"
+            elif name == "style":
+                value = self.sanitize_css(value)
+            parts.append(f' {name}="{html.escape(value, quote=True)}"')
+        if tag == "a":
+            parts.append(' rel="noopener noreferrer"')
+        return "".join(parts)
+
+    def handle_starttag(self, tag, attrs):
+        if self.drop_stack:
+            if tag in self.DROP_CONTENT_TAGS:
+                self.drop_stack.append(tag)
+            return
+        if tag in self.DROP_CONTENT_TAGS:
+            self.drop_stack.append(tag)
+        elif tag == "style":
+            self.in_style = True
+            self.write("<style>")
+        elif tag in self.ALLOWED_TAGS:
+            self.write(f"<{tag}{self.format_attributes(tag, attrs)}>")
+
+    def handle_startendtag(self, tag, attrs):
+        if self.drop_stack or tag in self.DROP_CONTENT_TAGS:
+            return
+        if tag in self.ALLOWED_TAGS:
+            self.write(f"<{tag}{self.format_attributes(tag, attrs)}>")
+
+    def handle_endtag(self, tag):
+        if self.drop_stack:
+            if tag in self.drop_stack:
+                # Unwind to the matching open tag, tolerating unclosed children
+                while self.drop_stack.pop() != tag:
+                    pass
+            return
+        if tag == "style":
+            if self.in_style:
+                self.in_style = False
+                self.write("</style>")
+        elif tag in self.ALLOWED_TAGS and tag not in self.VOID_TAGS:
+            self.write(f"</{tag}>")
+
+    def handle_data(self, data):
+        if self.drop_stack:
+            return
+        if self.in_style:
+            # Style content is raw text; only "</" could break out of it
+            self.write(self.sanitize_css(data).replace("</", "<\\/"))
+        else:
+            self.write(html.escape(data, quote=False))
+
+    def close(self):
+        super().close()
+        if self.in_style:
+            self.in_style = False
+            self.write("</style>")
+
+
+def sanitize_html(html_data, write, allow_remote_images=False, chunk_size=65536):
+    """
+    Stream a sanitized copy of an HTML body to write.
+
+    html_data may be str, bytes or a binary file object. The body is decoded
+    and parsed chunk by chunk and sanitized markup is written as soon as it is
+    produced, so memory use does not grow with the size of the body.
+    """
+    sanitizer = HTMLSanitizer(write, allow_remote_images=allow_remote_images)
+    if isinstance(html_data, str):
+        for start in range(0, len(html_data), chunk_size):
+            sanitizer.feed(html_data[start : start + chunk_size])
+    else:
+        decoder = codecs.getincrementaldecoder("utf-8")("ignore")
+        if isinstance(html_data, (bytes, bytearray, memoryview)):
+            data = memoryview(html_data)
+            chunks = (
+                data[start : start + chunk_size]
+                for start in range(0, len(data), chunk_size)
+            )
+        else:
+            chunks = iter(functools.partial(html_data.read, chunk_size), b"")
+        for chunk in chunks:
+            sanitizer.feed(decoder.decode(chunk))
+        sanitizer.feed(decoder.decode(b"", final=True))
+    sanitizer.close()
+
+
+def sanitize_html_content(html_content, allow_remote_images=False):
+    """
+    Clean up and sanitize HTML content from winmail.dat files
+    to make it safe for display and properly formatted.
+
+    Returns the sanitized markup of the document's styles and body, without
+    the surrounding html/head/body elements. See HTMLSanitizer for the rules
+    and sanitize_html for the streaming variant used by the HTML view.
+    """
+    parts = []
+    sanitize_html(html_content, parts.append, allow_remote_images=allow_remote_images)
+    return "".join(parts)
+
+
+# Initial dictionary contents for MS compressed RTF (MS-OXRTFCP 3.1.2)
+RTF_INITIAL_DICTIONARY = (
+    b"{\\rtf1\\ansi\\mac\\deff0\\deftab720{\\fonttbl;}{\\f0\\fnil \\froman "
+    b"\\fswiss \\fmodern \\fscript \\fdecor MS Sans SerifSymbolArialTimes New "
+    b"RomanCourier{\\colortbl\\red0\\green0\\blue0\r\n\\par "
+    b"\\pard\\plain\\f0\\fs20\\b\\i\\u\\tab\\tx"
+)
+RTF_COMPRESSED_LZFU = 0x75465A4C  # "LZFu"
+RTF_COMPRESSED_MELA = 0x414C454D  # "MELA" (stored uncompressed)
+RTF_DICTIONARY_SIZE = 4096
+# Each 2-byte reference expands to at most 17 bytes, so a valid stream can
+# never be more than ~9x larger than its compressed size
+RTF_MAX_EXPANSION = 9
+
+
+def decompress_rtf(data, max_size=None, validate=True):
+    """
+    Decompress an MS compressed RTF (LZFu) stream, as stored in PR_RTF_COMPRESSED.
+
+    Output is produced into a preallocated bytearray. Back-references are
+    copied as slices rather than byte by byte, and consecutive literals are
+    copied in one step. If max_size is given, decoding stops as soon as that
+    many bytes have been produced, so previews never pay for the whole body.
+
+    With validate=True the header sizes and the CRC of the compressed data are
+    checked. Raises ValueError for malformed streams.
+    """
+    data = memoryview(data).cast("B")
+    if len(data) < 16:
+        raise ValueError("Compressed RTF header is truncated")
+
+    comp_size, raw_size, magic, crc = struct.unpack_from("<IIII", data)
+    end = comp_size + 4
+    if end < 16:
+        raise ValueError(f"Invalid compressed RTF size: {comp_size}")
+
+    limit = raw_size if max_size is None else min(raw_size, max_size)
+
+    if magic == RTF_COMPRESSED_MELA:
+        return bytes(data[16 : 16 + limit])
+    if magic != RTF_COMPRESSED_LZFU:
+        raise ValueError(f"Unknown compressed RTF type: {magic:#010x}")
+
+    if len(data) < end:
+        # MAPI binary properties may lose trailing NUL bytes; restore them
+        missing = end - len(data)
+        if missing > RTF_DICTIONARY_SIZE:
+            raise ValueError("Compressed RTF stream is truncated")
+        data = memoryview(bytes(data) + b"\x00" * missing)
+
+    payload = data[16:end]
+    if validate:
+        if raw_size > len(payload) * RTF_MAX_EXPANSION + RTF_DICTIONARY_SIZE:
+            raise ValueError(
+                f"Compressed RTF declares {raw_size} bytes from {len(payload)} bytes of input"
+            )
+        # The LZFu CRC is CRC-32 without the usual pre- and post-inversion
+        actual_crc = zlib.crc32(payload, 0xFFFFFFFF) ^ 0xFFFFFFFF
+        if actual_crc != crc:
+            raise ValueError(
+                f"Compressed RTF CRC mismatch: {actual_crc:#010x} != {crc:#010x}"
+            )
+
+    # Decode into one buffer holding the initial dictionary followed by the
+    # output; dictionary offsets map onto the most recent 4096 bytes of it.
+    base = len(RTF_INITIAL_DICTIONARY)
+    capacity = min(limit, len(payload) * RTF_MAX_EXPANSION)
+    out = bytearray(base + capacity + 17)
+    out[:base] = RTF_INITIAL_DICTIONARY
+    target = base + limit
+    pos = base
+    index = 0
+    payload_len = len(payload)
+
+    while pos < target and index < payload_len:
+        control = payload[index]
+        index += 1
+        bit = 0
+        while bit < 8 and pos < target:
+            if not control & (1 << bit):
+                # Copy the run of literal bytes flagged by consecutive zero bits
+                run = 1
+                while bit + run < 8 and not control & (1 << (bit + run)):
+                    run += 1
+                run = min(run, payload_len - index, target - pos)
+                if run <= 0:
+                    break
+                out[pos : pos + run] = payload[index : index + run]
+                pos += run
+                index += run
+                bit += run
+                continue
+
+            if index + 2 > payload_len:
+                raise ValueError("Compressed RTF reference is truncated")
+            token = (payload[index] << 8) | payload[index + 1]
+            index += 2
+            bit += 1
+            offset = token >> 4
+            length = (token & 0xF) + 2
+            write_offset = pos % RTF_DICTIONARY_SIZE
+            if offset == write_offset:
+                # A reference to the current write position marks the end
+                return bytes(out[base:pos])
+
+            source = pos - ((write_offset - offset) % RTF_DICTIONARY_SIZE)
+            if source < 0:
+                raise ValueError("Compressed RTF reference before start of data")
+            distance = pos - source
+            if distance >= length:
+                out[pos : pos + length] = out[source : source + length]
+            else:
+                # Overlapping reference: the pattern repeats every distance bytes
+                pattern = out[source:pos]
+                out[pos : pos + length] = (pattern * (length // distance + 1))[:length]
+            pos += length
+
+    return bytes(out[base : min(pos, target)])
+
+
+def get_rtf_body(tnef, max_size=None):
+    """
+    Return the decompressed RTF body of a TNEF object, or None.
+
+    The raw PR_RTF_COMPRESSED stream is decompressed with decompress_rtf; objects
+    without it (e.g. already decoded bodies) fall back to the rtfbody attribute.
+    """
+    compressed = getattr(tnef, "_rtfbody", None)
+    if compressed:
+        try:
+            return decompress_rtf(compressed, max_size=max_size)
+        except ValueError as e:
+            logger.warning(f"Could not decompress RTF body: {e}")
+            return None
+
+    rtf_body = getattr(tnef, "rtfbody", None)
+    if rtf_body and max_size is not None:
+        return rtf_body[:max_size]
+    return rtf_body
+
+
+def convert_rtf_to_html(rtf_data):
+    """Convert RTF content to HTML"""
+    # For initial implementation, we'll use a simple approach
+    # In a future version, we could integrate a more robust RTF-to-HTML converter
+    if isinstance(rtf_data, bytes):
+        try:
+            rtf_text = rtf_data.decode("utf-8", "ignore")
+        except:
+            return "<pre>RTF content available but could not be converted</pre>"
+    else:
+        rtf_text = str(rtf_data)
+
+    # Very basic RTF cleanup - remove RTF control sequences
+    # This is a minimal implementation - a more robust parser would be better
+    try:
+        # Strip RTF control sequences
+        cleaned_text = re.sub(r"\\[a-z]+[-]?[0-9]*", " ", rtf_text)
+        cleaned_text = re.sub(r"[{}]", "", cleaned_text)
+        cleaned_text = re.sub(r"\\\'[0-9a-f]{2}", "", cleaned_text)
+
+        # Replace line breaks
+        cleaned_text = cleaned_text.replace("\\par", "<br>")
+
+        # Handle HTML entities
+        cleaned_text = (
+            cleaned_text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+        )
+
+        return cleaned_text
+    except:
+        # If conversion fails, return the raw RTF in a pre tag
+        safe_rtf = (
+            rtf_text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+        )
+        return f"<pre>{safe_rtf}</pre>"
+
+
+def format_file_size(size_bytes):
+    """Format file size in a human-readable way"""
+    if size_bytes < 1024:
+        return f"{size_bytes} bytes"
+    elif size_bytes < 1024 * 1024:
+        return f"{size_bytes/1024:.1f} KB"
+    else:
+        return f"{size_bytes/(1024*1024):.1f} MB"
+
+
+# Debounce delays: a file is handed to a worker once it has been quiet this long
+WATCH_SETTLE_SECONDS = 1.0  # after it was created or modified
+WATCH_CLOSE_SECONDS = 0.05  # after its writer closed it (inotify only)
+WATCH_POLL_SECONDS = 1.0
+WATCH_BUSY_SECONDS = 0.01  # how long to wait on busy workers between directory checks
+# Partial uploads and editor temp files are never picked up
+WATCH_IGNORED_PREFIXES = (".", "~")
+WATCH_IGNORED_SUFFIXES = (".tmp", ".part", ".partial", ".crdownload", ".swp")
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def load_inotify():
+    """Return libc if it provides inotify (Linux), otherwise None"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        import ctypes
+
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class DirectoryWatcher:
+    """
+    Reports files dropped into a directory once they are completely written.
+
+    On Linux the directory is watched with inotify, so files are reported a
+    few milliseconds after their writer closes them. Elsewhere, or when
+    inotify is unavailable, the directory is rescanned every poll_interval
+    seconds. Either way a file is only reported after it has stopped changing
+    for settle seconds, so slow copies are not picked up halfway. Files that
+    are already present when watching starts are reported too.
+    """
+
+    def __init__(
+        self,
+        directory,
+        settle=WATCH_SETTLE_SECONDS,
+        poll_interval=WATCH_POLL_SECONDS,
+        use_inotify=None,
+    ):
+        self.directory = directory
+        self.settle = settle
+        self.poll_interval = poll_interval
+        # path -> (deadline, stat signature)
+        self.pending = {}
+        # path -> stat signature of files already reported
+        self.reported = {}
+        self.next_scan = 0
+        self.fd = None
+
+        libc = load_inotify() if use_inotify is not False else None
+        if libc:
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            mask = IN_CREATE | IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO
+            if (
+                fd >= 0
+                and libc.inotify_add_watch(fd, os.fsencode(directory), mask) >= 0
+            ):
+                self.fd = fd
+            elif fd >= 0:
+                os.close(fd)
+        if self.fd is None:
+            logger.debug(f"Polling {directory} every {poll_interval}s")
+        self.scan()
+
+    @property
+    def mode(self):
+        return "inotify" if self.fd is not None else "polling"
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    @staticmethod
+    def is_candidate(name):
+        return not (
+            name.startswith(WATCH_IGNORED_PREFIXES)
+            or name.lower().endswith(WATCH_IGNORED_SUFFIXES)
+        )
+
+    def signature(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path):
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def touch(self, path, delay):
+        """(Re)start the quiet period of path"""
+        signature = self.signature(path)
+        if signature is not None:
+            self.pending[path] = (time.monotonic() + delay, signature)
+
+    def scan(self):
+        """Look for new or changed files by listing the directory"""
+        listed = set()
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file() or not self.is_candidate(entry.name):
+                    continue
+                listed.add(entry.path)
+                signature = self.signature(entry.path)
+                if self.reported.get(entry.path) == signature:
+                    continue
+                previous = self.pending.get(entry.path)
+                if previous is None or previous[1] != signature:
+                    self.pending[entry.path] = (
+                        time.monotonic() + self.settle,
+                        signature,
+                    )
+        self.reported = {
+            path: signature
+            for path, signature in self.reported.items()
+            if path in listed
+        }
+        self.next_scan = time.monotonic() + self.poll_interval
+
+    def read_events(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            name = os.fsdecode(name)
+            if not name or not self.is_candidate(name):
+                continue
+            path = os.path.join(self.directory, name)
+            if mask & IN_MOVED_TO:
+                self.touch(path, 0)  # Renamed into place, so already complete
+            elif mask & IN_CLOSE_WRITE:
+                self.touch(path, WATCH_CLOSE_SECONDS)
+            else:
+                self.touch(path, self.settle)
+
+    def poll(self, timeout=None):
+        """
+        Wait up to timeout seconds and return the paths of files that are ready.
+
+        Returns as soon as at least one file is ready.
+        """
+        end = time.monotonic() + (timeout if timeout is not None else 1e9)
+        while True:
+            if self.fd is not None:
+                self.read_events()
+            elif time.monotonic() >= self.next_scan:
+                self.scan()
+
+            now = time.monotonic()
+            ready = [path for path, (due, _) in self.pending.items() if due <= now]
+            ready = self.collect(ready)
+            if ready:
+                return ready
+            if now >= end:
+                return []
+
+            wake = min([end] + [due for due, _ in self.pending.values()])
+            if self.fd is not None:
+                select.select([self.fd], [], [], max(0, wake - now))
+            else:
+                time.sleep(max(0, min(wake, self.next_scan) - now))
+
+    def collect(self, paths):
+        ready = []
+        for path in paths:
+            _, signature = self.pending.pop(path)
+            current = self.signature(path)
+            if current is None:
+                continue  # Removed or renamed before it settled
+            if current != signature:
+                # Still being written; wait for it to settle again
+                self.pending[path] = (time.monotonic() + self.settle, current)
+                continue
+            if self.fd is None:
+                # Rescans must not report a file again while it is unchanged
+                self.reported[path] = signature
+            ready.append(path)
+        return sorted(ready)
+
+
+class ConnectionLogHandler(logging.handlers.QueueHandler):
+    """
+    Sends the log records of a worker process to the parent over the worker's
+    own pipe, as ("log", record) messages between the replies to its jobs.
+    """
+
+    def __init__(self, conn):
+        super().__init__(None)
+        self.conn = conn
+
+    def send(self, message):
+        # Attachment writer threads log while the main thread replies
+        with self.lock:
+            self.conn.send(message)
+
+    def enqueue(self, record):
+        self.send(("log", record))
+
+
+def apply_memory_limit(limit):
+    """
+    Cap the address space of the current process at limit bytes.
+
+    Allocations beyond the cap raise MemoryError instead of exhausting the
+    machine. Returns False where resource limits are unavailable or not
+    enforced (e.g. Windows).
+    """
+    try:
+        import resource
+
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, AttributeError, ValueError, OSError) as e:
+        logger.warning(f"Could not limit worker memory to {limit} bytes: {e}")
+        return False
+    return True
+
+
+# Metrics key recorded by extract_winmail_dat when an allocation failed
+MEMORY_ERROR_KEY = ("winmail_opener_failures_total", (("reason", "MemoryError"),))
+
+
+def worker_main(
+    conn,
+    log_level,
+    memory_limit,
+    renderer_format,
+    renderer_options,
+    extract_options,
+):
+    """
+    Serve extraction requests in a worker process.
+
+    The renderer is built once, when the worker starts, and stays warm for
+    every later file. Log records go back to the parent over conn, which
+    then cannot be disturbed by another worker being killed. Each reply carries the result, the metrics recorded for the file (which
+    the parent merges into its own registry), the VEVENTs of meeting
+    requests for a combined calendar, and whether the worker is exiting
+    because the file exhausted its memory limit.
+    """
+    import signal
+
+    # Ctrl-C is handled by the parent, which shuts the pool down cleanly
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    log_handler = ConnectionLogHandler(conn)
+    root.addHandler(log_handler)
+    root.setLevel(log_level)
+    METRICS.drain()  # Forked workers start with a copy of the parent's metrics
+    # Keep lines whole when several workers share the console
+    if hasattr(sys.stdout, "reconfigure"):
+        sys.stdout.reconfigure(line_buffering=True)
+    if memory_limit:
+        apply_memory_limit(memory_limit)
+    renderer = get_renderer(renderer_format, **renderer_options)
+    launcher = NullLauncher()
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        source, view_file = job
+        calendar = CalendarWriter(io.StringIO(), header=False)
+        result = extract_winmail_dat(
+            source,
+            renderer=renderer,
+            launcher=launcher,
+            view_file=view_file,
+            calendar=calendar,
+            **extract_options,
+        )
+        metrics = METRICS.drain()
+        # A process that ran out of memory may be in a bad state; start afresh
+        exhausted = MEMORY_ERROR_KEY in metrics[0]
+        events = (calendar.out.getvalue(), calendar.count)
+        log_handler.send(("result", (result, metrics, events, exhausted)))
+        if exhausted:
+            return
+
+
+class WorkerPool:
+    """
+    A pool of warm extraction processes fed one file at a time.
+
+    Worker processes are started up front and reused, so a file never pays
+    for interpreter startup or module imports. Jobs wait in the parent until
+    a worker is idle; results() collects whatever has finished.
+
+    A file that takes longer than timeout seconds has its worker killed, and
+    memory_limit caps each worker's address space so a decompression bomb
+    fails with MemoryError instead of exhausting the machine. Either way, and
+    when a worker dies, the worker is replaced, the file is reported as
+    failed, and the other workers carry on. calendar, a CalendarWriter,
+    receives the meeting requests extracted by the workers.
+    """
+
+    def __init__(
+        self,
+        workers=None,
+        renderer_format="html",
+        renderer_options=None,
+        timeout=None,
+        memory_limit=None,
+        calendar=None,
+        **options,
+    ):
+        self.context = multiprocessing.get_context()
+        self.extension = RENDERERS[renderer_format].extension
+        self.timeout = timeout
+        self.calendar = calendar
+        self.worker_args = (
+            logging.getLogger().level,
+            memory_limit,
+            renderer_format,
+            renderer_options or {},
+            options,
+        )
+        self.jobs = collections.deque()
+        self.idle = [self.start_worker() for _ in range(workers or os.cpu_count() or 1)]
+        # connection -> (process, path, deadline)
+        self.busy = {}
+
+    def start_worker(self):
+        parent_conn, child_conn = self.context.Pipe()
+        process = self.context.Process(
+            target=worker_main,
+            args=(child_conn, *self.worker_args),
+            name="winmail-worker",
+            daemon=True,
+        )
+        # Forked workers would print a copy of anything still buffered
+        sys.stdout.flush()
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+
+    def replace_worker(self, process, conn):
+        """Stop a worker that misbehaved and return a fresh one"""
+        conn.close()
+        if process.is_alive():
+            process.kill()
+        process.join()
+        return self.start_worker()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        """Number of files queued or being processed"""
+        return len(self.jobs) + len(self.busy)
+
+    def submit(self, path, view_file=None, source=None):
+        """Queue path; source (e.g. bytes read from stdin) is processed instead"""
+        self.jobs.append((path, source if source is not None else path, view_file))
+        self.dispatch()
+
+    def dispatch(self):
+        while self.idle and self.jobs:
+            process, conn = self.idle.pop()
+            path, source, view_file = self.jobs.popleft()
+            conn.send((source, view_file))
+            deadline = time.monotonic() + self.timeout if self.timeout else None
+            self.busy[conn] = (process, path, deadline)
+
+    def results(self, timeout=None):
+        """
+        Wait up to timeout seconds and return [(path, result, error)] of
+        finished files. result is None and error describes the problem for
+        files that could not be processed.
+        """
+        done = []
+        if self.busy:
+            deadlines = [entry[2] for entry in self.busy.values() if entry[2]]
+            if deadlines:
+                until_deadline = max(0, min(deadlines) - time.monotonic())
+                timeout = (
+                    until_deadline if timeout is None else min(timeout, until_deadline)
+                )
+            for conn in multiprocessing.connection.wait(list(self.busy), timeout):
+                try:
+                    reply = self.receive(conn)
+                except (EOFError, OSError):
+                    reply = None
+                else:
+                    if reply is None:
+                        continue  # Only log records so far
+                process, path, _ = self.busy.pop(conn)
+                error = None
+                if reply is None:
+                    result = None
+                    error = f"worker exited with code {process.exitcode}"
+                    METRICS.inc("winmail_opener_failures_total", reason="WorkerDied")
+                    process, conn = self.replace_worker(process, conn)
+                else:
+                    result, metrics, events, exhausted = reply
+                    METRICS.merge(metrics)
+                    if self.calendar and events[1]:
+                        self.calendar.write_events(*events)
+                    if exhausted:
+                        error = "exceeded the memory limit"
+                        process, conn = self.replace_worker(process, conn)
+                    elif not result:
+                        error = "could not be processed"
+                self.idle.append((process, conn))
+                done.append((path, result, error))
+
+            now = time.monotonic()
+            for conn, (process, path, deadline) in list(self.busy.items()):
+                if deadline and now >= deadline:
+                    del self.busy[conn]
+                    METRICS.inc("winmail_opener_failures_total", reason="Timeout")
+                    self.idle.append(self.replace_worker(process, conn))
+                    done.append((path, None, f"timed out after {self.timeout}s"))
+
+        for path, result, error in done:
+            if error and result is None and error != "could not be processed":
+                logger.error(f"{path} {error}; worker restarted")
+                print(f"Error: {path} {error}; worker restarted")
+        self.dispatch()
+        return done
+
+    @staticmethod
+    def receive(conn):
+        """
+        Read the messages waiting on a worker's pipe, handing log records to
+        the local loggers. Returns the reply to the worker's job, or None if
+        it has not arrived yet.
+        """
+        while True:
+            kind, payload = conn.recv()
+            if kind == "result":
+                return payload
+            logging.getLogger(payload.name).handle(payload)
+            if not conn.poll():
+                return None
+
+    def close(self):
+        """Stop the workers; files that were not started are dropped"""
+        self.jobs.clear()
+        workers = self.idle + [
+            (process, conn) for conn, (process, _, _) in self.busy.items()
+        ]
+        self.idle, self.busy = [], {}
+        for process, conn in workers:
+            with contextlib.suppress(OSError):
+                conn.send(None)
+            conn.close()
+        for process, _ in workers:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+
+def watch_directory(
+    directory,
+    pool,
+    settle=WATCH_SETTLE_SECONDS,
+    poll_interval=WATCH_POLL_SECONDS,
+    use_inotify=None,
+    stop=None,
+    on_result=None,
+):
+    """
+    Process every winmail.dat file dropped into directory until stop() is true.
+
+    Ready files are sent to the WorkerPool pool. Afterwards each file is
+    moved to the processed/ or failed/ subdirectory, and its message view is
+    written next to it in processed/. on_result(path, result) is called for
+    every file, with result None on failure. Returns the number of files
+    processed.
+    """
+    processed_dir = os.path.join(directory, "processed")
+    failed_dir = os.path.join(directory, "failed")
+    os.makedirs(processed_dir, exist_ok=True)
+    os.makedirs(failed_dir, exist_ok=True)
+    watcher = DirectoryWatcher(directory, settle, poll_interval, use_inotify)
+    print(f"Watching {directory} for winmail.dat files ({watcher.mode})")
+    in_flight = set()
+    count = 0
+    try:
+        while not (stop and stop()):
+            # While files are being processed, alternate between the directory
+            # and the workers; otherwise block on the directory
+            for path in watcher.poll(0 if pool else WATCH_POLL_SECONDS):
+                if path in in_flight:
+                    continue
+                in_flight.add(path)
+                name = os.path.basename(path)
+                pool.submit(path, os.path.join(processed_dir, name + pool.extension))
+            for path, result, error in pool.results(WATCH_BUSY_SECONDS):
+                in_flight.discard(path)
+                count += 1
+                target_dir = processed_dir if result else failed_dir
+                with contextlib.suppress(OSError):
+                    os.replace(path, os.path.join(target_dir, os.path.basename(path)))
+                if result:
+                    print(f"Processed {path}")
+                else:
+                    print(f"Failed to process {path} ({error}); moved to {failed_dir}")
+                if on_result:
+                    on_result(path, result)
+    finally:
+        watcher.close()
+    return count
+
+
+def main():
+    """
+    Main function to parse command-line arguments and call the extract_winmail_dat function.
+    """
+    parser = argparse.ArgumentParser(
+        description="Extract attachments and email body from Winmail.dat files."
+    )  # Create an argument parser
+    parser.add_argument(
+        "winmail_dat_files",
+        nargs="*",
+        help="Path to the Winmail.dat file, or - to read it from standard input. "
+        "Several paths process the files as a batch. 'watch DIR' processes files "
+        "dropped into DIR until interrupted.",
+    )  # Add an argument for the Winmail.dat file paths
+    parser.add_argument(
+        "--file",
+        help="Alternative way to specify the Winmail.dat file path (for use with Open With)",
+    )
+    parser.add_argument(
+        "--dedup-store",
+        help="Keep one copy of each attachment in this directory and hardlink it into the output folder",
+    )
+    parser.add_argument(
+        "--archive",
+        choices=sorted(ARCHIVE_FORMATS),
+        help="Write the attachments and the message view into one zip or tar "
+        "archive per message instead of loose files",
+    )
+    parser.add_argument(
+        "--include",
+        action="append",
+        metavar="PATTERN",
+        help="Only extract attachments matching this file name glob or MIME type "
+        "(e.g. '*.pdf' or 'image/*'); may be repeated",
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        metavar="PATTERN",
+        help="Never extract attachments matching this file name glob or MIME type; "
+        "may be repeated",
+    )
+    parser.add_argument(
+        "--min-size",
+        type=parse_size,
+        metavar="SIZE",
+        help="Skip attachments smaller than SIZE (e.g. 10K)",
+    )
+    parser.add_argument(
+        "--max-size",
+        type=parse_size,
+        metavar="SIZE",
+        help="Skip attachments larger than SIZE (e.g. 25M)",
+    )
+    parser.add_argument(
+        "--format",
+        choices=sorted(RENDERERS),
+        default="html",
+        help="Output format of the message view (default: html)",
+    )
+    parser.add_argument(
+        "--template",
+        metavar="FILE",
+        help="HTML template for the message view, using {{ title }}, {{ css }}, "
+        "{{ metadata }}, {{ body }}, {{ attachments }} and {{ version }} placeholders",
+    )
+    parser.add_argument(
+        "--css",
+        metavar="FILE",
+        help="Stylesheet that replaces the built-in CSS of the HTML view",
+    )
+    parser.add_argument(
+        "--allow-remote-images",
+        action="store_true",
+        help="Load remote images in HTML bodies (blocked by default to stop tracking)",
+    )
+    parser.add_argument(
+        "--launcher",
+        choices=["auto", "none", *sorted(name for name in LAUNCHERS if name != "none")],
+        default="auto",
+        help="How to open the message view (or the index page of a batch): "
+        "auto (default), none (headless), open or xdg-open",
+    )
+    parser.add_argument(
+        "--launch-command",
+        metavar="CMD",
+        help='Custom viewer command; "{}" is replaced with the path of the view',
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        metavar="N",
+        help="Worker processes for watch mode and batches (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        metavar="SECONDS",
+        help="Give up on a file after this long and restart its worker "
+        "(watch mode and batches)",
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=parse_size,
+        metavar="SIZE",
+        help="Limit the memory of each worker process (e.g. 512M); files that "
+        "exceed it fail and the worker is restarted (watch mode and batches)",
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=WATCH_SETTLE_SECONDS,
+        metavar="SECONDS",
+        help="Watch mode: wait until a new file has not changed for this long "
+        f"(default: {WATCH_SETTLE_SECONDS})",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=WATCH_POLL_SECONDS,
+        metavar="SECONDS",
+        help="Watch mode: rescan interval when inotify is not available "
+        f"(default: {WATCH_POLL_SECONDS})",
+    )
+    parser.add_argument(
+        "--preview",
+        type=int,
+        nargs="?",
+        const=200,
+        metavar="CHARS",
+        help="Print the first CHARS characters of the body (default 200) instead of extracting",
+    )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="Print the time spent in each extraction stage",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="Write cProfile statistics for the extraction to FILE (view with pstats)",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        metavar="PATH",
+        help="Write Prometheus metrics to PATH (textfile collector format) after each file",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        metavar="PORT",
+        help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics while running",
+    )
+    parser.add_argument(
+        "--log-level",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+        type=str.upper,
+        help=f"Log verbosity (default: $WINMAIL_OPENER_LOG_LEVEL or {DEFAULT_LOG_LEVEL})",
+    )
+    parser.add_argument(
+        "--log-file",
+        help=f"Log file, rotated when it grows large (default: {DEFAULT_LOG_FILE})",
+    )
+    parser.add_argument(
+        "--version", action="version", version=f"winmail_opener {__version__}"
+    )
+
+    # Try to parse args, but don't exit on error
+    parse_error = None
+    try:
+        args, unknown = parser.parse_known_args()
+    except Exception as e:
+        parse_error = e
+        args = None
+
+    configure_logging(
+        level=args.log_level if args else None,
+        log_file=args.log_file if args else None,
+    )
+
+    # Log startup information
+    logger.debug("==========================================")
+    logger.debug(f"Starting winmail_opener.py")
+    logger.debug(f"Working directory: {os.getcwd()}")
+    logger.debug(f"Command line args: {sys.argv}")
+    logger.debug(f"Python version: {sys.version}")
+
+    if args:
+        logger.debug(f"Parsed args: {args}")
+        if unknown:
+            logger.debug(f"Unknown args: {unknown}")
+    else:
+        logger.error(f"Error parsing arguments: {parse_error}")
+
+    # Determine which file paths to use with extensive logging
+    file_paths = []
+
+    # Try different ways to get the file path
+    if args and args.winmail_dat_files:
+        file_paths = list(args.winmail_dat_files)
+        logger.debug(f"Using file paths from positional arguments: {file_paths}")
+    elif args and args.file:
+        file_paths = [args.file]
+        logger.debug(f"Using file path from --file option: {args.file}")
+    elif len(sys.argv) > 1:
+        # This is a fallback in case argparse doesn't work
+        file_paths = [sys.argv[1]]
+        logger.debug(f"Using file path from raw sys.argv[1]: {sys.argv[1]}")
+    else:
+        logger.error("No file path specified in arguments")
+
+    # Try to interpret macOS-specific paths if nothing else worked
+    if not file_paths and len(sys.argv) > 1:
         # macOS might pass file paths with special characters
         try:
             possible_path = sys.argv[1].replace("\\", "")
             if os.path.exists(possible_path):
-                file_path = possible_path
-                logging.debug(f"Found file after path cleanup: {file_path}")
+                file_paths = [possible_path]
+                logger.debug(f"Found file after path cleanup: {possible_path}")
         except Exception as e:
-            logging.error(f"Error processing possible path: {e}")
+            logger.error(f"Error processing possible path: {e}")
 
     # Final validation
-    if not file_path:
+    if not file_paths:
         error_msg = "Error: No Winmail.dat file specified."
-        logging.error(error_msg)
+        logger.error(error_msg)
         print(error_msg)
         parser.print_help()
         return
 
-    # Normalize and verify the file path
-    try:
-        file_path = os.path.abspath(os.path.expanduser(file_path))
-        logging.debug(f"Normalized file path: {file_path}")
-    except Exception as e:
-        logging.error(f"Error normalizing path: {e}")
+    dedup_store = None
+    if args and args.dedup_store:
+        dedup_store = os.path.abspath(os.path.expanduser(args.dedup_store))
+        logger.debug(f"Using attachment deduplication store: {dedup_store}")
+        if args.archive:
+            print("Warning: --dedup-store does not apply to --archive output")
+
+    attachment_filter = None
+    if args and (
+        args.include
+        or args.exclude
+        or args.min_size is not None
+        or args.max_size is not None
+    ):
+        attachment_filter = AttachmentFilter(
+            args.include, args.exclude, args.min_size, args.max_size
+        )
+
+    metrics_file = None
+    if args and args.metrics_file:
+        metrics_file = os.path.abspath(os.path.expanduser(args.metrics_file))
+    if args and args.metrics_port:
+        METRICS.serve(args.metrics_port)
+        print(f"Serving metrics on http://127.0.0.1:{args.metrics_port}/metrics")
 
-    # Make sure file exists
-    if not os.path.isfile(file_path):
-        error_msg = f"Error: File not found: {file_path}"
-        logging.error(error_msg)
+    renderer_options = {}
+    if args and (args.template or args.css or args.allow_remote_images):
+        if args.format != "html":
+            print(
+                "Warning: --template, --css and --allow-remote-images only apply to --format html"
+            )
+        else:
+            renderer_options = {
+                "template": args.template,
+                "css": args.css,
+                "allow_remote_images": args.allow_remote_images,
+            }
+    try:
+        renderer = get_renderer(args.format if args else "html", **renderer_options)
+    except (OSError, ValueError) as e:
+        error_msg = f"Error: Could not load the view template: {e}"
+        logger.error(error_msg)
         print(error_msg)
         return
 
-    # Log file info
     try:
-        file_size = os.path.getsize(file_path)
-        logging.debug(f"File exists, size: {file_size} bytes")
-    except Exception as e:
-        logging.error(f"Error getting file info: {e}")
+        launcher = get_launcher(
+            args.launcher if args else "auto",
+            command=args.launch_command if args else None,
+        )
+    except ValueError as e:
+        error_msg = f"Error: {e}"
+        logger.error(error_msg)
+        print(error_msg)
+        return
 
-    # Process the file
-    try:
-        extract_winmail_dat(
-            file_path
-        )  # Call the extract_winmail_dat function with the file path
-    except Exception as e:
-        logging.exception(f"Unhandled exception in extract_winmail_dat: {e}")
-        print(
-            f"An unexpected error occurred. Please check the log at ~/winmail_opener_debug.log"
+    if args and args.winmail_dat_files and args.winmail_dat_files[0] == "watch":
+        if len(args.winmail_dat_files) != 2 or not os.path.isdir(
+            args.winmail_dat_files[1]
+        ):
+            error_msg = "Error: Usage: winmail_opener.py watch DIR [options]"
+            logger.error(error_msg)
+            print(error_msg)
+            return
+        directory = os.path.abspath(os.path.expanduser(args.winmail_dat_files[1]))
+
+        def on_result(path, result):
+            if metrics_file:
+                METRICS.write_textfile(metrics_file)
+
+        pool = WorkerPool(
+            args.workers,
+            renderer_format=args.format,
+            renderer_options=renderer_options,
+            timeout=args.timeout,
+            memory_limit=args.max_memory,
+            dedup_store=dedup_store,
+            archive=args.archive,
+            attachment_filter=attachment_filter,
+        )
+        # Service managers stop daemons with SIGTERM; shut the pool down cleanly
+        import signal
+
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        with pool:
+            try:
+                watch_directory(
+                    directory,
+                    pool,
+                    settle=args.settle,
+                    poll_interval=args.poll_interval,
+                    on_result=on_result,
+                )
+            except KeyboardInterrupt:
+                print("Stopped watching")
+        return
+
+    profiler = None
+    if args and args.profile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+
+    # Batches get one index page instead of a viewer per message
+    batch_index = None
+    batch_calendar = None
+    if len(file_paths) > 1:
+        logger.debug(f"Batch mode: processing {len(file_paths)} files")
+        if not (args and args.preview is not None):
+            batch_index = BatchIndex(
+                tempfile.mkdtemp(prefix="winmail_batch_"),
+                css=getattr(renderer, "css", DEFAULT_CSS),
+            )
+            # Meeting requests of the whole batch are streamed into one calendar
+            calendar_path = os.path.join(batch_index.directory, "calendar.ics")
+            calendar_file = open(calendar_path, "w", encoding="utf-8", newline="")
+            batch_calendar = CalendarWriter(calendar_file)
+
+    # Worker processes enforce --timeout and --max-memory, so one malformed
+    # file cannot stall or take down the rest of the batch
+    batch_pool = None
+    if batch_index and args and (args.workers or args.timeout or args.max_memory):
+        batch_pool = WorkerPool(
+            args.workers,
+            renderer_format=args.format,
+            renderer_options=renderer_options,
+            timeout=args.timeout,
+            memory_limit=args.max_memory,
+            calendar=batch_calendar,
+            dedup_store=dedup_store,
+            archive=args.archive,
+            attachment_filter=attachment_filter,
         )
 
+    def add_pool_results(results):
+        for path, result, error in results:
+            batch_index.add(path, result, error)
+            if result and args.timings:
+                timer = StageTimer()
+                timer.timings = result["timings"]
+                print(f"{os.path.basename(path)}: {timer.format_report()}")
+            if metrics_file:
+                METRICS.write_textfile(metrics_file)
+
+    for position, file_path in enumerate(file_paths, 1):
+        if file_path == "-":
+            # Read the winmail.dat bytes from standard input, without a temp file
+            source = sys.stdin.buffer
+        else:
+            # Normalize and verify the file path
+            try:
+                file_path = os.path.abspath(os.path.expanduser(file_path))
+                logger.debug(f"Normalized file path: {file_path}")
+            except Exception as e:
+                logger.error(f"Error normalizing path: {e}")
+
+            # Make sure file exists
+            if not os.path.isfile(file_path):
+                error_msg = f"Error: File not found: {file_path}"
+                logger.error(error_msg)
+                print(error_msg)
+                METRICS.inc("winmail_opener_failures_total", reason="FileNotFoundError")
+                if batch_index:
+                    batch_index.add(file_path, None)
+                continue
+
+            # Log file info
+            try:
+                file_size = os.path.getsize(file_path)
+                logger.debug(f"File exists, size: {file_size} bytes")
+            except Exception as e:
+                logger.error(f"Error getting file info: {e}")
+            source = file_path
+
+        if args and args.preview is not None:
+            # Preview mode: print the start of the body without extracting
+            try:
+                text = preview(source, args.preview)
+            except Exception as e:
+                logger.error(f"Could not preview {file_path}: {e}")
+                print(f"Error: Could not preview {file_path}: {e}")
+                METRICS.inc("winmail_opener_failures_total", reason=type(e).__name__)
+                continue
+            if len(file_paths) > 1:
+                print(f"{os.path.basename(file_path)}: {text}")
+            else:
+                print(text)
+            continue
+
+        if batch_pool is not None:
+            batch_pool.submit(
+                file_path,
+                batch_index.view_path(file_path, renderer.extension, position),
+                source=source if is_path(source) else source.read(),
+            )
+            add_pool_results(batch_pool.results(0))
+            continue
+
+        # Process the file
+        timer = StageTimer()
+        result = None
+        try:
+            if profiler:
+                profiler.enable()
+            result = extract_winmail_dat(
+                source,
+                dedup_store=dedup_store,
+                timer=timer,
+                renderer=renderer,
+                launcher=NullLauncher() if batch_index else launcher,
+                archive=args.archive if args else None,
+                calendar=batch_calendar,
+                attachment_filter=attachment_filter,
+                view_file=(
+                    batch_index.view_path(file_path, renderer.extension)
+                    if batch_index
+                    else None
+                ),
+            )  # Call the extract_winmail_dat function with the file path
+            if profiler:
+                profiler.disable()
+
+            if result:
+                logger.debug(f"Stage timings: {result['timings']}")
+                if args and args.timings:
+                    print(timer.format_report())
+        except Exception as e:
+            logger.exception(f"Unhandled exception in extract_winmail_dat: {e}")
+            print(
+                f"An unexpected error occurred. Please check the log at ~/winmail_opener_debug.log"
+            )
+        if batch_index:
+            batch_index.add(file_path, result)
+
+        if metrics_file:
+            METRICS.write_textfile(metrics_file)
+
+    if batch_pool is not None:
+        with batch_pool:
+            while batch_pool:
+                add_pool_results(batch_pool.results())
+
+    if batch_calendar:
+        batch_calendar.close()
+        calendar_file.close()
+        if batch_calendar.count:
+            batch_index.add_link(
+                f"Combined calendar ({batch_calendar.count} meetings)", calendar_path
+            )
+            print(f"Combined calendar written to: {calendar_path}")
+        else:
+            os.remove(calendar_path)
+
+    if batch_index:
+        index_path = batch_index.close()
+        print(f"Batch index written to: {index_path}")
+        if launcher.launch(index_path):
+            print("Opened batch index in browser")
+
+    if metrics_file:
+        METRICS.write_textfile(metrics_file)
+        logger.debug(f"Metrics written to {metrics_file}")
+
+    if profiler:
+        profile_path = os.path.abspath(os.path.expanduser(args.profile))
+        profiler.dump_stats(profile_path)
+        print(f"Profile written to {profile_path}")
+
 
 if __name__ == "__main__":
     main()  # Call the main function if the script is run directly